@@ -1,584 +1,3128 @@
 import os
-from flask import Flask, render_template, request, jsonify
-import requests  # For API calls to Mistral
-from pdf2image import convert_from_bytes
-import pytesseract
-from PIL import Image
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import functools
+import sqlite3
+import unicodedata
+import tempfile
+import bisect
+import threading
+import contextvars
+import multiprocessing
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, Response, g, make_response, render_template, request, jsonify
+from email.utils import parsedate_to_datetime
 import io
-import fitz  # PyMuPDF
+# requests, PyMuPDF (fitz), Pillow and pytesseract are imported where they are first used, so
+# processes that only serve text chat never load the PDF and OCR stacks; see warm_up()
 
 app = Flask(__name__)
 
 # Mistral AI API configuration
-MISTRAL_API_KEY = "your_api_key"  # Replace with your actual API key
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
-
-def call_mistral_api(prompt, model="mistral-large-latest"):
-    """Call Mistral AI API with the provided prompt."""
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
+MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY", "your_api_key")  # Replace with your actual API key
+MISTRAL_API_URL = os.environ.get("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
+
+# Mistral HTTP client tuning: keep-alive pool, timeouts and retry policy
+MISTRAL_POOL_CONNECTIONS = int(os.environ.get("MISTRAL_POOL_CONNECTIONS", 4))
+MISTRAL_POOL_MAXSIZE = int(os.environ.get("MISTRAL_POOL_MAXSIZE", 32))
+MISTRAL_CONNECT_TIMEOUT = float(os.environ.get("MISTRAL_CONNECT_TIMEOUT", 5))
+MISTRAL_READ_TIMEOUT = float(os.environ.get("MISTRAL_READ_TIMEOUT", 60))
+MISTRAL_MAX_RETRIES = int(os.environ.get("MISTRAL_MAX_RETRIES", 3))
+MISTRAL_BACKOFF_BASE = float(os.environ.get("MISTRAL_BACKOFF_BASE", 0.5))
+MISTRAL_BACKOFF_MAX = float(os.environ.get("MISTRAL_BACKOFF_MAX", 8))
+MISTRAL_MAX_RETRY_WAIT = float(os.environ.get("MISTRAL_MAX_RETRY_WAIT", 30))  # Give up on longer Retry-After
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MISTRAL_TEMPERATURE = float(os.environ.get("MISTRAL_TEMPERATURE", 0.7))
+
+# Model routing: short general questions go to the small tier, document analysis and long prompts
+# to the large one, a tier whose recent calls mostly fail is skipped, and short questions also go
+# large while the small tier is answering them much slower than the large one. MISTRAL_MODEL_URLS can
+# point a model at its own Mistral-compatible endpoint, e.g. '{"mistral-small-latest": "http://..."}'
+MISTRAL_SMALL_MODEL = os.environ.get("MISTRAL_SMALL_MODEL", "mistral-small-latest")
+MISTRAL_LARGE_MODEL = os.environ.get("MISTRAL_LARGE_MODEL", "mistral-large-latest")
+MISTRAL_MODEL_URLS = json.loads(os.environ.get("MISTRAL_MODEL_URLS", "{}"))
+ROUTER_SMALL_QUERY_TYPES = set(os.environ.get("ROUTER_SMALL_QUERY_TYPES", "general").split(","))
+ROUTER_SMALL_MAX_PROMPT_TOKENS = int(os.environ.get("ROUTER_SMALL_MAX_PROMPT_TOKENS", 1000))
+ROUTER_STATS_SECONDS = float(os.environ.get("ROUTER_STATS_SECONDS", 300))  # Routing forgets older calls
+ROUTER_MIN_SAMPLES = int(os.environ.get("ROUTER_MIN_SAMPLES", 5))
+ROUTER_MAX_ERROR_RATE = float(os.environ.get("ROUTER_MAX_ERROR_RATE", 0.5))
+ROUTER_SLOW_RATIO = float(os.environ.get("ROUTER_SLOW_RATIO", 2.0))  # Small p95 over this times large's is too slow
+
+# Hedged requests: a call still unanswered after the recent p95 latency of similar calls (same
+# model, max_tokens and prompt size; the first token for streams) gets a second, identical
+# request, and whichever answers first is used. Calls without HEDGE_MIN_SAMPLES similar samples
+# are not hedged, and at most HEDGE_MAX_FRACTION of calls are
+HEDGE_REQUESTS = os.environ.get("HEDGE_REQUESTS", "1").lower() in ("1", "true", "yes")
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", 0.25))
+HEDGE_MAX_DELAY = float(os.environ.get("HEDGE_MAX_DELAY", 10))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))
+HEDGE_MAX_FRACTION = float(os.environ.get("HEDGE_MAX_FRACTION", 0.05))
+
+_mistral_session = None
+_mistral_session_lock = threading.Lock()
+
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10MB upload limit
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + 1024 * 1024  # The upload plus the form fields around it
+UPLOAD_CHUNK_BYTES = 1024 * 1024  # Uploads are copied to disk this much at a time
+
+# Applied here rather than under __main__, so gunicorn and test clients get it too; the batch
+# route raises it per request
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
+
+# Extraction cache configuration (keyed by a hash of the uploaded bytes)
+CACHE_ROOT = os.environ.get("LEXIMED_CACHE_DIR", os.path.join(tempfile.gettempdir(), "leximed-cache"))
+EXTRACTION_CACHE_MEMORY_ITEMS = int(os.environ.get("EXTRACTION_CACHE_MEMORY_ITEMS", 128))
+EXTRACTION_CACHE_DISK_BYTES = int(os.environ.get("EXTRACTION_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+
+class TwoTierCache:
+    """Text cache with an in-process LRU tier backed by a size-bounded directory on disk."""
+
+    def __init__(self, directory, max_items, max_disk_bytes):
+        self.name = os.path.basename(directory)
+        self.directory = directory
+        self.max_items = max_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None  # Computed lazily on the first write
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".txt")
+
+    def get(self, key):
+        """Return the cached text for key, or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._count("memory_hits")
+                return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = f.read()
+            os.utime(path)  # Mark as recently used for disk eviction
+        except OSError:
+            with self._lock:
+                self._count("misses")
+            return None
+
+        with self._lock:
+            self._count("disk_hits")
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        """Store text under key in both tiers."""
+        with self._lock:
+            self._remember(key, value)
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(value)
+            try:
+                replaced_bytes = os.path.getsize(path)  # A rewritten key frees its old file
+            except OSError:
+                replaced_bytes = 0
+            os.replace(tmp_path, path)  # Atomic so concurrent readers never see partial files
+        except OSError as e:
+            app.logger.warning(f"Could not write cache entry {key}: {str(e)}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_usage()[0]
+            else:
+                self._disk_bytes += os.path.getsize(path) - replaced_bytes
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _count(self, event):
+        self.stats[event] += 1
+        cache_events.inc(1, self.name, event)
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _scan_disk_usage(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".txt"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(root, name)))
+                total += st.st_size
+        return total, entries
+
+    def _evict_disk(self):
+        # Drop least recently used files until we are back under 90% of the limit
+        total, entries = self._scan_disk_usage()
+        target = self.max_disk_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._count("evictions")
+        self._disk_bytes = total
+
+    def snapshot(self):
+        """Return hit/miss counters (whole-server with SHARED_METRICS) and current tier sizes."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_items"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+        stats.update(shared_cache_events(self.name))
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+def thread_local_sqlite(local, path):
+    """Return this thread's connection to the SQLite file at path, opening it on first use."""
+    # sqlite3 connections can't be shared across threads, so keep one per thread
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        local.conn = conn
+    return conn
+
+class MemoryResponseCache:
+    """In-process LLM response cache with TTL expiry and LRU eviction."""
+
+    def __init__(self, max_items, ttl):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+class SQLiteResponseCache:
+    """LLM response cache in a local SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path, max_items, ttl):
+        self.path = path
+        self.max_items = max_items
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def _connect(self):
+        return thread_local_sqlite(self._local, self.path)
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM responses WHERE key = ? AND expires_at > ?",
+                               (key, now)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        return row[0] if row else None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                         (key, value, now + self.ttl, now))
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_items,),
+            )
+
+# Opt-in response cache for repeated prompts: RESPONSE_CACHE_BACKEND is "none", "memory" or "sqlite"
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "none").lower()
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 24 * 3600))
+RESPONSE_CACHE_MAX_ITEMS = int(os.environ.get("RESPONSE_CACHE_MAX_ITEMS", 10000))
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", os.path.join(CACHE_ROOT, "responses.sqlite3"))
+# Sampled answers vary between calls, so they are only cached when explicitly allowed
+RESPONSE_CACHE_ALLOW_SAMPLING = os.environ.get("RESPONSE_CACHE_ALLOW_SAMPLING", "").lower() in ("1", "true", "yes")
+
+def create_response_cache():
+    """Create the configured response cache backend, or None when caching is off."""
+    if RESPONSE_CACHE_BACKEND == "memory":
+        return MemoryResponseCache(RESPONSE_CACHE_MAX_ITEMS, RESPONSE_CACHE_TTL)
+    elif RESPONSE_CACHE_BACKEND == "sqlite":
+        return SQLiteResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_ITEMS, RESPONSE_CACHE_TTL)
+    return None
+
+response_cache = create_response_cache()
+response_cache_stats = {"hits": 0, "misses": 0, "bypassed": 0}
+_response_cache_stats_lock = threading.Lock()
+
+# Uploads are spooled here and opened by path, so no request holds a whole file in memory
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR", os.path.join(CACHE_ROOT, "uploads"))
+
+# Background jobs for long document analysis: submit, poll status, fetch result
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", os.path.join(CACHE_ROOT, "jobs.sqlite3"))
+JOBS_FILES_DIR = os.environ.get("JOBS_FILES_DIR", os.path.join(CACHE_ROOT, "jobs"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_DEPTH = int(os.environ.get("JOB_QUEUE_DEPTH", 32))  # Queued jobs beyond this get 429 with Retry-After
+JOB_ABANDON_SECONDS = float(os.environ.get("JOB_ABANDON_SECONDS", 60))  # Cancel if nobody polls for this long
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", 600))  # Requeue running jobs with no progress
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", 24 * 3600))
+
+# Batch /ask: many documents, one question; each document is extracted and answered on its own thread
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", 100))
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", 200 * 1024 * 1024))  # Whole request, not per file
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", 32))
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", 8))  # Mistral calls in flight per batch
+
+# Conversation sessions keep the transcript and the active document server-side. Once the turns
+# not yet summarized overflow SESSION_HISTORY_TOKENS, the oldest are folded into a running summary
+# in the background, so each prompt carries the summary plus recent turns instead of everything.
+SESSIONS_DB_PATH = os.environ.get("SESSIONS_DB_PATH", os.path.join(CACHE_ROOT, "sessions.sqlite3"))
+SESSION_HISTORY_TOKENS = int(os.environ.get("SESSION_HISTORY_TOKENS", 1500))
+SESSION_SUMMARY_MAX_TOKENS = int(os.environ.get("SESSION_SUMMARY_MAX_TOKENS", 400))
+SESSION_RETENTION_SECONDS = float(os.environ.get("SESSION_RETENTION_SECONDS", 30 * 24 * 3600))
+# Sessions created with save=0 (chat history turned off in the UI) only live while in use
+SESSION_UNSAVED_RETENTION_SECONDS = float(os.environ.get("SESSION_UNSAVED_RETENTION_SECONDS", 3600))
+
+# Optional warm-up when a server starts: WARM_UP=1 loads PyMuPDF, Pillow and the Mistral session
+# in the background; WARM_UP=ocr also starts the OCR pool workers with their engine loaded
+WARM_UP = os.environ.get("WARM_UP", "").lower()
+
+# Per-stage timings, exported on /metrics in the Prometheus text format. With SERVER_TIMING set
+# (or an X-Server-Timing request header) responses also carry a Server-Timing header.
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Multi-worker servers: with SHARED_METRICS set, every worker process adds its metric increments
+# to a local SQLite file every METRICS_FLUSH_SECONDS (and before rendering), so /metrics and
+# /cache/stats on any worker report the whole server. gunicorn.conf.py turns this on.
+SHARED_METRICS = os.environ.get("SHARED_METRICS", "").lower() in ("1", "true", "yes")
+METRICS_DB_PATH = os.environ.get("METRICS_DB_PATH", os.path.join(CACHE_ROOT, "metrics.sqlite3"))
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+
+def _format_labels(labelnames, labels, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """Thread-safe Prometheus-style histogram with one series per label value tuple."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def series(self):
+        """Return {labels: [bucket counts..., sum, count]}."""
+        with self._lock:
+            return {labels: list(values) for labels, values in self._series.items()}
+
+    def render(self, series=None):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        if series is None:
+            series = self.series()
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {values[-1]}")
+            series_labels = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{series_labels} {values[-2]}")
+            lines.append(f"{self.name}_count{series_labels} {values[-1]}")
+        return "\n".join(lines)
+
+class Counter:
+    """Thread-safe Prometheus-style counter with one series per label value tuple."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def total(self):
+        """Sum over every series."""
+        with self._lock:
+            return sum(self._values.values())
+
+    def series(self):
+        """Return {labels: [value]}, the same shape as Histogram.series()."""
+        with self._lock:
+            return {labels: [value] for labels, value in self._values.items()}
+
+    def render(self, series=None):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        if series is None:
+            series = self.series()
+        for labels, (value,) in sorted(series.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return "\n".join(lines)
+
+class MetricsStore:
+    """Whole-server metric totals in a local SQLite file, written to by every worker process.
+
+    Each process adds what its counters and histograms gained since its previous flush, so the
+    totals outlive worker restarts. Admission lanes are gauges, so each process stores its latest
+    lane state instead, and only processes that flushed recently count towards active/waiting.
+    """
+
+    def __init__(self, path, metrics, flush_seconds):
+        self.path = path
+        self.metrics = metrics
+        self.flush_seconds = flush_seconds
+        self.process = f"{os.getpid()}-{os.urandom(4).hex()}"  # PIDs get reused by later workers
+        self.lanes = ()
+        self._flushed = {}  # (metric name, labels) -> values at the last flush
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metric_values ("
+                "name TEXT NOT NULL, labels TEXT NOT NULL, field INTEGER NOT NULL, value, "
+                "PRIMARY KEY (name, labels, field))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS lane_state ("
+                "process TEXT NOT NULL, lane TEXT NOT NULL, active INTEGER, waiting INTEGER, "
+                "rejected TEXT, updated_at REAL, PRIMARY KEY (process, lane))"
+            )
+
+    def _connect(self):
+        return thread_local_sqlite(self._local, self.path)
+
+    def track_lanes(self, lanes):
+        """Report these admission lanes (the asyncio server has its own)."""
+        self.lanes = tuple(lanes)
+
+    def start(self):
+        """Flush from a background thread every flush_seconds; once per process."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+                self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                app.logger.warning(f"Could not flush metrics: {str(e)}")
+
+    def flush(self):
+        """Add this process's increments since the last flush to the totals and store its lane state."""
+        now = time.time()
+        with self._lock:
+            rows = []
+            current = {}
+            for metric in self.metrics:
+                for labels, values in metric.series().items():
+                    previous = self._flushed.get((metric.name, labels)) or [0] * len(values)
+                    rows += [(metric.name, json.dumps(labels), field, value - old)
+                             for field, (value, old) in enumerate(zip(values, previous)) if value != old]
+                    current[(metric.name, labels)] = values
+            lanes = []
+            for lane in self.lanes:
+                snapshot = lane.snapshot()
+                lanes.append((self.process, lane.name, snapshot["active"], snapshot["waiting"],
+                              json.dumps(snapshot["rejected"]), now))
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO metric_values VALUES (?, ?, ?, ?) ON CONFLICT (name, labels, field) "
+                    "DO UPDATE SET value = value + excluded.value", rows)
+                conn.executemany("INSERT OR REPLACE INTO lane_state VALUES (?, ?, ?, ?, ?, ?)", lanes)
+            self._flushed.update(current)
+
+    def totals(self):
+        """Return {metric name: {labels: values}} summed over every process."""
+        totals = {}
+        for name, labels, field, value in self._connect().execute(
+                "SELECT name, labels, field, value FROM metric_values"):
+            values = totals.setdefault(name, {}).setdefault(tuple(json.loads(labels)), [])
+            values.extend([0] * (field + 1 - len(values)))
+            values[field] = value
+        return totals
+
+    def lane_totals(self):
+        """Return {lane name: snapshot} summed over every process, like AdmissionLane.snapshot()."""
+        live_since = time.time() - 3 * self.flush_seconds
+        lanes = {}
+        for row in self._connect().execute("SELECT lane, active, waiting, rejected, updated_at FROM lane_state"):
+            lane = lanes.setdefault(row["lane"], {"active": 0, "waiting": 0, "rejected": {}})
+            if row["updated_at"] >= live_since:
+                lane["active"] += row["active"]
+                lane["waiting"] += row["waiting"]
+            for status, count in json.loads(row["rejected"]).items():
+                lane["rejected"][status] = lane["rejected"].get(status, 0) + count
+        return lanes
+
+stage_seconds = Histogram("leximed_stage_seconds", "Time spent in each processing stage.", ("stage",))
+document_bytes = Counter("leximed_document_bytes_total", "Bytes of documents read, by file kind.", ("kind",))
+document_pages = Counter("leximed_document_pages_total", "PDF pages processed, by text source.", ("source",))
+document_tokens = Counter("leximed_document_tokens_total",
+                          "Estimated document tokens before and after prompt compaction.", ("stage",))
+llm_tokens = Counter("leximed_llm_tokens_total", "Tokens reported in Mistral usage, by kind.", ("kind",))
+llm_seconds = Histogram("leximed_llm_seconds", "Mistral call latency (to the first token for streams), by model.",
+                        ("model", "kind", "outcome"))
+llm_hedges = Counter("leximed_llm_hedges_total", "Hedged Mistral calls, by model and the attempt that won.",
+                     ("model", "winner"))
+cache_events = Counter("leximed_cache_events_total", "Cache hits, misses and evictions, by cache.",
+                       ("cache", "event"))
+METRICS = (stage_seconds, document_bytes, document_pages, document_tokens, llm_tokens, llm_seconds, llm_hedges,
+           cache_events)
+
+shared_metrics = MetricsStore(METRICS_DB_PATH, METRICS, METRICS_FLUSH_SECONDS) if SHARED_METRICS else None
+
+def shared_cache_events(cache):
+    """Return {event: count} for one cache summed over every worker, or {} without SHARED_METRICS."""
+    if shared_metrics is None:
+        return {}
+    shared_metrics.flush()
+    series = shared_metrics.totals().get(cache_events.name, {})
+    return {event: values[0] for (name, event), values in series.items() if name == cache}
+
+# Spans of the request being served, when it asked for a Server-Timing header
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+def record_span(stage, seconds):
+    """Record a finished stage in the stage histogram and the current request's Server-Timing."""
+    stage_seconds.observe(seconds, stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as one stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+def record_llm_usage(usage):
+    """Count the prompt and completion tokens from a Mistral usage object."""
+    if not isinstance(usage, dict):
+        return
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens")
+        if isinstance(tokens, int):
+            llm_tokens.inc(tokens, kind)
+
+def server_timing_header(spans):
+    """Format spans as a Server-Timing header, summing repeated stages such as per-page OCR."""
+    totals = {}
+    for stage, seconds in spans:
+        total, count = totals.get(stage, (0.0, 0))
+        totals[stage] = (total + seconds, count + 1)
+    entries = []
+    for stage, (total, count) in totals.items():
+        entry = f"{stage};dur={total * 1000:.1f}"
+        if count > 1:
+            entry += f';desc="{count}x"'
+        entries.append(entry)
+    return ", ".join(entries)
+
+def render_metrics(lanes=None):
+    """Return every metric, plus the admission lanes' state, in the Prometheus text exposition format.
+
+    With SHARED_METRICS the values are whole-server totals and lanes is ignored in favour of
+    the lanes each process tracks.
+    """
+    if shared_metrics is not None:
+        shared_metrics.flush()
+        totals = shared_metrics.totals()
+        lines = [metric.render(totals.get(metric.name, {})) for metric in METRICS]
+        lanes = shared_metrics.lane_totals()
+    else:
+        lines = [metric.render() for metric in METRICS]
+        lanes = {lane.name: lane.snapshot() for lane in (ADMISSION_LANES if lanes is None else lanes)}
+    for field, kind, help_text in (("active", "gauge", "Requests holding an admission slot."),
+                                   ("waiting", "gauge", "Requests queued for an admission slot.")):
+        lines += [f"# HELP leximed_lane_{field} {help_text}", f"# TYPE leximed_lane_{field} {kind}"]
+        lines += [f'leximed_lane_{field}{{lane="{name}"}} {snapshot[field]}' for name, snapshot in lanes.items()]
+    lines += ["# HELP leximed_lane_rejected_total Requests turned away by admission control.",
+              "# TYPE leximed_lane_rejected_total counter"]
+    lines += [f'leximed_lane_rejected_total{{lane="{name}",status="{status}"}} {count}'
+              for name, snapshot in lanes.items() for status, count in snapshot["rejected"].items()]
+    return "\n".join(lines) + "\n"
+
+# OCR worker pool configuration
+OCR_MAX_WORKERS = int(os.environ.get("OCR_MAX_WORKERS", os.cpu_count() or 1))
+OCR_MAX_CONCURRENT_JOBS = int(os.environ.get("OCR_MAX_CONCURRENT_JOBS", 2))  # Documents OCR'd at once
+OCR_PAGES_PER_TASK = int(os.environ.get("OCR_PAGES_PER_TASK", 4))  # Smaller tasks give finer progress
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+_ocr_job_slots = threading.BoundedSemaphore(OCR_MAX_CONCURRENT_JOBS)
+
+# Admission lanes: text-only questions and uploads (which may need OCR) get separate limits, so
+# a burst of scans can't slow chat down. A full queue is rejected at once with 429; a request
+# that waits longer than the lane's max wait gets 503. Both carry Retry-After. The lane is chosen
+# from the request headers and taken before the body is read, so a rejection costs no upload: a
+# multipart body over UPLOAD_LANE_MIN_BYTES (or of unknown length) goes to the OCR lane.
+UPLOAD_LANE_MIN_BYTES = int(os.environ.get("UPLOAD_LANE_MIN_BYTES", 16 * 1024))
+TEXT_LANE_CONCURRENCY = int(os.environ.get("TEXT_LANE_CONCURRENCY", 32))
+TEXT_LANE_QUEUE_DEPTH = int(os.environ.get("TEXT_LANE_QUEUE_DEPTH", 64))
+TEXT_LANE_MAX_WAIT = float(os.environ.get("TEXT_LANE_MAX_WAIT", 5))
+OCR_LANE_CONCURRENCY = int(os.environ.get("OCR_LANE_CONCURRENCY", OCR_MAX_CONCURRENT_JOBS * 2))
+OCR_LANE_QUEUE_DEPTH = int(os.environ.get("OCR_LANE_QUEUE_DEPTH", 8))
+OCR_LANE_MAX_WAIT = float(os.environ.get("OCR_LANE_MAX_WAIT", 30))
+
+class AdmissionRejected(Exception):
+    """Raised when a lane cannot take a request; carries the HTTP status and Retry-After seconds."""
+
+    def __init__(self, lane, status, retry_after):
+        super().__init__(f"The {lane} lane is overloaded.")
+        self.lane = lane
+        self.status = status
+        self.retry_after = retry_after
+
+class AdmissionLane:
+    """Bounded concurrency with a bounded wait queue in front of it."""
+
+    def __init__(self, name, concurrency, queue_depth, max_wait):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.rejected = {429: 0, 503: 0}
+        self._hold_seconds = 1.0  # Moving average of how long a request keeps its slot
+        self._cond = threading.Condition()
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained, for the Retry-After header."""
+        backlog = self.waiting + 1
+        return max(1, min(60, math.ceil(self._hold_seconds * backlog / self.concurrency)))
+
+    def _reject(self, status):
+        self.rejected[status] += 1
+        raise AdmissionRejected(self.name, status, self.retry_after())
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if needed; returns seconds waited or raises AdmissionRejected."""
+        start = time.perf_counter()
+        with self._cond:
+            if self.active >= self.concurrency:
+                if self.waiting >= self.queue_depth:
+                    self._reject(429)
+                self.waiting += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self.active < self.concurrency, timeout=self.max_wait)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self._reject(503)
+            self.active += 1
+        waited = time.perf_counter() - start
+        record_span(f"{self.name}_lane_wait", waited)
+        return waited
+
+    def release(self, held_seconds):
+        with self._cond:
+            self.active -= 1
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held_seconds
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self):
+        """Hold a slot for the enclosed block."""
+        self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._cond:
+            return {"active": self.active, "waiting": self.waiting, "rejected": dict(self.rejected)}
+
+text_lane = AdmissionLane("text", TEXT_LANE_CONCURRENCY, TEXT_LANE_QUEUE_DEPTH, TEXT_LANE_MAX_WAIT)
+ocr_lane = AdmissionLane("ocr", OCR_LANE_CONCURRENCY, OCR_LANE_QUEUE_DEPTH, OCR_LANE_MAX_WAIT)
+ADMISSION_LANES = (text_lane, ocr_lane)
+
+if shared_metrics is not None:
+    shared_metrics.track_lanes(ADMISSION_LANES)
+    shared_metrics.start()
+
+# Per-page OCR decision: pages with almost no embedded text, or mostly-image pages with
+# only a little text (scans with a typed header), are rasterized and OCR'd individually
+OCR_MIN_PAGE_CHARS = int(os.environ.get("OCR_MIN_PAGE_CHARS", 50))
+OCR_IMAGE_COVERAGE = float(os.environ.get("OCR_IMAGE_COVERAGE", 0.5))
+OCR_SCANNED_PAGE_MAX_CHARS = int(os.environ.get("OCR_SCANNED_PAGE_MAX_CHARS", 300))
+
+# OCR profiles trade accuracy for speed; requests pick one with the ocr_profile form field.
+# dpi renders PDF pages, max_side caps the longest image side (phone photos are downscaled),
+# binarize is the black/white threshold applied after autocontrast (0 keeps grayscale), and
+# psm/oem/lang are passed to Tesseract.
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+OCR_PROFILES = {
+    "fast": {"dpi": int(os.environ.get("OCR_FAST_DPI", 150)), "max_side": 2000, "binarize": 150,
+             "psm": 6, "oem": 1, "lang": OCR_LANG},
+    "accurate": {"dpi": int(os.environ.get("OCR_ACCURATE_DPI", 300)), "max_side": 4000, "binarize": 0,
+                 "psm": 3, "oem": 1, "lang": OCR_LANG},
+}
+OCR_DEFAULT_PROFILE = os.environ.get("OCR_PROFILE", "accurate")
+OCR_BLANK_INK_RATIO = float(os.environ.get("OCR_BLANK_INK_RATIO", 0.002))  # Less dark pixels than this is blank
+
+# OCR engine: "tesserocr" keeps Tesseract loaded in each pool worker and passes images in memory,
+# "pytesseract" runs the tesseract CLI per image; "auto" prefers tesserocr when it is installed
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "auto").lower()
+TESSDATA_PREFIX = os.environ.get("TESSDATA_PREFIX")
+
+_ocr_backend = None
+
+PAGE_BREAK = "\f"  # Separates pages in extracted document text
+
+# Embedded PDF text: "layout" rebuilds each page from PyMuPDF's text blocks in reading order
+# (two-column bands left column first), keeps ruled tables as compact "cell | cell" rows and
+# drops page numbers, running headers/footers and boilerplate already seen on an earlier page;
+# "plain" is PyMuPDF's raw page text
+PDF_TEXT_MODE = os.environ.get("PDF_TEXT_MODE", "layout").lower()
+PDF_MARGIN_RATIO = 0.08  # Top and bottom bands of the page where running headers and footers sit
+PDF_BOILERPLATE_MIN_CHARS = 15  # Shorter body blocks ("Yes", form labels) are kept even when repeated
+PDF_TABLE_MIN_LINES = 4  # find_tables is slow, so it only runs on pages with some vector lines
+PAGE_NUMBER_RE = re.compile(r"^\s*(page\s*)?[-(]?\s*\d+\s*[-)]?\s*((of|/)\s*\d+)?\s*$", re.IGNORECASE)
+# Numbers in a running header/footer that change by design: page counters, print dates and times
+FURNITURE_COUNTER_RE = re.compile(r"\bpage\s*\d+(\s*(of|/)\s*\d+)?|\b\d{1,4}[/.-]\d{1,2}[/.-]\d{1,4}\b|\b\d{1,2}:\d{2}(:\d{2})?\b",
+                                  re.IGNORECASE)
+LIST_ITEM_RE = re.compile(r"^(\d{1,3}(\.\d{1,3})+\.?|\(?\d{1,3}[.)]|\(?[a-zA-Z][.)]|[-*\u2022\u25aa])\s")
+
+# Long documents: anything over DOCUMENT_TOKEN_BUDGET is split into chunks that are summarized
+# concurrently (map) and the summaries are combined into the final prompt (reduce)
+CHARS_PER_TOKEN = 4  # Rough estimate for English prose with Mistral's tokenizer
+DOCUMENT_TOKEN_BUDGET = int(os.environ.get("DOCUMENT_TOKEN_BUDGET", 8000))
+CHUNK_TOKEN_BUDGET = int(os.environ.get("CHUNK_TOKEN_BUDGET", 3000))
+CHUNK_SUMMARY_MAX_TOKENS = int(os.environ.get("CHUNK_SUMMARY_MAX_TOKENS", 400))
+SUMMARY_MAX_CONCURRENCY = int(os.environ.get("SUMMARY_MAX_CONCURRENCY", 4))
+SUMMARY_CACHE_MEMORY_ITEMS = int(os.environ.get("SUMMARY_CACHE_MEMORY_ITEMS", 1024))
+SUMMARY_CACHE_DISK_BYTES = int(os.environ.get("SUMMARY_CACHE_DISK_BYTES", 64 * 1024 * 1024))
+
+# Retrieval over uploaded documents: each upload is indexed once under its document ID and
+# follow-up questions send only the top-k BM25 passages instead of the whole text
+RETRIEVAL_CHUNK_TOKENS = int(os.environ.get("RETRIEVAL_CHUNK_TOKENS", 250))
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", 5))
+INDEX_CACHE_MEMORY_ITEMS = int(os.environ.get("INDEX_CACHE_MEMORY_ITEMS", 16))
+INDEX_CACHE_DISK_BYTES = int(os.environ.get("INDEX_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Prompt compaction: extracted document text is cleaned before it is indexed, summarized or sent
+# to Mistral: Unicode and whitespace normalized, line-break hyphenation undone, OCR noise lines,
+# page numbers and running headers/footers dropped, and near-duplicate paragraphs kept once
+PROMPT_COMPACTION = os.environ.get("PROMPT_COMPACTION", "1").lower() in ("1", "true", "yes")
+COMPACTION_EDGE_LINES = 2  # Lines at the top and bottom of each page checked for headers and footers
+COMPACTION_MIN_ALNUM_RATIO = 0.5  # Lines with a smaller share of letters and digits are OCR noise
+COMPACTION_SHORT_LINE_CHARS = 8  # Lines up to this long are only noise when they have no letter or digit
+NEAR_DUPLICATE_SIMILARITY = float(os.environ.get("NEAR_DUPLICATE_SIMILARITY", 0.8))  # Word-trigram Jaccard
+# Text is NFC-normalized and only these characters are replaced: NFKC would also flatten
+# superscripts, subscripts and vulgar fractions, turning "10^9/L" into "109/L" and "m^2" into "m2"
+COMPACTION_CHAR_MAP = str.maketrans({
+    **{chr(code): chr(code - 0xFEE0) for code in range(0xFF01, 0xFF5F)},  # Full-width ASCII forms
+    "\ufb00": "ff", "\ufb01": "fi", "\ufb02": "fl", "\ufb03": "ffi", "\ufb04": "ffl", "\ufb05": "st", "\ufb06": "st",
+    "\u00a0": " ", "\u2007": " ", "\u202f": " ", "\u3000": " ",  # Non-breaking and ideographic spaces
+    "\u00ad": "",  # Soft hyphens
+})
+
+# Preferred split points, coarsest first: pages, sections/paragraphs, lines, sentences, words
+CHUNK_SEPARATORS = [PAGE_BREAK, "\n\n", "\n", ". ", " "]
+
+extraction_cache = TwoTierCache(
+    os.path.join(CACHE_ROOT, "extraction"),
+    EXTRACTION_CACHE_MEMORY_ITEMS,
+    EXTRACTION_CACHE_DISK_BYTES,
+)
+
+# Serialized BM25 indexes keyed by document ID
+index_cache = TwoTierCache(
+    os.path.join(CACHE_ROOT, "index"),
+    INDEX_CACHE_MEMORY_ITEMS,
+    INDEX_CACHE_DISK_BYTES,
+)
+
+# Chunk summaries are query-independent, so follow-up questions reuse them
+summary_cache = TwoTierCache(
+    os.path.join(CACHE_ROOT, "summaries"),
+    SUMMARY_CACHE_MEMORY_ITEMS,
+    SUMMARY_CACHE_DISK_BYTES,
+)
+
+class MistralAPIError(Exception):
+    """Base class for failures talking to the Mistral API."""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class MistralAuthError(MistralAPIError):
+    """The API key was rejected (401/403)."""
+
+class MistralRateLimitError(MistralAPIError):
+    """Rate limit or quota exceeded (429) and retries were exhausted."""
+
+class MistralServerError(MistralAPIError):
+    """Mistral returned a 5xx response and retries were exhausted."""
+
+class MistralRequestError(MistralAPIError):
+    """Mistral rejected the request itself (other 4xx)."""
+
+class MistralTimeoutError(MistralAPIError):
+    """Connecting to or reading from Mistral timed out."""
+
+class MistralConnectionError(MistralAPIError):
+    """The connection to Mistral failed or dropped."""
+
+class MistralResponseError(MistralAPIError):
+    """Mistral answered with a body we could not parse."""
+
+def get_mistral_session():
+    """Return the shared keep-alive session used for every Mistral call."""
+    global _mistral_session
+    with _mistral_session_lock:
+        if _mistral_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            # Retries are handled in _post_mistral so they can honor Retry-After with jitter
+            adapter = HTTPAdapter(pool_connections=MISTRAL_POOL_CONNECTIONS,
+                                  pool_maxsize=MISTRAL_POOL_MAXSIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Content-Type": "application/json"})
+            _mistral_session = session
+        return _mistral_session
+
+def mistral_url_for(model):
+    """Endpoint serving a model: its MISTRAL_MODEL_URLS entry, or MISTRAL_API_URL."""
+    return MISTRAL_MODEL_URLS.get(model, MISTRAL_API_URL)
+
+def _parse_retry_after(value):
+    """Return the Retry-After header as seconds, accepting both delta-seconds and HTTP dates."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def mistral_error_for_status(status_code, reason, body_text, retry_after_header=None):
+    """Build the typed error for a non-2xx Mistral response."""
+    try:
+        body = json.loads(body_text)
+        detail = (body.get("message") or body.get("detail") or body) if isinstance(body, dict) else body
+    except ValueError:
+        detail = body_text[:200]
+    message = f"{status_code} {reason}: {detail}"
+    retry_after = _parse_retry_after(retry_after_header)
+
+    if status_code in (401, 403):
+        error_class = MistralAuthError
+    elif status_code == 429:
+        error_class = MistralRateLimitError
+    elif status_code >= 500:
+        error_class = MistralServerError
+    else:
+        error_class = MistralRequestError
+    return error_class(message, status_code=status_code, retry_after=retry_after)
+
+def _backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, never sooner than the server's Retry-After."""
+    delay = random.uniform(0, min(MISTRAL_BACKOFF_MAX, MISTRAL_BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def _post_mistral(data, stream=False):
+    """POST a chat completion request, retrying 429/5xx responses and transient network errors."""
+    import requests
+    session = get_mistral_session()
+    headers = {"Authorization": f"Bearer {MISTRAL_API_KEY}"}
+    if stream:
+        headers["Accept"] = "text/event-stream"
+
+    attempt = 0
+    while True:
+        try:
+            response = session.post(mistral_url_for(data["model"]), headers=headers, json=data, stream=stream,
+                                    timeout=(MISTRAL_CONNECT_TIMEOUT, MISTRAL_READ_TIMEOUT))
+        except requests.Timeout as e:
+            error = MistralTimeoutError(f"Request timed out: {str(e)}")
+        except requests.ConnectionError as e:
+            error = MistralConnectionError(f"Connection failed: {str(e)}")
+        else:
+            if response.ok:
+                return response
+            error = mistral_error_for_status(response.status_code, response.reason, response.text,
+                                             response.headers.get("Retry-After"))
+            response.close()
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                raise error
+
+        delay = _backoff_delay(attempt, error.retry_after)
+        if attempt >= MISTRAL_MAX_RETRIES or delay > MISTRAL_MAX_RETRY_WAIT:
+            raise error
+        app.logger.warning(f"Mistral call failed ({str(error)}), retrying in {delay:.2f}s")
+        time.sleep(delay)
+        attempt += 1
+
+def mistral_request_body(prompt, model=None, stream=False, max_tokens=1024, temperature=None):
+    """Build the chat completion request body sent to Mistral (for the large model unless one is given)."""
     data = {
-        "model": model,
+        "model": model or MISTRAL_LARGE_MODEL,
         "messages": [
             {"role": "user", "content": prompt}
         ],
-        "temperature": 0.7,
-        "max_tokens": 1024
+        "temperature": MISTRAL_TEMPERATURE if temperature is None else temperature,
+        "max_tokens": max_tokens
     }
-    
+    if stream:
+        data["stream"] = True
+    return data
+
+def parse_stream_line(line):
+    """Return the content delta carried by one streamed line, "" for no content, or None at [DONE]."""
+    # Mistral streams OpenAI-style "data: {...}" lines terminated by "data: [DONE]"
+    if not line or not line.startswith("data:"):
+        return ""
+    payload = line[len("data:"):].strip()
+    if payload == "[DONE]":
+        return None
+    try:
+        chunk = json.loads(payload)
+        record_llm_usage(chunk.get('usage'))  # Sent with the last chunk
+        return chunk['choices'][0]['delta'].get('content') or ""
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        raise MistralResponseError(f"Unexpected stream chunk from Mistral: {str(e)}")
+
+def _count_response_cache(outcome):
+    with _response_cache_stats_lock:
+        response_cache_stats[outcome] += 1
+    cache_events.inc(1, "responses", outcome)
+
+def cache_stats_snapshot():
+    """Hit/miss statistics of every cache, for /cache/stats."""
+    with _response_cache_stats_lock:
+        responses = dict(response_cache_stats)
+    responses.update(shared_cache_events("responses"))
+    return {
+        "extraction": extraction_cache.snapshot(),
+        "summaries": summary_cache.snapshot(),
+        "index": index_cache.snapshot(),
+        "responses": dict(responses, backend=RESPONSE_CACHE_BACKEND),
+    }
+
+def response_cache_key(data):
+    """Return the response cache key for a request body, or None when it must not be cached."""
+    if response_cache is None:
+        return None
+    if data["temperature"] != 0 and not RESPONSE_CACHE_ALLOW_SAMPLING:
+        _count_response_cache("bypassed")
+        return None
+    # Case, spacing and trailing punctuation don't change the question being asked
+    prompt = " ".join(data["messages"][-1]["content"].split()).casefold().rstrip("?!. ")
+    material = json.dumps([prompt, data["model"], data["temperature"], data["max_tokens"]])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def get_cached_response(key):
+    """Look up a cached answer, counting the hit or miss."""
+    if key is None:
+        return None
+    try:
+        cached = response_cache.get(key)
+    except sqlite3.Error as e:
+        app.logger.warning(f"Response cache lookup failed: {str(e)}")
+        cached = None
+    _count_response_cache("hits" if cached is not None else "misses")
+    return cached
+
+def store_cached_response(key, value):
+    """Store an answer under key; cache write failures never fail the request."""
+    if key is None or not value:
+        return
+    try:
+        response_cache.set(key, value)
+    except sqlite3.Error as e:
+        app.logger.warning(f"Response cache write failed: {str(e)}")
+
+class ModelStats:
+    """Recent Mistral call outcomes per model, within ROUTER_STATS_SECONDS: latency percentiles and error rate.
+
+    Latency is kept per kind ("complete" for whole answers, "stream" for the first token) and
+    latency_bucket(), while errors of either kind count towards the model's health.
+    """
+
+    def __init__(self, window_seconds, max_samples=1000):
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+        self._latencies = {}  # (model, kind, bucket) -> deque of (time, seconds) for successful calls
+        self._outcomes = {}  # model -> deque of (time, ok)
+        self._lock = threading.Lock()
+
+    def _prune(self, samples, now):
+        while samples and samples[0][0] < now - self.window_seconds:
+            samples.popleft()
+
+    def record(self, model, kind, seconds, ok, bucket=None):
+        now = time.monotonic()
+        with self._lock:
+            outcomes = self._outcomes.setdefault(model, deque(maxlen=self.max_samples))
+            outcomes.append((now, ok))
+            if ok:
+                self._latencies.setdefault((model, kind, bucket), deque(maxlen=self.max_samples)).append((now, seconds))
+
+    def latency(self, model, kind, pct, bucket=None, min_samples=1):
+        """Return the pct-th percentile of recent successful call latencies, or None with fewer than min_samples.
+
+        Without a bucket, samples from every bucket are pooled.
+        """
+        now = time.monotonic()
+        ordered = []
+        with self._lock:
+            for (sample_model, sample_kind, sample_bucket), samples in self._latencies.items():
+                if sample_model == model and sample_kind == kind and bucket in (None, sample_bucket):
+                    self._prune(samples, now)
+                    ordered.extend(seconds for _, seconds in samples)
+        if not ordered or len(ordered) < min_samples:
+            return None
+        ordered.sort()
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def error_rate(self, model):
+        """Return (error rate, calls) over the model's recent calls."""
+        with self._lock:
+            outcomes = self._outcomes.get(model)
+            if not outcomes:
+                return 0.0, 0
+            self._prune(outcomes, time.monotonic())
+            calls = len(outcomes)
+            errors = sum(1 for _, ok in outcomes if not ok)
+        return (errors / calls if calls else 0.0), calls
+
+    def healthy(self, model):
+        rate, calls = self.error_rate(model)
+        return calls < ROUTER_MIN_SAMPLES or rate <= ROUTER_MAX_ERROR_RATE
+
+    def snapshot(self):
+        with self._lock:
+            models = sorted(set(self._outcomes) | {model for model, _, _ in self._latencies})
+        result = {}
+        for model in models:
+            rate, calls = self.error_rate(model)
+            result[model] = {
+                "calls": calls,
+                "error_rate": round(rate, 3),
+                "healthy": self.healthy(model),
+                "p50_seconds": self.latency(model, "complete", 50),
+                "p95_seconds": self.latency(model, "complete", 95),
+                "first_token_p95_seconds": self.latency(model, "stream", 95),
+            }
+        return result
+
+model_stats = ModelStats(ROUTER_STATS_SECONDS)
+
+def route_model(query_type, prompt, has_document=False):
+    """Pick the model for a prompt: small for short general questions, large for documents and long prompts.
+
+    A tier whose recent error rate is above ROUTER_MAX_ERROR_RATE is skipped while the other is healthy.
+    A short question also goes to the large tier while the small one's recent p95 for similar prompts
+    is over ROUTER_SLOW_RATIO times the large one's; documents never move to the small tier for speed.
+    """
+    small = (query_type in ROUTER_SMALL_QUERY_TYPES and not has_document
+             and estimate_tokens(prompt) <= ROUTER_SMALL_MAX_PROMPT_TOKENS)
+    preferred, fallback = (MISTRAL_SMALL_MODEL, MISTRAL_LARGE_MODEL) if small else (MISTRAL_LARGE_MODEL, MISTRAL_SMALL_MODEL)
+    if not model_stats.healthy(preferred) and model_stats.healthy(fallback):
+        return fallback
+    if small and model_stats.healthy(fallback):
+        bucket = latency_bucket(mistral_request_body(prompt))
+        small_p95 = model_stats.latency(preferred, "complete", 95, bucket, min_samples=ROUTER_MIN_SAMPLES)
+        large_p95 = model_stats.latency(fallback, "complete", 95, bucket, min_samples=ROUTER_MIN_SAMPLES)
+        # Once skipped the small tier's samples age out after ROUTER_STATS_SECONDS, so it gets retried
+        if small_p95 is not None and large_p95 is not None and small_p95 > ROUTER_SLOW_RATIO * large_p95:
+            return fallback
+    return preferred
+
+def latency_bucket(data):
+    """Group a request body with others of similar latency: same max_tokens, prompt size within 4x."""
+    prompt_tokens = estimate_tokens("".join(message["content"] for message in data["messages"]))
+    size = 256
+    while size < prompt_tokens:
+        size *= 4
+    return f"{data['max_tokens']}/{size}"
+
+def hedge_delay(model, kind, bucket=None):
+    """How long to wait for an attempt before hedging: the recent p95 of similar calls, within the configured bounds.
+
+    Returns None, meaning don't hedge, until there are HEDGE_MIN_SAMPLES similar calls.
+    """
+    p95 = model_stats.latency(model, kind, 95, bucket, min_samples=HEDGE_MIN_SAMPLES)
+    if p95 is None:
+        return None
+    return min(max(p95, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+class HedgeBudget:
+    """Caps hedges at a fraction of calls: every call earns that fraction of a hedge and a hedge spends one."""
+
+    def __init__(self, fraction, max_credit=10):
+        self.fraction = fraction
+        self.max_credit = max_credit  # Hedges allowed in a burst after a quiet spell
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self._credit = min(self.max_credit, self._credit + self.fraction)
+
+    def spend(self):
+        """Take one hedge from the budget; False when it is used up."""
+        with self._lock:
+            if self._credit < 1:
+                return False
+            self._credit -= 1
+            return True
+
+hedge_budget = HedgeBudget(HEDGE_MAX_FRACTION)
+
+def record_llm_call(model, kind, seconds, ok, bucket=None):
+    model_stats.record(model, kind, seconds, ok, bucket)
+    llm_seconds.observe(seconds, model, kind, "ok" if ok else "error")
+
+def _timed_attempt(call, model, kind, bucket):
+    start = time.perf_counter()
+    try:
+        result = call()
+    except Exception:
+        record_llm_call(model, kind, time.perf_counter() - start, False, bucket)
+        raise
+    record_llm_call(model, kind, time.perf_counter() - start, True, bucket)
+    return result
+
+# Hedged attempts run here; a losing request is left to finish in the background. Each attempt
+# takes a slot first, so attempts never queue behind each other: without a free slot a call runs
+# unhedged on the caller's thread, or goes without its hedge
+_hedge_pool_size = MISTRAL_POOL_MAXSIZE * 2
+_hedge_pool = ThreadPoolExecutor(max_workers=_hedge_pool_size, thread_name_prefix="llm-hedge")
+_hedge_slots = threading.BoundedSemaphore(_hedge_pool_size)
+
+def _start_attempt(call, model, kind, bucket):
+    """Run an attempt on the hedge pool, or return None when every pool thread is busy."""
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    future = _hedge_pool.submit(_timed_attempt, call, model, kind, bucket)
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+def _discard_attempt(future, discard):
+    if discard and not future.cancelled() and future.exception() is None:
+        discard(future.result())
+
+def hedged(call, model, kind, bucket=None, discard=None):
+    """Run call() and, if it is still running after hedge_delay(), race a second call() against it.
+
+    Returns the first successful result; a later successful result is passed to discard(). An
+    attempt that fails before the hedge delay is not hedged, since _post_mistral already retried.
+    The hedge is skipped when hedge_budget is spent or the hedge pool is full.
+    """
+    if not HEDGE_REQUESTS:
+        return _timed_attempt(call, model, kind, bucket)
+    hedge_budget.earn()
+    delay = hedge_delay(model, kind, bucket)
+    first = _start_attempt(call, model, kind, bucket) if delay is not None else None
+    if first is None:
+        return _timed_attempt(call, model, kind, bucket)
+    done, _ = wait([first], timeout=delay)
+    if done or not hedge_budget.spend():
+        return first.result()
+
+    second = _start_attempt(call, model, kind, bucket)
+    if second is None:
+        return first.result()
+    pending = {first, second}
+    winner = None
+    errors = []
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                errors.append(future.exception())
+            elif winner is None:
+                winner = future
+            else:
+                _discard_attempt(future, discard)
+    for future in pending:
+        future.add_done_callback(lambda loser: _discard_attempt(loser, discard))
+    if winner is None:
+        raise errors[0]
+    llm_hedges.inc(1, model, "hedge" if winner is second else "first")
+    return winner.result()
+
+def _complete(data):
+    """POST one non-streaming request and return (content, usage)."""
+    response = _post_mistral(data)
     try:
-        response = requests.post(MISTRAL_API_URL, headers=headers, json=data)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        
         result = response.json()
-        return result['choices'][0]['message']['content']
-    except Exception as e:
-        raise Exception(f"Mistral API error: {str(e)}")
+        return result['choices'][0]['message']['content'], result.get('usage')
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise MistralResponseError(f"Unexpected response from Mistral: {str(e)}")
+
+def call_mistral_api(prompt, model=None, max_tokens=1024, temperature=None):
+    """Call Mistral AI API with the provided prompt (on the large model unless one is given)."""
+    data = mistral_request_body(prompt, model, max_tokens=max_tokens, temperature=temperature)
+    cache_key = response_cache_key(data)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        return cached
+    
+    with span("llm"):
+        content, usage = hedged(lambda: _complete(data), data["model"], "complete", latency_bucket(data))
+    record_llm_usage(usage)
+    store_cached_response(cache_key, content)
+    return content
+
+def _open_stream(data):
+    """Start a streamed request and wait for its first content delta.
+
+    Returns (response, deltas) where the deltas generator yields every delta, starting with
+    the one already read. The caller must close the response.
+    """
+    response = _post_mistral(data, stream=True)
+    try:
+        lines = response.iter_lines(decode_unicode=True)
+        first = ""
+        for line in lines:
+            first = parse_stream_line(line)
+            if first != "":
+                break
+    except BaseException:
+        response.close()
+        raise
 
-def extract_text_from_pdf(pdf_bytes):
+    def deltas():
+        if first is None:
+            return
+        if first:
+            yield first
+        for line in lines:
+            delta = parse_stream_line(line)
+            if delta is None:
+                return
+            if delta:
+                yield delta
+        # The connection closed before [DONE], so the answer is incomplete
+        raise MistralConnectionError("Stream ended before the answer was complete")
+    return response, deltas()
+
+def call_mistral_api_stream(prompt, model=None, temperature=None):
+    """Call Mistral AI API with streaming enabled, yielding content deltas as they arrive."""
+    import requests
+    data = mistral_request_body(prompt, model, stream=True, temperature=temperature)
+    cache_key = response_cache_key(data)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        yield cached
+        return
+    
+    # Retries and hedging only happen before the first token; a stream that breaks midway is reported
+    deltas = []
+    start = time.perf_counter()
+    try:
+        response, stream = hedged(lambda: _open_stream(data), data["model"], "stream", latency_bucket(data),
+                                  discard=lambda opened: opened[0].close())
+        with response:
+            for delta in stream:
+                if not deltas:
+                    record_span("llm_first_token", time.perf_counter() - start)
+                deltas.append(delta)
+                yield delta
+    except requests.Timeout as e:
+        raise MistralTimeoutError(f"Stream timed out: {str(e)}")
+    except requests.RequestException as e:
+        raise MistralConnectionError(f"Stream interrupted: {str(e)}")
+    record_span("llm_stream", time.perf_counter() - start)
+    store_cached_response(cache_key, "".join(deltas))
+
+def _image_coverage(page):
+    """Return the fraction of the page area covered by embedded images (capped at 1.0)."""
+    import fitz
+    page_area = abs(page.rect)
+    if not page_area:
+        return 0.0
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(fitz.Rect(info["bbox"]) & page.rect)
+    return min(covered / page_area, 1.0)
+
+def page_needs_ocr(chars, image_coverage):
+    """Decide whether a page whose embedded text has chars characters is too sparse to trust."""
+    if chars < OCR_MIN_PAGE_CHARS:
+        return True
+    return image_coverage >= OCR_IMAGE_COVERAGE and chars < OCR_SCANNED_PAGE_MAX_CHARS
+
+def open_pdf(pdf_source):
+    """Open a PDF from a file path (read lazily by PyMuPDF) or from bytes."""
+    import fitz  # PyMuPDF
+    if isinstance(pdf_source, str):
+        return fitz.open(pdf_source, filetype="pdf")
+    return fitz.open(stream=pdf_source, filetype="pdf")
+
+def furniture_key(text):
+    """Normalize a header/footer candidate: case, spacing, page counters and print dates ignored.
+
+    Any other number must match, so a reading that lands in the margin is never taken for a footer.
+    """
+    return FURNITURE_COUNTER_RE.sub("#", " ".join(text.split()).casefold())
+
+class PageFurniture:
+    """Remembers blocks from earlier pages so running headers, footers and boilerplate are kept once.
+
+    Margin blocks match ignoring page counters and print dates ("Page 3 of 9", "05/01/2024"); body
+    blocks only match when their text is the same. Either way a reading that differs page to page
+    is always kept.
+    """
+
+    def __init__(self):
+        self.seen_margin = set()
+        self.seen_body = set()
+
+    def is_repeat(self, text, in_margin):
+        if in_margin and PAGE_NUMBER_RE.match(text):
+            return True
+        if in_margin:
+            key, seen = furniture_key(text), self.seen_margin
+        else:
+            key, seen = " ".join(text.split()).casefold(), self.seen_body
+            if len(key) < PDF_BOILERPLATE_MIN_CHARS:
+                return False
+        if key in seen:
+            return True
+        seen.add(key)
+        return False
+
+def _unwrap_block(text):
+    """Join a block's layout line breaks, keeping breaks before list items and numbered clauses."""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not lines or LIST_ITEM_RE.match(line):
+            lines.append(line)
+        elif lines[-1].endswith("-") and line[0].islower():
+            lines[-1] = lines[-1][:-1] + line  # Word hyphenated across lines
+        else:
+            lines[-1] += " " + line
+    return "\n".join(lines)
+
+def _reading_order(blocks, page_width):
+    """Order (x0, y0, x1, y1, text) blocks top to bottom, reading two-column bands left column first."""
+    middle = page_width / 2
+    ordered, left, right = [], [], []
+
+    def flush():
+        if len(left) > 1 and len(right) > 1:
+            ordered.extend(left + right)
+        else:
+            # One stray block beside a column (a date, a signature) is not a column layout
+            ordered.extend(sorted(left + right, key=lambda block: (block[1], block[0])))
+        left.clear()
+        right.clear()
+
+    for block in sorted(blocks, key=lambda block: (block[1], block[0])):
+        if block[2] <= middle:
+            left.append(block)
+        elif block[0] >= middle:
+            right.append(block)
+        else:
+            flush()
+            ordered.append(block)
+    flush()
+    return ordered
+
+def _page_tables(page):
+    """Return (bbox, rows) for each ruled table on the page, rows as "cell | cell" lines."""
+    import fitz  # PyMuPDF
+    if sum(len(path["items"]) for path in page.get_cdrawings()) < PDF_TABLE_MIN_LINES:
+        return []
+    tables = []
+    for table in page.find_tables().tables:
+        rows = (" | ".join(" ".join((cell or "").split()) for cell in row) for row in table.extract())
+        rows = "\n".join(row for row in rows if row.strip(" |"))
+        if rows:
+            tables.append((fitz.Rect(table.bbox), rows))
+    return tables
+
+def _layout_page_text(page, furniture):
+    """Rebuild a page's text from its blocks: reading order, tables as rows, furniture dropped.
+
+    Returns (text, embedded characters); the count is taken before furniture is dropped.
+    """
+    import fitz  # PyMuPDF
+    tables = _page_tables(page)
+    top, bottom = page.rect.height * PDF_MARGIN_RATIO, page.rect.height * (1 - PDF_MARGIN_RATIO)
+    blocks = [(bbox.x0, bbox.y0, bbox.x1, bbox.y1, rows) for bbox, rows in tables]
+    embedded_chars = 0
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks", sort=False):
+        if block_type != 0 or not text.strip():
+            continue  # Image blocks
+        embedded_chars += len(text.strip())
+        center = fitz.Point((x0 + x1) / 2, (y0 + y1) / 2)
+        if any(center in bbox for bbox, _ in tables):
+            continue  # Already emitted as table rows
+        if furniture.is_repeat(text, y1 <= top or y0 >= bottom):
+            continue
+        blocks.append((x0, y0, x1, y1, _unwrap_block(text)))
+    return "\n\n".join(block[4] for block in _reading_order(blocks, page.rect.width)), embedded_chars
+
+def iter_pdf_pages(pdf_source, mode=None):
+    """Yield {"text", "needs_ocr"} for each page in turn, so callers never hold more than they keep.
+
+    mode is "layout" or "plain" and defaults to PDF_TEXT_MODE.
+    """
+    layout = (mode or PDF_TEXT_MODE) == "layout"
+    furniture = PageFurniture()
+    with open_pdf(pdf_source) as doc:
+        for page in doc:
+            # OCR is decided on everything embedded, so a short page with a running header and
+            # footer isn't rasterized once they are dropped
+            if layout:
+                text, chars = _layout_page_text(page, furniture)
+            else:
+                text = page.get_text()
+                chars = len(text.strip())
+            yield {"text": text, "needs_ocr": page_needs_ocr(chars, _image_coverage(page))}
+
+def extract_pdf_pages(pdf_source, mode=None):
+    """Extract embedded text per page with PyMuPDF, flagging the pages that need OCR."""
+    return list(iter_pdf_pages(pdf_source, mode))
+
+def extract_text_from_pdf(pdf_source, mode=None):
     """Extract text from PDF using PyMuPDF."""
-    text = ""
     try:
-        # Open the PDF from memory
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        # Extract text from each page
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text += page.get_text()
-        
-        doc.close()  # Properly close the document
-        return text
+        return PAGE_BREAK.join(page["text"] for page in iter_pdf_pages(pdf_source, mode))
     except Exception as e:
         return f"Error extracting text from PDF: {str(e)}"
 
-def extract_text_from_image(image_bytes):
-    """Extract text from image using pytesseract OCR."""
+def get_ocr_profile(name=None):
+    """Return the settings of an OCR profile, or of the default profile when name is None."""
+    return OCR_PROFILES[name or OCR_DEFAULT_PROFILE]
+
+def preprocess_for_ocr(image, profile):
+    """Grayscale, downscale and optionally binarize an image for Tesseract.
+
+    Returns None for a blank page, which is then skipped without running Tesseract.
+    """
+    from PIL import Image, ImageOps
+    if image.mode != "L":
+        image = image.convert("L")
+    if max(image.size) > profile["max_side"]:
+        scale = profile["max_side"] / max(image.size)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    
+    ink = sum(image.histogram()[:128])
+    if ink < OCR_BLANK_INK_RATIO * image.width * image.height:
+        return None
+    
+    if profile["binarize"]:
+        threshold = profile["binarize"]
+        image = ImageOps.autocontrast(image).point(lambda p: 255 if p >= threshold else 0)
+    return image
+
+class PytesseractBackend:
+    """Runs the tesseract CLI once per image; pytesseract passes the image through a temp file."""
+
+    name = "pytesseract"
+
+    def __init__(self):
+        import pytesseract
+        self._pytesseract = pytesseract
+
+    def recognize(self, image, profile):
+        config = f"--psm {profile['psm']} --oem {profile['oem']}"
+        return self._pytesseract.image_to_string(image, lang=profile["lang"], config=config)
+
+class TesserocrBackend:
+    """Keeps a loaded Tesseract API per (lang, oem) and hands it PIL images directly.
+
+    An API instance is not thread-safe, so each instance belongs to one OCR pool worker process.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self._apis = {}
+
+    def _api(self, profile):
+        key = (profile["lang"], profile["oem"])
+        if key not in self._apis:
+            kwargs = {"path": TESSDATA_PREFIX} if TESSDATA_PREFIX else {}
+            self._apis[key] = self._tesserocr.PyTessBaseAPI(lang=profile["lang"], oem=profile["oem"], **kwargs)
+        return self._apis[key]
+
+    def recognize(self, image, profile):
+        api = self._api(profile)
+        api.SetPageSegMode(profile["psm"])
+        api.SetImage(image)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+def create_ocr_backend(name=None):
+    """Create the OCR backend named by OCR_BACKEND ("auto", "tesserocr" or "pytesseract")."""
+    name = name or OCR_BACKEND
+    if name == "pytesseract":
+        return PytesseractBackend()
+    if name == "tesserocr":
+        return TesserocrBackend()
+    if name == "auto":
+        try:
+            return TesserocrBackend()
+        except ImportError:
+            return PytesseractBackend()
+    raise ValueError(f"Unknown OCR backend: {name}")
+
+def get_ocr_backend():
+    """Return this process's OCR backend, creating (and loading) it on first use."""
+    global _ocr_backend
+    if _ocr_backend is None:
+        _ocr_backend = create_ocr_backend()
+    return _ocr_backend
+
+def _init_ocr_worker():
+    """OCR pool initializer: load the engine once per worker instead of on its first page."""
+    backend = get_ocr_backend()
+    if isinstance(backend, TesserocrBackend):
+        try:
+            backend._api(get_ocr_profile())
+        except Exception:
+            pass  # Raising here would break the pool; the first page reports the error instead
+
+def ocr_image(image, profile):
+    """Run the OCR backend on a PIL image with an OCR profile's preprocessing and settings."""
+    image = preprocess_for_ocr(image, profile)
+    if image is None:
+        return ""
+    return get_ocr_backend().recognize(image, profile)
+
+def _ocr_image_source(image_source, profile):
+    """Decode an uploaded image (path or bytes) and OCR it inside a pool worker."""
+    from PIL import Image
+    try:
+        # A path lets PIL decode straight from disk instead of from a second in-memory copy
+        with Image.open(image_source if isinstance(image_source, str) else io.BytesIO(image_source)) as image:
+            # JPEG can decode at a reduced scale, which makes oversized phone photos much cheaper
+            if max(image.size) > profile["max_side"]:
+                scale = profile["max_side"] / max(image.size)
+                image.draft("L", (round(image.width * scale), round(image.height * scale)))
+            return ocr_image(image, profile)
+    except Exception as e:
+        # Same as _ocr_pdf_pages: keep unpicklable exceptions from breaking the pool
+        raise RuntimeError(f"{type(e).__name__}: {str(e)}") from None
+
+def extract_text_from_image(image_source, ocr_profile=None):
+    """Extract text from image with the OCR backend, in the pool where the engine stays loaded."""
+    profile = get_ocr_profile(ocr_profile)
     try:
-        image = Image.open(io.BytesIO(image_bytes))
-        text = pytesseract.image_to_string(image)
-        return text
+        with ocr_slot(), span("ocr_image"):
+            pool = get_ocr_pool()
+            try:
+                return pool.submit(_ocr_image_source, image_source, profile).result()
+            except BrokenProcessPool:
+                reset_ocr_pool(pool)
+                raise
     except Exception as e:
         return f"Error extracting text from image: {str(e)}"
 
-def process_pdf_with_ocr(pdf_bytes):
-    """Process PDF with OCR if regular text extraction yields limited results."""
-    # First try regular text extraction
-    text = extract_text_from_pdf(pdf_bytes)
-    
-    # If extracted text is too short, try OCR
-    if len(text.strip()) < 100 and not text.startswith("Error"):
+@contextmanager
+def ocr_slot():
+    """Hold one of the OCR_MAX_CONCURRENT_JOBS slots, timing the wait as the ocr_queue stage."""
+    start = time.perf_counter()
+    with _ocr_job_slots:
+        record_span("ocr_queue", time.perf_counter() - start)
+        yield
+
+def get_ocr_pool():
+    """Return the shared OCR process pool, creating it on first use."""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            # Spawned workers avoid inheriting Flask threads and open PyMuPDF handles via fork
+            _ocr_pool = ProcessPoolExecutor(
+                max_workers=OCR_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_ocr_worker,
+            )
+        return _ocr_pool
+
+def reset_ocr_pool(broken_pool):
+    """Drop a pool whose workers died so the next OCR job starts a fresh one."""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is broken_pool:
+            _ocr_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+def _ocr_pdf_pages(pdf_source, page_numbers, profile):
+    """Render the given pages (0-based) with PyMuPDF and OCR them inside a pool worker.
+
+    Pages are rasterized one at a time and dropped after recognition, so memory use depends
+    on the page size, not the page count. Returns a (text, seconds) pair per page.
+    """
+    import fitz
+    from PIL import Image
+    texts = []
+    try:
+        with open_pdf(pdf_source) as doc:
+            for page_num in page_numbers:
+                start = time.perf_counter()
+                pix = doc.load_page(page_num).get_pixmap(dpi=profile["dpi"], colorspace=fitz.csGRAY)
+                image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+                del pix  # Release the raw samples before recognition
+                texts.append((ocr_image(image, profile).rstrip(PAGE_BREAK), time.perf_counter() - start))
+                del image
+    except Exception as e:
+        # Some pytesseract exceptions can't be unpickled in the parent and would break the pool
+        raise RuntimeError(f"{type(e).__name__}: {str(e)}") from None
+    return texts
+
+def ocr_pdf_pages(pdf_source, page_numbers, progress=None, ocr_profile=None):
+    """OCR the given pages of a PDF across the process pool, returning texts in the same order.
+
+    Pass a file path where possible: workers then open the file themselves instead of being
+    sent a copy of the document. progress, when given, is called as
+    progress("ocr", pages_done, total_pages) as tasks finish.
+    """
+    if not page_numbers:
+        return []
+    profile = get_ocr_profile(ocr_profile)
+
+    # Contiguous slices so each task opens the document once, small enough to spread the work
+    workers = min(OCR_MAX_WORKERS, len(page_numbers))
+    slice_size = max(1, min(OCR_PAGES_PER_TASK, -(-len(page_numbers) // workers)))
+    slices = [page_numbers[i:i + slice_size] for i in range(0, len(page_numbers), slice_size)]
+
+    # Cap how many documents share the pool so one huge upload can't starve the rest
+    with ocr_slot():
+        pool = get_ocr_pool()
+        futures = {}
         try:
-            # Convert PDF to images
-            images = convert_from_bytes(pdf_bytes)
-            ocr_text = ""
-            
-            # Apply OCR to each page
-            for image in images:
-                ocr_text += pytesseract.image_to_string(image)
-                
-            return ocr_text if ocr_text.strip() else text
-        except Exception as e:
+            for number, pages in enumerate(slices):
+                futures[pool.submit(_ocr_pdf_pages, pdf_source, pages, profile)] = number
+            results = [None] * len(slices)
+            pages_done = 0
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                pages_done += len(slices[futures[future]])
+                if progress:
+                    progress("ocr", pages_done, len(page_numbers))
+        except BrokenProcessPool:
+            reset_ocr_pool(pool)
+            raise
+        finally:
+            # Drop queued slices if we bail out early (error or cancelled job)
+            for future in futures:
+                future.cancel()
+    texts = []
+    for page_results in results:
+        for text, seconds in page_results:
+            record_span("ocr_page", seconds)
+            texts.append(text)
+    return texts
+
+def process_pdf_with_ocr(pdf_source, progress=None, ocr_profile=None):
+    """Extract PDF text, running OCR only on the pages whose embedded text is too sparse."""
+    try:
+        with span("pdf_text"):
+            pages = extract_pdf_pages(pdf_source)
+    except Exception as e:
+        return f"Error extracting text from PDF: {str(e)}"
+
+    ocr_page_numbers = [num for num, page in enumerate(pages) if page["needs_ocr"]]
+    document_pages.inc(len(pages) - len(ocr_page_numbers), "embedded")
+    document_pages.inc(len(ocr_page_numbers), "ocr")
+    try:
+        for num, ocr_text in zip(ocr_page_numbers, ocr_pdf_pages(pdf_source, ocr_page_numbers, progress, ocr_profile)):
+            # Keep the embedded text when OCR finds nothing better
+            if len(ocr_text.strip()) > len(pages[num]["text"].strip()):
+                pages[num]["text"] = ocr_text
+    except JobCancelled:
+        raise
+    except Exception as e:
+        embedded_text = PAGE_BREAK.join(page["text"] for page in pages)
+        if len(embedded_text.strip()) < 100:
             return f"Error processing PDF with OCR: {str(e)}"
-    
+        app.logger.warning(f"OCR failed, using embedded PDF text only: {str(e)}")
+        return embedded_text
+
+    return PAGE_BREAK.join(page["text"] for page in pages)
+
+def document_id_for(file_source):
+    """Return the content address used as the document ID and cache key for an upload."""
+    if not isinstance(file_source, str):
+        return hashlib.sha256(file_source).hexdigest()
+    digest = hashlib.sha256()
+    with open(file_source, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def spool_upload(stream):
+    """Copy an upload stream to a temp file in chunks, hashing it on the way.
+
+    Returns (path, document_id, size). Copying stops one byte past MAX_UPLOAD_BYTES, so an
+    oversized upload is detected without storing it; the caller removes the file.
+    """
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(dir=UPLOAD_SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while size <= MAX_UPLOAD_BYTES:
+                block = stream.read(min(UPLOAD_CHUNK_BYTES, MAX_UPLOAD_BYTES + 1 - size))
+                if not block:
+                    break
+                f.write(block)
+                digest.update(block)
+                size += len(block)
+    except BaseException:
+        remove_file(path)
+        raise
+    return path, digest.hexdigest(), size
+
+def remove_file(path):
+    """Delete a spooled or job file, ignoring files that are already gone."""
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def extract_document_text(file_source, file_kind, document_id=None, progress=None, ocr_profile=None):
+    """Extract text from an uploaded PDF or image (path or bytes), reusing the cached result for identical content."""
+    ocr_profile = ocr_profile or OCR_DEFAULT_PROFILE
+    text_mode = PDF_TEXT_MODE if file_kind == "pdf" else "ocr"
+    key = f"{file_kind}-{text_mode}-{ocr_profile}-{document_id or document_id_for(file_source)}"
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with span("extract"):
+        if file_kind == "pdf":
+            text = process_pdf_with_ocr(file_source, progress, ocr_profile)
+        else:
+            text = extract_text_from_image(file_source, ocr_profile)
+
+    # Never cache failures so a transient error doesn't stick to the document
+    if not text.startswith("Error"):
+        extraction_cache.set(key, text)
     return text
 
+# query type -> (system prompt, document instruction), built once instead of per request
+QUERY_TYPE_PROMPTS = {
+    "medical": (
+        "You are a medical assistant AI. Provide helpful information about medical conditions, treatments, "
+        "and recommendations. Note that your responses should include appropriate disclaimers about "
+        "consulting healthcare professionals.",
+        "Analyze the following medical document and provide insights:",
+    ),
+    "legal": (
+        "You are a legal assistant AI. Provide helpful information about legal concepts, documents, and "
+        "processes. Include appropriate disclaimers about consulting qualified legal professionals for "
+        "specific advice.",
+        "Analyze the following legal document and provide insights:",
+    ),
+}
+GENERAL_PROMPT = "You are a helpful assistant. Please provide information on the following query:"
+
 def get_prompt_for_query_type(query_type, document_text=None):
     """Generate appropriate prompt based on query type."""
-    if query_type == "medical":
-        base_prompt = """You are a medical assistant AI. Provide helpful information about medical conditions, treatments, and recommendations. 
-        Note that your responses should include appropriate disclaimers about consulting healthcare professionals.
-        """
-        if document_text:
-            return base_prompt + f"\n\nAnalyze the following medical document and provide insights: {document_text}"
-        return base_prompt
-    
-    elif query_type == "legal":
-        base_prompt = """You are a legal assistant AI. Provide helpful information about legal concepts, documents, and processes.
-        Include appropriate disclaimers about consulting qualified legal professionals for specific advice.
-        """
-        if document_text:
-            return base_prompt + f"\n\nAnalyze the following legal document and provide insights: {document_text}"
-        return base_prompt
-    
-    return "You are a helpful assistant. Please provide information on the following query:"
+    if query_type not in QUERY_TYPE_PROMPTS:
+        return GENERAL_PROMPT
+    system_prompt, document_instruction = QUERY_TYPE_PROMPTS[query_type]
+    if document_text:
+        return f"{system_prompt}\n\n{document_instruction}\n{document_text}"
+    return system_prompt
 
-def create_templates_directory():
-    # Create templates directory if it doesn't exist
-    import os
-    if not os.path.exists("templates"):
-        os.makedirs("templates")
-        
-    with open("templates/index.html", "w") as f:
-        f.write("""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Medical & Legal Assistant</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-    <style>
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background-color: #f5f8fa;
-            margin: 0;
-            padding: 0;
-        }
-        
-        .chat-container {
-            max-width: 1200px;
-            margin: 30px auto;
-            background: white;
-            border-radius: 15px;
-            box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-            overflow: hidden;
-        }
-        
-        .chat-header {
-            background: linear-gradient(135deg, #4b6cb7, #182848);
-            color: white;
-            padding: 20px;
-            text-align: center;
-        }
-        
-        .chat-messages {
-            height: 400px;
-            overflow-y: auto;
-            padding: 20px;
-            background-color: #f9f9f9;
-        }
-        
-        .message {
-            margin-bottom: 15px;
-            padding: 12px 18px;
-            border-radius: 18px;
-            max-width: 80%;
-            position: relative;
-            line-height: 1.5;
-        }
-        
-        .user-message {
-            background-color: #e3f2fd;
-            color: #0d47a1;
-            margin-left: auto;
-            border-bottom-right-radius: 5px;
-        }
-        
-        .bot-message {
-            background-color: #ffffff;
-            color: #333;
-            border: 1px solid #e0e0e0;
-            border-bottom-left-radius: 5px;
-        }
-        
-        .chat-input {
-            padding: 20px;
-            background-color: #fff;
-            border-top: 1px solid #eaeaea;
-        }
-        
-        .query-type-selector {
-            margin-bottom: 15px;
-        }
-        
-        .file-input-container {
-            margin-bottom: 15px;
-        }
-        
-        .typing-indicator {
-            display: none;
-            padding: 10px;
-            background-color: #f0f0f0;
-            border-radius: 10px;
-            margin-bottom: 10px;
-        }
-        
-        .typing-indicator span {
-            height: 10px;
-            width: 10px;
-            background-color: #333;
-            border-radius: 50%;
-            display: inline-block;
-            margin: 0 2px;
-            animation: bounce 1.2s infinite;
-        }
-        
-        .typing-indicator span:nth-child(2) {
-            animation-delay: 0.2s;
-        }
-        
-        .typing-indicator span:nth-child(3) {
-            animation-delay: 0.4s;
-        }
-        
-        @keyframes bounce {
-            0%, 80%, 100% { transform: translateY(0); }
-            40% { transform: translateY(-10px); }
-        }
-        
-        .disclaimer {
-            font-size: 12px;
-            color: #666;
-            text-align: center;
-            padding: 10px;
-            border-top: 1px solid #eee;
-        }
-        
-        /* Additional features styling */
-        .feature-toggle {
-            margin-bottom: 15px;
-        }
-        
-        .theme-selector {
-            margin-bottom: 15px;
-        }
-        
-        .dark-mode {
-            background-color: #333 !important;
-            color: #f0f0f0 !important;
-        }
-        
-        .dark-mode .chat-container {
-            background-color: #444;
-        }
-        
-        .dark-mode .chat-messages {
-            background-color: #555;
-        }
-        
-        .dark-mode .user-message {
-            background-color: #2c5282;
-            color: #e3f2fd;
-        }
-        
-        .dark-mode .bot-message {
-            background-color: #666;
-            color: #fff;
-            border-color: #777;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="chat-container">
-            <div class="chat-header">
-                <h1>Medical & Legal Assistant</h1>
-                <p>Ask medical or legal questions and upload documents for analysis</p>
-            </div>
-            
-            <div class="row p-3">
-                <div class="col-md-4">
-                    <div class="card mb-3">
-                        <div class="card-header bg-primary text-white">
-                            Settings
-                        </div>
-                        <div class="card-body">
-                            <div class="query-type-selector mb-3">
-                                <label class="form-label">Query Type:</label>
-                                <select id="query-type" class="form-select">
-                                    <option value="medical">Medical</option>
-                                    <option value="legal">Legal</option>
-                                    <option value="general">General</option>
-                                </select>
-                            </div>
-                            
-                            <div class="feature-toggle mb-3">
-                                <label class="form-label">Features:</label>
-                                <div class="form-check">
-                                    <input class="form-check-input" type="checkbox" id="text-to-speech">
-                                    <label class="form-check-label" for="text-to-speech">
-                                        Text-to-Speech
-                                    </label>
-                                </div>
-                                <div class="form-check">
-                                    <input class="form-check-input" type="checkbox" id="enable-history">
-                                    <label class="form-check-label" for="enable-history">
-                                        Save Chat History
-                                    </label>
-                                </div>
-                            </div>
-                            
-                            <div class="theme-selector">
-                                <label class="form-label">Theme:</label>
-                                <select id="theme-selector" class="form-select">
-                                    <option value="light">Light</option>
-                                    <option value="dark">Dark</option>
-                                </select>
-                            </div>
-                            
-                            <button id="clear-chat" class="btn btn-danger w-100 mt-3">Clear Chat</button>
-                        </div>
-                    </div>
-                    
-                    <div class="card">
-                        <div class="card-header bg-info text-white">
-                            Document Upload
-                        </div>
-                        <div class="card-body">
-                            <div class="file-input-container">
-                                <label for="document-upload" class="form-label">Upload PDF or Image:</label>
-                                <input type="file" id="document-upload" class="form-control" accept=".pdf,.jpg,.jpeg,.png">
-                            </div>
-                            <div id="upload-preview" class="mt-2 d-none">
-                                <p class="text-success">Document ready for analysis</p>
-                            </div>
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="col-md-8">
-                    <div class="chat-messages" id="chat-messages">
-                        <div class="message bot-message">
-                            Hello! I'm your medical and legal assistant. You can ask me questions, upload documents for analysis, or both. How can I help you today?
-                        </div>
-                    </div>
-                    
-                    <div class="typing-indicator" id="typing-indicator">
-                        <span></span>
-                        <span></span>
-                        <span></span>
-                    </div>
-                    
-                    <div class="chat-input">
-                        <form id="chat-form">
-                            <div class="input-group">
-                                <input type="text" id="user-input" class="form-control" placeholder="Type your question here...">
-                                <button type="submit" class="btn btn-primary">Send</button>
-                            </div>
-                        </form>
-                    </div>
-                    
-                    <div class="disclaimer">
-                        Disclaimer: This AI assistant provides information for educational purposes only. 
-                        For medical queries, always consult with qualified healthcare professionals. 
-                        For legal matters, consult with licensed attorneys.
-                    </div>
-                </div>
-            </div>
-        </div>
-    </div>
-
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
-    <script>
-        document.addEventListener('DOMContentLoaded', function() {
-            const chatForm = document.getElementById('chat-form');
-            const userInput = document.getElementById('user-input');
-            const chatMessages = document.getElementById('chat-messages');
-            const queryType = document.getElementById('query-type');
-            const documentUpload = document.getElementById('document-upload');
-            const uploadPreview = document.getElementById('upload-preview');
-            const typingIndicator = document.getElementById('typing-indicator');
-            const textToSpeech = document.getElementById('text-to-speech');
-            const enableHistory = document.getElementById('enable-history');
-            const themeSelector = document.getElementById('theme-selector');
-            const clearChatButton = document.getElementById('clear-chat');
-            
-            // Load chat history if enabled
-            if (localStorage.getItem('enableHistory') === 'true') {
-                enableHistory.checked = true;
-                const savedMessages = localStorage.getItem('chatHistory');
-                if (savedMessages) {
-                    chatMessages.innerHTML = savedMessages;
-                    chatMessages.scrollTop = chatMessages.scrollHeight;
-                }
-            }
-            
-            // Theme selector
-            themeSelector.addEventListener('change', function() {
-                if (this.value === 'dark') {
-                    document.body.classList.add('dark-mode');
-                } else {
-                    document.body.classList.remove('dark-mode');
-                }
-            });
-            
-            // Document upload preview
-            documentUpload.addEventListener('change', function() {
-                if (this.files.length > 0) {
-                    uploadPreview.classList.remove('d-none');
-                    uploadPreview.innerHTML = `<p class="text-success">Document ready: ${this.files[0].name}</p>`;
-                } else {
-                    uploadPreview.classList.add('d-none');
-                }
-            });
-            
-            // Clear chat
-            clearChatButton.addEventListener('click', function() {
-                chatMessages.innerHTML = `
-                    <div class="message bot-message">
-                        Hello! I'm your medical and legal assistant. You can ask me questions, upload documents for analysis, or both. How can I help you today?
-                    </div>
-                `;
-                localStorage.removeItem('chatHistory');
-            });
-            
-            // Add message function
-            function addMessage(text, sender) {
-                const messageDiv = document.createElement('div');
-                messageDiv.classList.add('message', sender === 'user' ? 'user-message' : 'bot-message');
-                messageDiv.innerText = text;
-                
-                chatMessages.appendChild(messageDiv);
-                chatMessages.scrollTop = chatMessages.scrollHeight;
-                
-                // Save to local storage if enabled
-                if (enableHistory.checked) {
-                    localStorage.setItem('enableHistory', 'true');
-                    localStorage.setItem('chatHistory', chatMessages.innerHTML);
-                }
-            }
+def estimate_tokens(text):
+    """Cheap token estimate used for budgeting prompts."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def is_ocr_noise(line):
+    """True for Tesseract speckle: lines without a letter or digit, or longer lines that are mostly symbols.
+
+    _drop_ocr_noise() keeps a lone symbol next to a content line all the same.
+    """
+    chars = line.replace(" ", "")
+    alnum = sum(char.isalnum() for char in chars)
+    if alnum == 0:
+        return True
+    # Short lines are often clause markers such as "(a)" or "§ 4(a)", so only longer ones are judged by their mix
+    return len(chars) > COMPACTION_SHORT_LINE_CHARS and alnum < COMPACTION_MIN_ALNUM_RATIO * len(chars)
+
+def _drop_ocr_noise(lines):
+    """Drop OCR noise lines, keeping single symbols such as "+" or "-" directly above or below a content line.
+
+    In lab tables those symbols are results (positive, negative), not speckle; a lone symbol
+    with blank lines around it is still dropped.
+    """
+    kept = []
+    for number, line in enumerate(lines):
+        if line and is_ocr_noise(line):
+            neighbours = [lines[i] for i in (number - 1, number + 1) if 0 <= i < len(lines)]
+            if len(line) > 1 or not any(neighbour and not is_ocr_noise(neighbour) for neighbour in neighbours):
+                continue
+        kept.append(line)
+    return kept
+
+class NearDuplicates:
+    """Finds paragraphs that repeat an earlier one up to OCR errors, via shared word trigrams.
+
+    Paragraphs whose numbers differ are never duplicates, so "30 days" and "60 days" clauses or
+    two lab panels with different results are both kept.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.owners = {}  # trigram -> number of the first paragraph that had it
+        self.sizes = []
+        self.numbers = []
+
+    def seen(self, paragraph):
+        """Return True if paragraph nearly repeats an earlier one; otherwise remember it."""
+        words = re.findall(r"\w+", paragraph.casefold())
+        if len(words) < 3 or len(paragraph) < PDF_BOILERPLATE_MIN_CHARS:
+            return False
+        trigrams = {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+        shared = {}
+        for trigram in trigrams:
+            owner = self.owners.get(trigram)
+            if owner is not None:
+                shared[owner] = shared.get(owner, 0) + 1
+        numbers = re.findall(r"\d+", paragraph)
+        for owner, count in shared.items():
+            if (count / (len(trigrams) + self.sizes[owner] - count) >= self.threshold
+                    and numbers == self.numbers[owner]):
+                return True
+        number = len(self.sizes)
+        self.sizes.append(len(trigrams))
+        self.numbers.append(numbers)
+        for trigram in trigrams:
+            self.owners.setdefault(trigram, number)
+        return False
+
+def _strip_page_edges(lines, seen_edges):
+    """Drop page numbers and running header/footer lines from the first and last lines of a page.
+
+    Only lines standing on their own count as headers or footers, and only when the same text
+    (numbers included) was at an earlier page's edge; the last line of a body paragraph that
+    happens to repeat, or a reading that changes from page to page, is left alone.
+    """
+    content = [number for number, line in enumerate(lines) if line]
+    dropped = set()
+    for number in sorted(set(content[:COMPACTION_EDGE_LINES] + content[-COMPACTION_EDGE_LINES:])):
+        line = lines[number]
+        standalone = all(not lines[i] for i in (number - 1, number + 1) if 0 <= i < len(lines))
+        if PAGE_NUMBER_RE.match(line):
+            dropped.add(number)
+        elif standalone and len(line) >= PDF_BOILERPLATE_MIN_CHARS:
+            key = line.casefold()
+            if key in seen_edges:
+                dropped.add(number)
+            seen_edges.add(key)
+    return [line for number, line in enumerate(lines) if number not in dropped]
 
-            // Chat form submission
-            chatForm.addEventListener('submit', function(e) {
-                e.preventDefault();
-                
-                const userMessage = userInput.value.trim();
-                if (!userMessage) return;
-                
-                // Add user message to chat
-                addMessage(userMessage, 'user');
-                userInput.value = '';
-                
-                // Show typing indicator
-                typingIndicator.style.display = 'block';
-
-                // Prepare form data
-                const formData = new FormData();
-                formData.append('query', userMessage);
-                formData.append('type', queryType.value);
-
-                // Add document if uploaded
-                if (documentUpload.files.length > 0) {
-                    formData.append('document', documentUpload.files[0]);
-                }
-
-                // Send request to server - with timeout and error handling
-                const fetchTimeout = function(url, options, timeout = 30000) {
-                    return Promise.race([
-                        fetch(url, options),
-                        new Promise((_, reject) => 
-                            setTimeout(() => reject(new Error('Request timed out')), timeout)
-                        )
-                    ]);
-                };
-
-                fetchTimeout('/ask', {
-                    method: 'POST',
-                    body: formData
-                }, 60000) // 60 second timeout for large files
-                .then(response => {
-                    if (!response.ok) {
-                        throw new Error(`Server responded with status: ${response.status}`);
-                    }
-                    return response.json();
-                })
-                .then(data => {
-                    // Hide typing indicator
-                    typingIndicator.style.display = 'none';
-                    
-                    // Add bot response to chat
-                    if (data.error) {
-                        addMessage(`Error: ${data.error}`, 'bot');
-                    } else {
-                        addMessage(data.response, 'bot');
-                        
-                        // Text-to-speech if enabled
-                        if (textToSpeech.checked && 'speechSynthesis' in window) {
-                            const speech = new SpeechSynthesisUtterance(data.response);
-                            window.speechSynthesis.speak(speech);
-                        }
-                    }
-                    
-                    // Clear file upload
-                    documentUpload.value = '';
-                    uploadPreview.classList.add('d-none');
-                })
-                .catch(error => {
-                    typingIndicator.style.display = 'none';
-                    addMessage(`Error: Could not connect to the server. ${error.message}`, 'bot');
-                    console.error('Fetch error:', error);
-                });
-            });
-        });
-    </script>
-</body>
-</html>""")
+def compact_document_text(text):
+    """Shrink extracted document text before it reaches the prompt without dropping content.
+
+    Pages stay separated by PAGE_BREAK, so chunking still breaks on page boundaries.
+    """
+    text = unicodedata.normalize("NFC", text).translate(COMPACTION_CHAR_MAP)
+    text = re.sub(r"(\w)-[ \t]*\n[ \t]*([a-z])", r"\1\2", text)  # Words hyphenated across lines
+    seen_edges = set()
+    duplicates = NearDuplicates(NEAR_DUPLICATE_SIMILARITY)
+    pages = []
+    for page in text.split(PAGE_BREAK):
+        lines = [" ".join(line.split()) for line in page.split("\n")]
+        lines = _drop_ocr_noise(lines)
+        lines = _strip_page_edges(lines, seen_edges)
+        paragraphs = re.split(r"\n{2,}", "\n".join(lines).strip("\n"))
+        pages.append("\n\n".join(paragraph for paragraph in paragraphs
+                                  if paragraph and not duplicates.seen(paragraph)))
+    return PAGE_BREAK.join(pages)
+
+def compact_document(document_text):
+    """compact_document_text() when PROMPT_COMPACTION is on, counting tokens before and after."""
+    if not PROMPT_COMPACTION:
+        return document_text
+    compacted = compact_document_text(document_text)
+    before, after = estimate_tokens(document_text), estimate_tokens(compacted)
+    document_tokens.inc(before, "raw")
+    document_tokens.inc(after, "compacted")
+    app.logger.debug(f"Compacted document text from {before} to {after} estimated tokens")
+    return compacted
+
+def _split_to_budget(text, max_chars, separators):
+    """Split text on the coarsest separator that brings every piece under max_chars."""
+    if len(text) <= max_chars:
+        return [text]
+    if not separators:
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+    separator, finer = separators[0], separators[1:]
+    parts = text.split(separator)
+    pieces = []
+    for i, part in enumerate(parts):
+        if i < len(parts) - 1:
+            part += separator  # Keep the boundary so chunks join back to the original text
+        pieces.extend(_split_to_budget(part, max_chars, finer))
+    return pieces
+
+def chunk_document(text, max_tokens=None):
+    """Split document text into chunks of at most max_tokens, breaking on page and section boundaries."""
+    max_chars = (max_tokens or CHUNK_TOKEN_BUDGET) * CHARS_PER_TOKEN
+    chunks = []
+    current = []
+    current_size = 0
+    for piece in _split_to_budget(text, max_chars, CHUNK_SEPARATORS):
+        # Start a new chunk when it would overflow, or at a page break once half full
+        at_page_break = current and current[-1].endswith(PAGE_BREAK) and current_size >= max_chars // 2
+        if current and (current_size + len(piece) > max_chars or at_page_break):
+            chunks.append("".join(current))
+            current, current_size = [], 0
+        current.append(piece)
+        current_size += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def summarize_chunk(chunk, query_type, part, total_parts, llm_slots=None):
+    """Summarize one chunk of a document, reusing the cached summary when the chunk was seen before.
+
+    llm_slots, when given, is held around the Mistral call (see condense_document()).
+    """
+    key = hashlib.sha256(f"{query_type}\0{CHUNK_SUMMARY_MAX_TOKENS}\0{chunk}".encode("utf-8")).hexdigest()
+    cached = summary_cache.get(key)
+    if cached is not None:
+        return cached
+
+    kind = query_type if query_type in ("medical", "legal") else "general"
+    prompt = (
+        f"The following is part {part} of {total_parts} of a {kind} document. "
+        "Summarize it concisely, keeping every fact a reader may ask about later: names, dates, "
+        "amounts, measurements, diagnoses, medications, obligations, deadlines and clause numbers. "
+        f"Do not add commentary.\n\n{chunk}"
+    )
+    with llm_slots or nullcontext():
+        summary = call_mistral_api(prompt, max_tokens=CHUNK_SUMMARY_MAX_TOKENS)
+    summary_cache.set(key, summary)
+    return summary
+
+def condense_document(document_text, query_type, progress=None, llm_slots=None):
+    """Map-reduce a document that exceeds DOCUMENT_TOKEN_BUDGET into combined chunk summaries.
+
+    llm_slots is a context manager (such as a batch's semaphore) each summary call is made in,
+    so they count against the same limit as the calls answering the query.
+    """
+    while estimate_tokens(document_text) > DOCUMENT_TOKEN_BUDGET:
+        chunks = chunk_document(document_text)
+        if len(chunks) <= 1:
+            break  # A single chunk can't shrink further by splitting
+
+        # Map: summarize chunks concurrently; Mistral errors propagate to the caller
+        with ThreadPoolExecutor(max_workers=SUMMARY_MAX_CONCURRENCY) as executor:
+            futures = [executor.submit(summarize_chunk, chunk, query_type, i + 1, len(chunks), llm_slots)
+                       for i, chunk in enumerate(chunks)]
+            try:
+                for done, future in enumerate(as_completed(futures), start=1):
+                    future.result()
+                    if progress:
+                        progress("summarize", done, len(chunks))
+            finally:
+                for future in futures:
+                    future.cancel()
+            summaries = [future.result() for future in futures]
+
+        # Reduce: the combined summaries stand in for the document, condensed again if still too long
+        combined = "\n\n".join(f"[Part {i + 1}/{len(summaries)}] {summary.strip()}"
+                                 for i, summary in enumerate(summaries))
+        if len(combined) >= len(document_text):
+            break  # Summaries stopped shrinking the text
+        document_text = combined
+    return document_text
+
+SEARCH_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i in is it its of on or she that the
+their them they this to was were what when where which who will with you your
+""".split())
+
+def tokenize_for_search(text):
+    """Lowercase word tokens used by the BM25 index, without common stopwords."""
+    return [token for token in re.findall(r"\w+", text.lower()) if token not in SEARCH_STOPWORDS]
+
+class DocumentIndex:
+    """BM25 inverted index over the chunks of one extracted document."""
+
+    def __init__(self, chunks, lengths, postings):
+        self.chunks = chunks
+        self.lengths = lengths
+        self.postings = postings  # term -> [[chunk number, term frequency], ...]
+
+    @classmethod
+    def build(cls, document_text):
+        chunks = chunk_document(document_text, RETRIEVAL_CHUNK_TOKENS)
+        lengths = []
+        postings = {}
+        for number, chunk in enumerate(chunks):
+            counts = {}
+            tokens = tokenize_for_search(chunk)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append([number, count])
+            lengths.append(len(tokens))
+        return cls(chunks, lengths, postings)
+
+    @classmethod
+    def from_json(cls, payload):
+        data = json.loads(payload)
+        return cls(data["chunks"], data["lengths"], data["postings"])
+
+    def to_json(self):
+        return json.dumps({"chunks": self.chunks, "lengths": self.lengths, "postings": self.postings})
+
+    def search(self, query, top_k):
+        """Return the top_k chunk numbers for query, best first."""
+        if not self.chunks:
+            return []
+        average_length = (sum(self.lengths) / len(self.lengths)) or 1.0
+        scores = {}
+        for term in set(tokenize_for_search(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self.chunks) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for number, frequency in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[number] / average_length)
+                scores[number] = scores.get(number, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        ranked = sorted(scores, key=lambda number: (-scores[number], number))
+        if not ranked:
+            # Nothing matched; the start of a document is usually its most informative part
+            ranked = list(range(len(self.chunks)))
+        return ranked[:top_k]
+
+DOCUMENT_ID_RE = re.compile(r"[0-9a-f]{64}")
+
+_loaded_indexes = OrderedDict()  # Parsed indexes for recently queried documents
+_loaded_indexes_lock = threading.Lock()
+
+def index_key(document_id, ocr_profile=None):
+    """Cache key of a document's index, which like the extraction cache differs per text mode and OCR profile."""
+    # Retrieval requests don't say what kind of file the ID came from, so PDF_TEXT_MODE is part of every key
+    return f"{PDF_TEXT_MODE}-{ocr_profile or OCR_DEFAULT_PROFILE}-{document_id}"
+
+def index_document(document_id, document_text, ocr_profile=None):
+    """Build and store the retrieval index for a document unless it already exists."""
+    key = index_key(document_id, ocr_profile)
+    if index_cache.get(key) is None:
+        index_cache.set(key, DocumentIndex.build(document_text).to_json())
+
+def load_document_index(document_id, ocr_profile=None):
+    """Return the DocumentIndex for document_id, or None if the document was never indexed.
+
+    An explicit ocr_profile must match the one the document was indexed with; without one the
+    default profile's index is preferred, then any other profile's.
+    """
+    if not DOCUMENT_ID_RE.fullmatch(document_id):
+        return None  # IDs come from clients and double as cache file names
+    if ocr_profile:
+        profiles = [ocr_profile]
+    else:
+        profiles = [OCR_DEFAULT_PROFILE] + [name for name in OCR_PROFILES if name != OCR_DEFAULT_PROFILE]
+    for profile in profiles:
+        key = index_key(document_id, profile)
+        with _loaded_indexes_lock:
+            if key in _loaded_indexes:
+                _loaded_indexes.move_to_end(key)
+                return _loaded_indexes[key]
+
+        payload = index_cache.get(key)
+        if payload is None:
+            continue
+        index = DocumentIndex.from_json(payload)
+        with _loaded_indexes_lock:
+            _loaded_indexes[key] = index
+            while len(_loaded_indexes) > INDEX_CACHE_MEMORY_ITEMS:
+                _loaded_indexes.popitem(last=False)
+        return index
+    return None
+
+def retrieve_passages(document_id, query, top_k=None, ocr_profile=None):
+    """Return the passages of an indexed document most relevant to query, in document order."""
+    index = load_document_index(document_id, ocr_profile)
+    if index is None:
+        return None
+    numbers = sorted(index.search(query, top_k or RETRIEVAL_TOP_K))
+    return "\n\n".join(f"[Passage {number + 1}/{len(index.chunks)}] {index.chunks[number].strip()}"
+                         for number in numbers)
+
+def warm_up(ocr=False):
+    """Load what the first document request would otherwise pay for; returns the seconds taken."""
+    start = time.perf_counter()
+    get_mistral_session()  # Text chat first: it is what most first requests need
+    import fitz  # noqa: F401
+    from PIL import Image  # noqa: F401
+    if ocr:
+        # Workers start on demand, so give each one a task; the pool initializer loads its engine
+        pool = get_ocr_pool()
+        for future in [pool.submit(time.sleep, 0.1) for _ in range(OCR_MAX_WORKERS)]:
+            future.result()
+    seconds = time.perf_counter() - start
+    app.logger.info(f"Warm-up finished in {seconds:.2f}s")
+    return seconds
+
+def start_warm_up():
+    """Run warm_up() in a background thread when WARM_UP is set, so serving starts immediately."""
+    if WARM_UP in ("", "0", "false", "no"):
+        return None
+    thread = threading.Thread(target=warm_up, args=(WARM_UP == "ocr",), name="warm-up", daemon=True)
+    thread.start()
+    return thread
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def get_file_kind(filename):
+    """Return the extractor kind ("pdf" or "image") for an upload filename, or None if unsupported."""
+    if filename.lower().endswith('.pdf'):
+        return "pdf"
+    elif filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+        return "image"
+    return None
+
+def validate_upload(filename, size):
+    """Check an uploaded file's name and size, returning (file_kind, error) where error is a user-facing message."""
+    # Validate file size (limit to 10MB)
+    if size > MAX_UPLOAD_BYTES:
+        return None, "File too large. Please upload files smaller than 10MB."
+    
+    if size == 0:
+        return None, "Empty file uploaded."
+    
+    file_kind = get_file_kind(filename)
+    if file_kind is None:
+        return None, "Unsupported file format. Please upload PDF or image files."
+    return file_kind, None
+
+def build_prompt(query, query_type, document_text=None):
+    """Build the final LLM prompt for a query and optional extracted document text."""
+    if document_text and len(document_text) > 100:
+        # If document is provided and has content, combine the typed prompt with the user query
+        prompt = get_prompt_for_query_type(query_type, document_text)
+        return f"{prompt}\n\nUser Query: {query}"
+    
+    # For regular text queries or if document extraction failed
+    return query
+
+def prepare_prompt(query, query_type, file_source=None, file_kind=None, document_id=None, progress=None,
+                   ocr_profile=None, session_id=None, llm_slots=None):
+    """Build the LLM prompt for a query with an optional validated upload or indexed document ID.
+
+    file_source is the spooled upload's path (or its bytes). Returns a (prompt, document_id,
+    error) tuple; error is a user-facing message. A new upload is indexed under its document
+    ID, and a request that only sends a document_id is answered from that document's most
+    relevant passages. progress, when given, is called with each stage name ("extract",
+    "ocr", "index", "summarize", "retrieve"). ocr_profile names an OCR_PROFILES entry.
+
+    With a session_id the prompt is prefixed with that conversation's history, and a follow-up
+    without a document of its own is answered from the session's document. llm_slots is passed
+    on to condense_document().
+    """
+    document_text = None
+    if ocr_profile is not None and ocr_profile not in OCR_PROFILES:
+        return None, None, f"Unknown OCR profile. Choose one of: {', '.join(OCR_PROFILES)}."
+    
+    session = None
+    if session_id:
+        session = session_store.get(session_id)
+        if session is None:
+            return None, None, "Session not found. Please start a new conversation."
+        if file_source is None and not document_id:
+            document_id = session["document_id"]
+    
+    if file_source is not None:
+        if progress:
+            progress("extract")
+        if document_id is None:
+            document_id = document_id_for(file_source)
+        document_text = extract_document_text(file_source, file_kind, document_id, progress, ocr_profile)
+        if document_text.startswith("Error"):
+            document_id = None
+        else:
+            with span("compact"):
+                document_text = compact_document(document_text)
+            if progress:
+                progress("index")
+            with span("index"):
+                index_document(document_id, document_text, ocr_profile)
+            with span("summarize"):
+                document_text = condense_document(document_text, query_type, progress, llm_slots)
+    elif document_id:
+        if progress:
+            progress("retrieve")
+        with span("retrieve"):
+            document_text = retrieve_passages(document_id, query, ocr_profile=ocr_profile)
+        if document_text is None:
+            return None, None, "Document not found. Please upload it again."
+    
+    with span("prompt_build"):
+        prompt = build_prompt(query, query_type, document_text)
+        if session is not None:
+            prompt = session_store.prompt_with_history(session, prompt)
+    return prompt, document_id, None
+
+def spool_request_upload():
+    """Spool the current request's 'document' upload to disk.
+
+    Returns (path, document_id, file_kind, error); path is None when nothing was uploaded or
+    the upload was rejected. The caller owns the file and must remove it.
+    """
+    if 'document' not in request.files or request.files['document'].filename == '':
+        return None, None, None, None
+    return spool_file_storage(request.files['document'])
+
+def spool_file_storage(file):
+    """Spool one uploaded file to disk; returns (path, document_id, file_kind, error) like spool_request_upload()."""
+    # Reject oversized uploads before reading them
+    if file.content_length and file.content_length > MAX_UPLOAD_BYTES:
+        return None, None, None, "File too large. Please upload files smaller than 10MB."
+    
+    with span("upload_read"):
+        path, document_id, size = spool_upload(file.stream)
+    file_kind, error = validate_upload(file.filename, size)
+    if error:
+        remove_file(path)
+        return None, None, None, error
+    document_bytes.inc(size, file_kind)
+    return path, document_id, file_kind, None
+
+def uploaded_document_name():
+    """Filename of the current request's 'document' upload, or None."""
+    file = request.files.get('document')
+    return file.filename if file and file.filename else None
+
+def build_prompt_from_request():
+    """Read the query and optional document from the current request and build the LLM prompt.
+
+    Returns a (prompt, document_id, error) tuple like prepare_prompt().
+    """
+    query = request.form.get('query', '')
+    query_type = request.form.get('type', 'general')
+    
+    # Check if a file was uploaded
+    path, document_id, file_kind, error = spool_request_upload()
+    if error:
+        return None, None, error
+    if path is None:
+        document_id = request.form.get('document_id') or None
+    
+    try:
+        return prepare_prompt(query, query_type, path, file_kind, document_id,
+                              ocr_profile=request.form.get('ocr_profile') or None,
+                              session_id=request.form.get('session_id') or None)
+    finally:
+        remove_file(path)
+
+def describe_api_error(api_error):
+    """Turn an LLM API exception into a user-facing error message."""
+    if isinstance(api_error, MistralRateLimitError):
+        return "API quota exceeded. Please try again later."
+    elif isinstance(api_error, MistralAuthError):
+        return "API authentication failed. Please check your API key."
+    elif isinstance(api_error, MistralTimeoutError):
+        return "API request timed out. Please try again."
+    return f"API error: {str(api_error)}"
+
+def answer_batch_document(query, query_type, path, file_kind, document_id, llm_slots, ocr_profile=None):
+    """Extract one spooled batch document and ask Mistral about it once an LLM slot is free.
+
+    Summaries of a long document take the same slots. Returns a result dict with "response" and
+    "document_id", or "error". Removes the file.
+    """
+    try:
+        prompt, document_id, error = prepare_prompt(query, query_type, path, file_kind, document_id,
+                                                    ocr_profile=ocr_profile, llm_slots=llm_slots)
+        if error:
+            return {"error": error}
+        wait_start = time.perf_counter()
+        with llm_slots:
+            record_span("llm_queue", time.perf_counter() - wait_start)
+            response_text = call_mistral_api(prompt, route_model(query_type, prompt, document_id is not None))
+        return {"response": response_text, "document_id": document_id}
+    except MistralAPIError as api_error:
+        return {"error": describe_api_error(api_error)}
+    except Exception as e:
+        app.logger.error(f"Error processing batch document: {str(e)}")
+        return {"error": f"An error occurred: {str(e)}"}
+    finally:
+        remove_file(path)
+
+def run_batch(query, query_type, uploads, ocr_profile=None):
+    """Answer one query about many documents concurrently, yielding each result as it finishes.
+
+    uploads is a list of (filename, path, document_id, file_kind, error) tuples as spooled by
+    spool_file_storage(). Results carry the upload's index and filename, rejected uploads are
+    reported first, and spooled files not yet processed are removed if the generator is closed.
+    """
+    pending = []
+    for index, (filename, path, document_id, file_kind, error) in enumerate(uploads):
+        if error:
+            yield {"index": index, "filename": filename, "error": error}
+        else:
+            pending.append((index, filename, path, document_id, file_kind))
+    if not pending:
+        return
+    
+    llm_slots = threading.BoundedSemaphore(BATCH_LLM_CONCURRENCY)
+    pool = ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(pending)))
+    futures = {}
+    try:
+        for index, filename, path, document_id, file_kind in pending:
+            future = pool.submit(answer_batch_document, query, query_type, path, file_kind, document_id,
+                                 llm_slots, ocr_profile)
+            futures[future] = (index, filename, path)
+        for future in as_completed(futures):
+            index, filename, _ = futures[future]
+            yield dict(future.result(), index=index, filename=filename)
+    finally:
+        # The client went away mid-batch: drop documents that have not started
+        for future, (_, _, path) in futures.items():
+            if future.cancel():
+                remove_file(path)
+        pool.shutdown(wait=False)
+
+class JobCancelled(Exception):
+    """Raised from a progress callback to stop a job that was cancelled or abandoned."""
+
+class JobQueue:
+    """Persistent SQLite-backed queue of document analysis jobs run by background worker threads.
+
+    Uploads are stored under files_dir until the job finishes. Identical in-flight submissions
+    share one job, and a job stops at its next progress report once it is cancelled or its
+    client has not polled for JOB_ABANDON_SECONDS.
+    """
+
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+    IN_FLIGHT = (QUEUED, RUNNING)
+
+    def __init__(self, path, files_dir, workers, queue_depth):
+        self.path = path
+        self.files_dir = files_dir
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._started = False
+        self._start_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        os.makedirs(files_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, dedupe_key TEXT NOT NULL, status TEXT NOT NULL, "
+                "stage TEXT, current INTEGER, total INTEGER, query TEXT, query_type TEXT, "
+                "file_path TEXT, file_kind TEXT, result TEXT, error TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, last_seen REAL NOT NULL, "
+                "ocr_profile TEXT, session_id TEXT, document_name TEXT)"
+            )
+            # Databases created before OCR profiles and sessions existed
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+            for column in ("ocr_profile", "session_id", "document_name"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+            # One in-flight job per dedupe key, enforced across worker processes
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs (dedupe_key) "
+                         "WHERE status IN ('queued', 'running')")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self):
+        return thread_local_sqlite(self._local, self.path)
+
+    def start(self):
+        """Start the worker threads once per process."""
+        with self._start_lock:
+            if self._started:
+                return
+            for number in range(self.workers):
+                threading.Thread(target=self._worker_loop, name=f"job-worker-{number}", daemon=True).start()
+            self._started = True
+
+    def submit(self, query, query_type, upload_path=None, document_id=None, file_kind=None, ocr_profile=None,
+               session_id=None, document_name=None):
+        """Queue a job, returning (job_id, deduplicated).
+
+        The queue takes ownership of the spooled upload at upload_path: it is moved into
+        files_dir, or deleted when an identical job is already in flight. A finished job with a
+        session_id is recorded as a turn of that session.
+        """
+        dedupe_key = hashlib.sha256(json.dumps([document_id or "", query, query_type, ocr_profile or "",
+                                                session_id or ""]).encode("utf-8")).hexdigest()
+        existing = self._find_in_flight(dedupe_key)
+        if existing:
+            remove_file(upload_path)
+            return existing, True
+        try:
+            self._check_depth()
+        except AdmissionRejected:
+            remove_file(upload_path)
+            raise
+
+        job_id = os.urandom(16).hex()
+        file_path = None
+        if upload_path is not None:
+            file_path = os.path.join(self.files_dir, job_id)
+            os.replace(upload_path, file_path)
+
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, dedupe_key, status, stage, query, query_type, file_path, "
+                    "file_kind, ocr_profile, session_id, document_name, created_at, updated_at, last_seen) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, dedupe_key, self.QUEUED, self.QUEUED, query, query_type, file_path,
+                     file_kind, ocr_profile, session_id, document_name, now, now, now),
+                )
+        except sqlite3.IntegrityError:
+            # Another worker process queued the same job between our check and insert
+            remove_file(file_path)
+            existing = self._find_in_flight(dedupe_key)
+            if existing:
+                return existing, True
+            raise
+
+        self.start()
+        self._wakeup.set()
+        return job_id, False
+
+    def _check_depth(self):
+        """Raise AdmissionRejected (429) when queue_depth jobs are already waiting for a worker."""
+        conn = self._connect()
+        queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (self.QUEUED,)).fetchone()[0]
+        if queued < self.queue_depth:
+            return
+        # A worker frees up about every (recent turnaround / workers) seconds
+        turnaround = conn.execute(
+            "SELECT AVG(updated_at - created_at) FROM jobs WHERE status = ? AND updated_at > ?",
+            (self.DONE, time.time() - 3600),
+        ).fetchone()[0] or 10.0
+        raise AdmissionRejected("jobs", 429, max(1, min(60, math.ceil(turnaround / max(1, self.workers)))))
+
+    def _find_in_flight(self, dedupe_key):
+        row = self._connect().execute(
+            "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')", (dedupe_key,)
+        ).fetchone()
+        return row["id"] if row else None
+
+    def get(self, job_id):
+        """Return the job as a dict (recording that its client is still polling), or None."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET last_seen = ? WHERE id = ?", (time.time(), job_id))
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it had already finished."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (self.CANCELLED, "Job cancelled.", time.time(), job_id),
+            )
+        return cursor.rowcount > 0
+
+    def _claim(self):
+        """Atomically move the oldest queued job to running and return it."""
+        now = time.time()
+        with self._connect() as conn:
+            # Jobs left running by a crashed process go back to the queue
+            conn.execute("UPDATE jobs SET status = ? WHERE status = ? AND updated_at < ?",
+                         (self.QUEUED, self.RUNNING, now - JOB_STALE_SECONDS))
+            while True:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (self.QUEUED,)
+                ).fetchone()
+                if row is None:
+                    return None
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (self.RUNNING, now, row["id"], self.QUEUED),
+                )
+                if cursor.rowcount:
+                    return dict(row)
+
+    def _report(self, job_id, stage, current=None, total=None):
+        """Record progress, raising JobCancelled if the job was cancelled or abandoned."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT status, last_seen FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            running = row is not None and row["status"] == self.RUNNING
+            abandoned = running and now - row["last_seen"] > JOB_ABANDON_SECONDS
+            if abandoned:
+                conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                             (self.CANCELLED, "Job abandoned: client stopped polling.", now, job_id))
+            elif running:
+                conn.execute("UPDATE jobs SET stage = ?, current = ?, total = ?, updated_at = ? WHERE id = ?",
+                             (stage, current, total, now, job_id))
+        # Raised outside the transaction so the abandoned status is committed
+        if not running or abandoned:
+            raise JobCancelled(job_id)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, result = ?, error = ?, updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (status, status, json.dumps(result) if result is not None else None, error,
+                 time.time(), job_id, self.RUNNING),
+            )
+
+    def _run(self, job):
+        job_id = job["id"]
+
+        def progress(stage, current=None, total=None):
+            self._report(job_id, stage, current, total)
+
+        try:
+            record_span("queue_wait", max(0.0, time.time() - job["created_at"]))
+            progress("start")
+            prompt, document_id, error = prepare_prompt(
+                job["query"], job["query_type"], job["file_path"], job["file_kind"], progress=progress,
+                ocr_profile=job["ocr_profile"], session_id=job["session_id"])
+            if error:
+                self._finish(job_id, self.FAILED, error=error)
+                return
+            progress("llm")
+            response_text = call_mistral_api(prompt, route_model(job["query_type"], prompt, document_id is not None))
+            record_session_turn(job["session_id"], job["query"], response_text, document_id, job["document_name"])
+            self._finish(job_id, self.DONE, result={"response": response_text, "document_id": document_id})
+        except JobCancelled:
+            pass
+        except MistralAPIError as api_error:
+            self._finish(job_id, self.FAILED, error=describe_api_error(api_error))
+        except Exception as e:
+            app.logger.error(f"Error processing job {job_id}: {str(e)}")
+            self._finish(job_id, self.FAILED, error=f"An error occurred: {str(e)}")
+        finally:
+            remove_file(job["file_path"])
+
+    def _purge_finished(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?",
+                         (time.time() - JOB_RETENTION_SECONDS,))
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim()
+                if job is None:
+                    self._purge_finished()
+                    # Poll as well as wait, so jobs queued by other processes get picked up
+                    self._wakeup.wait(timeout=1.0)
+                    self._wakeup.clear()
+                    continue
+                self._run(job)
+            except Exception as e:
+                app.logger.error(f"Job worker error: {str(e)}")
+                time.sleep(1.0)
+
+job_queue = JobQueue(JOBS_DB_PATH, JOBS_FILES_DIR, JOB_WORKERS, JOB_QUEUE_DEPTH)
+
+def job_status(job):
+    """Public view of a job row."""
+    status = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+    if job["total"]:
+        status["progress"] = {"current": job["current"], "total": job["total"]}
+    if job["error"]:
+        status["error"] = job["error"]
+    return status
+
+def format_transcript(messages):
+    """Render session messages as "User: ..." / "Assistant: ..." lines."""
+    speakers = {"user": "User", "assistant": "Assistant"}
+    return "\n".join(f"{speakers[message['role']]}: {message['content']}" for message in messages)
+
+class SessionStore:
+    """SQLite-backed conversation sessions: the full transcript, the active document and a running summary.
+
+    Messages up to a session's compacted_through ID have been folded into its summary. Prompts
+    carry the summary and the newer messages that fit SESSION_HISTORY_TOKENS, so the prefix only
+    changes when a turn is appended or the session is compacted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, summary TEXT NOT NULL DEFAULT '', "
+                "compacted_through INTEGER NOT NULL DEFAULT 0, document_id TEXT, document_name TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, role TEXT NOT NULL, "
+                "content TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)")
+            # Databases created before unsaved sessions existed
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(sessions)")]
+            if "saved" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN saved INTEGER NOT NULL DEFAULT 1")
+
+    def _connect(self):
+        return thread_local_sqlite(self._local, self.path)
+
+    def create(self, saved=True):
+        """Start an empty session and return its ID, dropping sessions idle past their retention period.
+
+        Saved sessions are kept for SESSION_RETENTION_SECONDS, others for SESSION_UNSAVED_RETENTION_SECONDS.
+        """
+        session_id = os.urandom(16).hex()
+        now = time.time()
+        expired = "(saved = 1 AND updated_at < ?) OR (saved = 0 AND updated_at < ?)"
+        cutoffs = (now - SESSION_RETENTION_SECONDS, now - SESSION_UNSAVED_RETENTION_SECONDS)
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM messages WHERE session_id IN (SELECT id FROM sessions WHERE {expired})",
+                         cutoffs)
+            conn.execute(f"DELETE FROM sessions WHERE {expired}", cutoffs)
+            conn.execute("INSERT INTO sessions (id, saved, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                         (session_id, int(saved), now, now))
+        return session_id
+
+    def set_saved(self, session_id, saved):
+        """Switch a session between the saved and unsaved retention periods; returns False if it did not exist."""
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE sessions SET saved = ? WHERE id = ?", (int(saved), session_id))
+        return cursor.rowcount > 0
+
+    def get(self, session_id):
+        """Return the session as a dict, or None."""
+        row = self._connect().execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return dict(row) if row else None
+
+    def messages(self, session_id, after=0):
+        """Return the session's messages with an ID above after, oldest first."""
+        rows = self._connect().execute(
+            "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? ORDER BY id",
+            (session_id, after),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def add_turn(self, session_id, query, answer, document_id=None, document_name=None):
+        """Append a question and its answer; a turn about a document makes it the session's document.
+
+        Nothing is stored if the session was deleted while the answer was generated.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            if document_id:
+                # A follow-up about the same document keeps the name it was uploaded under
+                cursor = conn.execute(
+                    "UPDATE sessions SET document_id = ?, updated_at = ?, document_name = "
+                    "CASE WHEN document_id = ? THEN COALESCE(?, document_name) ELSE ? END WHERE id = ?",
+                    (document_id, now, document_id, document_name, document_name, session_id),
+                )
+            else:
+                cursor = conn.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+            if cursor.rowcount == 0:
+                return
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                [(session_id, "user", query, now), (session_id, "assistant", answer, now)],
+            )
+
+    def delete(self, session_id):
+        """Delete a session and its transcript; returns False if it did not exist."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            cursor = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    def prompt_with_history(self, session, prompt):
+        """Prefix prompt with the session's summary and the most recent turns that fit the history budget."""
+        remaining = SESSION_HISTORY_TOKENS * CHARS_PER_TOKEN
+        recent = []
+        for message in reversed(self.messages(session["id"], session["compacted_through"])):
+            content = message["content"]
+            if len(content) > remaining:
+                if recent:
+                    break  # Older turns are waiting to be folded into the summary
+                content = content[:remaining] + " [...]"
+            recent.insert(0, dict(message, content=content))
+            remaining -= len(content)
+
+        parts = []
+        if session["summary"]:
+            parts.append(f"Summary of the earlier conversation:\n{session['summary']}")
+        if recent:
+            parts.append(f"Recent conversation:\n{format_transcript(recent)}")
+        if not parts:
+            return prompt
+        parts.append(f"Current request:\n{prompt}")
+        return "\n\n".join(parts)
+
+    def compact(self, session_id):
+        """Fold the oldest unsummarized messages into the running summary once they overflow the budget.
+
+        Returns True if the summary was updated. Mistral errors propagate to the caller.
+        """
+        session = self.get(session_id)
+        if session is None:
+            return False
+        pending = self.messages(session_id, session["compacted_through"])
+        total = sum(estimate_tokens(message["content"]) for message in pending)
+        if total <= SESSION_HISTORY_TOKENS:
+            return False
+
+        # Fold down to half the budget so compaction runs every few turns rather than every turn,
+        # always keeping the latest turn verbatim
+        folded = []
+        while len(pending) > 2 and total > SESSION_HISTORY_TOKENS // 2:
+            message = pending.pop(0)
+            folded.append(message)
+            total -= estimate_tokens(message["content"])
+        if not folded:
+            return False
+
+        prompt = (
+            "You maintain the running summary of a conversation between a user and an assistant about "
+            "legal and medical questions. Update the summary with the new messages. Keep what the user "
+            "is trying to find out and every fact they may refer back to: names, dates, amounts, "
+            "diagnoses, medications, obligations, deadlines, clause numbers and the assistant's "
+            "conclusions. Reply with the updated summary only.\n\n"
+            f"Current summary:\n{session['summary'] or '(none)'}\n\n"
+            f"New messages:\n{format_transcript(folded)}"
+        )
+        with span("session_compact"):
+            summary = call_mistral_api(prompt, MISTRAL_SMALL_MODEL, SESSION_SUMMARY_MAX_TOKENS, temperature=0)
+        with self._connect() as conn:
+            # If another process compacted this session meanwhile, its summary wins
+            cursor = conn.execute(
+                "UPDATE sessions SET summary = ?, compacted_through = ? WHERE id = ? AND compacted_through = ?",
+                (summary.strip(), folded[-1]["id"], session_id, session["compacted_through"]),
+            )
+        return cursor.rowcount > 0
+
+session_store = SessionStore(SESSIONS_DB_PATH)
+# One compactor thread: a session is never summarized twice at once in this process
+_session_compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-compactor")
+
+def compact_session(session_id):
+    try:
+        session_store.compact(session_id)
+    except Exception as e:
+        # The turns stay unsummarized and are retried after the next turn
+        app.logger.warning(f"Could not compact session {session_id}: {str(e)}")
+
+def record_session_turn(session_id, query, answer, document_id=None, document_name=None):
+    """Append a finished turn to a session (if any) and compact it in the background."""
+    if not session_id:
+        return
+    try:
+        session_store.add_turn(session_id, query, answer, document_id, document_name)
+    except sqlite3.Error as e:
+        app.logger.error(f"Could not record a turn for session {session_id}: {str(e)}")
+        return
+    _session_compactor.submit(compact_session, session_id)
+
+def session_view(session):
+    """Public view of a session with its full transcript."""
+    document = None
+    if session["document_id"]:
+        document = {"id": session["document_id"], "name": session["document_name"]}
+    return {
+        "session_id": session["id"],
+        "document": document,
+        "summary": session["summary"],
+        "saved": bool(session["saved"]),
+        "messages": [{"role": message["role"], "content": message["content"]}
+                     for message in session_store.messages(session["id"])],
+        "created_at": session["created_at"],
+        "updated_at": session["updated_at"],
+    }
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Events message with a JSON payload."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.before_request
+def start_server_timing():
+    if SERVER_TIMING or request.headers.get("X-Server-Timing"):
+        _request_spans.set([])
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def add_server_timing(response):
+    spans = _request_spans.get()
+    if spans is not None:
+        # Streamed responses only carry the stages that ran before their first byte
+        spans = spans + [("total", time.perf_counter() - g.request_started)]
+        response.headers["Server-Timing"] = server_timing_header(spans)
+    return response
+
+@app.teardown_request
+def stop_server_timing(exc):
+    _request_spans.set(None)  # Worker threads are reused across requests
+
+def may_carry_upload(content_type, content_length):
+    """Guess from the headers alone whether a request carries an upload; form fields by themselves are small."""
+    if not (content_type or "").startswith("multipart/form-data"):
+        return False
+    return content_length is None or content_length > UPLOAD_LANE_MIN_BYTES
+
+def request_lane():
+    """Pick the admission lane for the current request without reading its body: uploads may need OCR, the rest is text."""
+    return ocr_lane if may_carry_upload(request.mimetype, request.content_length) else text_lane
+
+def admission_controlled(view):
+    """Run a view inside its request's admission lane.
+
+    A streamed response calls Mistral while its body is sent, so it keeps the slot until the
+    stream is closed.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        lane = request_lane()
+        lane.acquire()
+        admitted = time.perf_counter()
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            lane.release(time.perf_counter() - admitted)
+            raise
+        if response.is_streamed:
+            response.call_on_close(lambda: lane.release(time.perf_counter() - admitted))
+        else:
+            lane.release(time.perf_counter() - admitted)
+        return response
+    return wrapper
+
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(error):
+    response = jsonify({"error": "The server is busy. Please try again shortly.", "retry_after": error.retry_after})
+    response.status_code = error.status
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
 @app.route('/ask', methods=['POST'])
+@admission_controlled
 def ask():
     try:
         # Increase timeout for large files
         request.timeout = 60  # seconds
         
-        query = request.form.get('query', '')
-        query_type = request.form.get('type', 'general')
-        
-        document_text = None
-        
-        # Check if a file was uploaded
-        if 'document' in request.files and request.files['document'].filename != '':
-            file = request.files['document']
-            
-            # Validate file size (limit to 10MB)
-            if file.content_length and file.content_length > 10 * 1024 * 1024:
-                return jsonify({"error": "File too large. Please upload files smaller than 10MB."})
-                
-            file_bytes = file.read()
-            
-            if len(file_bytes) == 0:
-                return jsonify({"error": "Empty file uploaded."})
-            
-            # Process based on file type
-            if file.filename.lower().endswith('.pdf'):
-                document_text = process_pdf_with_ocr(file_bytes)
-            elif file.filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                document_text = extract_text_from_image(file_bytes)
-            else:
-                return jsonify({"error": "Unsupported file format. Please upload PDF or image files."})
-        
-        # Generate prompt based on query type and document if available
-        prompt = get_prompt_for_query_type(query_type, document_text)
-        
-        # Prepare the final prompt with the user query
-        final_prompt = f"{prompt}\n\nUser Query: {query}"
+        session_id = request.form.get('session_id') or None
+        prompt, document_id, error = build_prompt_from_request()
+        if error:
+            return jsonify({"error": error})
         
         # Handle potential API errors
         try:
-            if document_text and len(document_text) > 100:
-                # If document is provided and has content
-                response_text = call_mistral_api(final_prompt)
-            else:
-                # For regular text queries or if document extraction failed
-                response_text = call_mistral_api(query)
-            
-            return jsonify({"response": response_text})
+            model = route_model(request.form.get('type', 'general'), prompt, document_id is not None)
+            response_text = call_mistral_api(prompt, model)
+            record_session_turn(session_id, request.form.get('query', ''), response_text, document_id,
+                                uploaded_document_name())
+            return jsonify({"response": response_text, "document_id": document_id, "session_id": session_id})
         except Exception as api_error:
-            # Handle specific API errors
-            error_message = str(api_error)
-            if "quota" in error_message.lower():
-                return jsonify({"error": "API quota exceeded. Please try again later."})
-            elif "unauthorized" in error_message.lower():
-                return jsonify({"error": "API authentication failed. Please check your API key."})
-            else:
-                return jsonify({"error": f"API error: {error_message}"})
+            return jsonify({"error": describe_api_error(api_error)})
     
+    except MistralAPIError as api_error:
+        # Raised while summarizing a long document
+        return jsonify({"error": describe_api_error(api_error)})
     except Exception as e:
         app.logger.error(f"Error processing request: {str(e)}")
         return jsonify({"error": f"An error occurred: {str(e)}"})
 
-if __name__ == '__main__':
-    # Create templates directory and HTML file on startup
-    create_templates_directory()
+@app.route('/ask/stream', methods=['POST'])
+@admission_controlled
+def ask_stream():
+    """Same as /ask, but streams the answer as Server-Sent Events while Mistral generates it."""
+    # The generator runs after the request context is gone
+    query = request.form.get('query', '')
+    query_type = request.form.get('type', 'general')
+    session_id = request.form.get('session_id') or None
+    document_name = uploaded_document_name()
+    try:
+        # The upload has to be consumed before the streaming response starts
+        prompt, document_id, error = build_prompt_from_request()
+    except MistralAPIError as api_error:
+        prompt, document_id, error = None, None, describe_api_error(api_error)
+    except Exception as e:
+        app.logger.error(f"Error processing request: {str(e)}")
+        prompt, document_id, error = None, None, f"An error occurred: {str(e)}"
+    
+    def generate():
+        if error:
+            yield sse_event({"error": error}, event="error")
+            return
+        deltas = []
+        try:
+            for delta in call_mistral_api_stream(prompt, route_model(query_type, prompt, document_id is not None)):
+                deltas.append(delta)
+                yield sse_event({"delta": delta})
+        except Exception as api_error:
+            yield sse_event({"error": describe_api_error(api_error)}, event="error")
+            return
+        record_session_turn(session_id, query, "".join(deltas), document_id, document_name)
+        yield sse_event({"document_id": document_id, "session_id": session_id}, event="done")
+    
+    # Disable proxy buffering so each token reaches the browser immediately
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(generate(), mimetype="text/event-stream", headers=headers)
+
+@app.route('/ask/batch', methods=['POST'])
+def ask_batch():
+    """Answer one question about every uploaded 'documents' file, streaming an NDJSON line per document.
+
+    Lines arrive in completion order, each with the upload's index and filename; the last line
+    is {"done": true, ...} with the batch totals.
+    """
+    started = time.monotonic()
+    request.max_content_length = BATCH_MAX_BYTES
+    
+    # The whole batch holds one OCR lane slot until its stream is closed. It is taken before the
+    # body is read, so a full lane turns the request away without receiving the uploads
+    ocr_lane.acquire()
+    admitted = time.perf_counter()
+    uploads = []
+    
+    def close():
+        # Covers a client that disconnects before the first line; finished documents are already gone
+        for upload in uploads:
+            remove_file(upload[1])
+        ocr_lane.release(time.perf_counter() - admitted)
+    
+    try:
+        query = request.form.get('query', '')
+        query_type = request.form.get('type', 'general')
+        ocr_profile = request.form.get('ocr_profile') or None
+        
+        files = [file for file in request.files.getlist('documents') if file.filename]
+        if not files:
+            close()
+            return jsonify({"error": "No documents uploaded."}), 400
+        if len(files) > BATCH_MAX_FILES:
+            close()
+            return jsonify({"error": f"Too many documents. Please upload at most {BATCH_MAX_FILES} at a time."}), 400
+        
+        # Spool every upload before the streaming response starts, while the request body is readable
+        for file in files:
+            uploads.append((file.filename,) + spool_file_storage(file))
+    except BaseException:
+        close()
+        raise
+    
+    def generate():
+        failed = 0
+        for result in run_batch(query, query_type, uploads, ocr_profile):
+            failed += "error" in result
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"done": True, "documents": len(uploads), "failed": failed,
+                          "seconds": round(time.monotonic() - started, 3)}) + "\n"
+    
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(generate(), mimetype="application/x-ndjson", headers=headers)
+    response.call_on_close(close)
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a document analysis job with the same form fields as /ask."""
+    query = request.form.get('query', '')
+    query_type = request.form.get('type', 'general')
     
-    # Set larger request size limit (10MB)
-    app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024
+    path, document_id, file_kind, error = spool_request_upload()
+    if error:
+        return jsonify({"error": error}), 400
     
-    # Start the server
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    job_id, deduplicated = job_queue.submit(query, query_type, path, document_id, file_kind,
+                                            request.form.get('ocr_profile') or None,
+                                            request.form.get('session_id') or None, uploaded_document_name())
+    job = job_queue.get(job_id)
+    return jsonify(dict(job_status(job), deduplicated=deduplicated)), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job_queue.start()  # Pick up jobs persisted by an earlier run of this process
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job_status(job))
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    if job["status"] in JobQueue.IN_FLIGHT:
+        return jsonify(dict(job_status(job), error="Job is not finished yet.")), 409
+    if job["status"] == JobQueue.DONE:
+        return jsonify(json.loads(job["result"]))
+    return jsonify({"error": job["error"] or "Job failed."})
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if job_queue.get(job_id) is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify({"job_id": job_id, "cancelled": job_queue.cancel(job_id)})
+
+def form_flag(value, default=True):
+    """Parse an optional "1"/"0" style form field."""
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """Start a conversation; send its session_id with /ask, /ask/stream or /jobs to continue it.
+
+    save=0 gives the session the short SESSION_UNSAVED_RETENTION_SECONDS retention.
+    """
+    return jsonify({"session_id": session_store.create(form_flag(request.form.get('save')))}), 201
+
+@app.route('/sessions/<session_id>', methods=['PATCH'])
+def update_session(session_id):
+    """Keep (save=1) or stop keeping (save=0) a session for the full retention period."""
+    saved = form_flag(request.form.get('save'))
+    if not session_store.set_saved(session_id, saved):
+        return jsonify({"error": "Session not found."}), 404
+    return jsonify({"session_id": session_id, "saved": saved})
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    session = session_store.get(session_id)
+    if session is None:
+        return jsonify({"error": "Session not found."}), 404
+    return jsonify(session_view(session))
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not session_store.delete(session_id):
+        return jsonify({"error": "Session not found."}), 404
+    return jsonify({"session_id": session_id, "deleted": True})
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/models')
+def models():
+    """Model tiers and the recent per-model latency and error statistics that drive routing."""
+    return jsonify({
+        "small": MISTRAL_SMALL_MODEL,
+        "large": MISTRAL_LARGE_MODEL,
+        "hedging": HEDGE_REQUESTS,
+        "stats": model_stats.snapshot(),
+    })
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(cache_stats_snapshot())
+
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({"error": "Request too large. Please upload smaller files."}), 413
+
+if __name__ == '__main__':
+    # Development server; in production run gunicorn with gunicorn.conf.py (gunicorn app:app)
+    start_warm_up()
+    app.run(debug=os.environ.get("FLASK_DEBUG", "").lower() in ("1", "true", "yes"), host='0.0.0.0', port=5000)
\ No newline at end of file
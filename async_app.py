@@ -0,0 +1,757 @@
+"""Asyncio serving path for LexiMed.
+
+Serves the same page, /ask, /ask/stream and /ask/batch as app.py, but on aiohttp with an async
+Mistral client, so a request waiting on the LLM costs a coroutine instead of a worker. CPU-bound
+PDF/OCR extraction runs in a thread pool (OCR itself fans out to the shared process pool).
+
+    python async_app.py --port 5000
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+
+import app as leximed
+
+# Connections to Mistral held open at once; this is what bounds in-flight LLM calls
+ASYNC_MISTRAL_CONNECTIONS = int(os.environ.get("ASYNC_MISTRAL_CONNECTIONS", 512))
+# A text request holds its lane slot through the Mistral call, which here costs a coroutine
+# rather than a thread, so the text lane is sized to the connection pool instead of app.py's threads
+ASYNC_TEXT_LANE_CONCURRENCY = int(os.environ.get("ASYNC_TEXT_LANE_CONCURRENCY", ASYNC_MISTRAL_CONNECTIONS))
+ASYNC_TEXT_LANE_QUEUE_DEPTH = int(os.environ.get("ASYNC_TEXT_LANE_QUEUE_DEPTH", ASYNC_MISTRAL_CONNECTIONS * 2))
+EXTRACTION_THREADS = int(os.environ.get("EXTRACTION_THREADS", (os.cpu_count() or 1) * 2))
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "index.html")
+
+
+class AsyncAdmissionLane(leximed.AdmissionLane):
+    """app.AdmissionLane for the event loop: queued requests wait as coroutines, not threads."""
+
+    def __init__(self, name, concurrency, queue_depth, max_wait):
+        super().__init__(name, concurrency, queue_depth, max_wait)
+        self._async_cond = asyncio.Condition()
+
+    async def acquire(self):
+        start = time.perf_counter()
+        async with self._async_cond:
+            if self.active >= self.concurrency:
+                if self.waiting >= self.queue_depth:
+                    self._reject(429)
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self._async_cond.wait_for(lambda: self.active < self.concurrency), self.max_wait)
+                except asyncio.TimeoutError:
+                    self._reject(503)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+        waited = time.perf_counter() - start
+        leximed.record_span(f"{self.name}_lane_wait", waited)
+        return waited
+
+    async def release(self, held_seconds):
+        async with self._async_cond:
+            self.active -= 1
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held_seconds
+            self._async_cond.notify()
+
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        await self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            await self.release(time.perf_counter() - start)
+
+
+def create_lanes():
+    return {
+        "text": AsyncAdmissionLane("text", ASYNC_TEXT_LANE_CONCURRENCY, ASYNC_TEXT_LANE_QUEUE_DEPTH,
+                                   leximed.TEXT_LANE_MAX_WAIT),
+        "ocr": AsyncAdmissionLane("ocr", leximed.OCR_LANE_CONCURRENCY, leximed.OCR_LANE_QUEUE_DEPTH,
+                                  leximed.OCR_LANE_MAX_WAIT),
+    }
+
+
+class AsyncMistralClient:
+    """aiohttp-based Mistral client with the same retry policy, hedging and typed errors as app.py."""
+
+    def __init__(self, session):
+        self.session = session
+
+    async def _post(self, data, stream=False):
+        headers = {"Authorization": f"Bearer {leximed.MISTRAL_API_KEY}"}
+        if stream:
+            headers["Accept"] = "text/event-stream"
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.session.post(leximed.mistral_url_for(data["model"]), json=data, headers=headers)
+            except asyncio.TimeoutError as e:
+                error = leximed.MistralTimeoutError(f"Request timed out: {str(e)}")
+            except aiohttp.ClientError as e:
+                error = leximed.MistralConnectionError(f"Connection failed: {str(e)}")
+            else:
+                if response.status < 400:
+                    return response
+                body_text = await response.text()
+                error = leximed.mistral_error_for_status(response.status, response.reason, body_text,
+                                                         response.headers.get("Retry-After"))
+                response.release()
+                if response.status not in leximed.RETRYABLE_STATUS_CODES:
+                    raise error
+
+            delay = leximed._backoff_delay(attempt, error.retry_after)
+            if attempt >= leximed.MISTRAL_MAX_RETRIES or delay > leximed.MISTRAL_MAX_RETRY_WAIT:
+                raise error
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _timed(self, attempt, model, kind, bucket):
+        start = time.perf_counter()
+        try:
+            result = await attempt()
+        except Exception:
+            leximed.record_llm_call(model, kind, time.perf_counter() - start, False, bucket)
+            raise
+        leximed.record_llm_call(model, kind, time.perf_counter() - start, True, bucket)
+        return result
+
+    async def _hedged(self, attempt, model, kind, bucket, discard=None):
+        """Async counterpart of app.hedged(); the losing attempt is cancelled instead of left running."""
+        if not leximed.HEDGE_REQUESTS:
+            return await self._timed(attempt, model, kind, bucket)
+        leximed.hedge_budget.earn()
+        delay = leximed.hedge_delay(model, kind, bucket)
+        if delay is None:
+            return await self._timed(attempt, model, kind, bucket)
+        first = asyncio.ensure_future(self._timed(attempt, model, kind, bucket))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not leximed.hedge_budget.spend():
+                return await first
+
+            second = asyncio.ensure_future(self._timed(attempt, model, kind, bucket))
+            tasks.append(second)
+            pending = set(tasks)
+            winner = None
+            errors = []
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                    elif winner is None:
+                        winner = task
+                    elif discard:
+                        discard(task.result())
+            if winner is None:
+                raise errors[0]
+            leximed.llm_hedges.inc(1, model, "hedge" if winner is second else "first")
+            return winner.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _complete(self, data):
+        response = await self._post(data)
+        try:
+            result = await response.json()
+            return result['choices'][0]['message']['content'], result.get('usage')
+        except (ValueError, KeyError, IndexError, TypeError, aiohttp.ContentTypeError) as e:
+            raise leximed.MistralResponseError(f"Unexpected response from Mistral: {str(e)}")
+        finally:
+            response.release()
+
+    async def complete(self, prompt, model=None):
+        """Return the full completion for prompt (from the large model unless one is given)."""
+        data = leximed.mistral_request_body(prompt, model)
+        cache_key = leximed.response_cache_key(data)
+        cached = leximed.get_cached_response(cache_key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        try:
+            content, usage = await self._hedged(lambda: self._complete(data), data["model"], "complete",
+                                                leximed.latency_bucket(data))
+        finally:
+            leximed.record_span("llm", time.perf_counter() - start)
+        leximed.record_llm_usage(usage)
+        leximed.store_cached_response(cache_key, content)
+        return content
+
+    async def _open_stream(self, data):
+        """Start a streamed request and read up to its first delta; returns (response, first delta)."""
+        response = await self._post(data, stream=True)
+        try:
+            first = ""
+            async for raw_line in response.content:
+                first = leximed.parse_stream_line(raw_line.decode("utf-8").strip())
+                if first != "":
+                    break
+        except BaseException:
+            response.release()
+            raise
+        return response, first
+
+    async def stream(self, prompt, model=None):
+        """Yield content deltas as Mistral generates them."""
+        data = leximed.mistral_request_body(prompt, model, stream=True)
+        cache_key = leximed.response_cache_key(data)
+        cached = leximed.get_cached_response(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        deltas = []
+        start = time.perf_counter()
+        try:
+            response, delta = await self._hedged(lambda: self._open_stream(data), data["model"], "stream",
+                                                 leximed.latency_bucket(data),
+                                                 discard=lambda opened: opened[0].release())
+            try:
+                if delta:
+                    leximed.record_span("llm_first_token", time.perf_counter() - start)
+                    deltas.append(delta)
+                    yield delta
+                if delta is not None:
+                    async for raw_line in response.content:
+                        delta = leximed.parse_stream_line(raw_line.decode("utf-8").strip())
+                        if delta is None:
+                            break
+                        if delta:
+                            deltas.append(delta)
+                            yield delta
+                    else:
+                        # The connection closed before [DONE], so the answer is incomplete
+                        raise leximed.MistralConnectionError("Stream ended before the answer was complete")
+            finally:
+                response.release()
+        except asyncio.TimeoutError as e:
+            raise leximed.MistralTimeoutError(f"Stream timed out: {str(e)}")
+        except aiohttp.ClientError as e:
+            raise leximed.MistralConnectionError(f"Stream interrupted: {str(e)}")
+        leximed.record_span("llm_stream", time.perf_counter() - start)
+        leximed.store_cached_response(cache_key, "".join(deltas))
+
+
+def check_body_size(request, limit):
+    """Raise 413, as Flask does past MAX_CONTENT_LENGTH, once the client has sent more than limit bytes.
+
+    aiohttp's client_max_size only covers bodies read whole, not multipart bodies read part by part.
+    """
+    received = max(request.content_length or 0, request.content.total_bytes)
+    if received > limit:
+        raise web.HTTPRequestEntityTooLarge(
+            max_size=limit, actual_size=received, content_type="application/json",
+            text=json.dumps({"error": "Request too large. Please upload smaller files."}))
+
+
+async def spool_part(part, request, limit):
+    """Stream one multipart file part to a temp file; returns (path, document_id, size) like app.spool_upload.
+
+    Only the first MAX_UPLOAD_BYTES or so are written; the rest of an oversized part is read
+    and dropped, within the request's limit.
+    """
+    start = time.perf_counter()
+    os.makedirs(leximed.UPLOAD_SPOOL_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(dir=leximed.UPLOAD_SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = await part.read_chunk(leximed.UPLOAD_CHUNK_BYTES)
+                if not block:
+                    break
+                check_body_size(request, limit)
+                if size <= leximed.MAX_UPLOAD_BYTES:
+                    f.write(block)
+                    digest.update(block)
+                size += len(block)
+    except BaseException:
+        leximed.remove_file(path)
+        raise
+    leximed.record_span("upload_read", time.perf_counter() - start)
+    return path, digest.hexdigest(), size
+
+
+async def read_form(request):
+    """Read the request's form fields, spooling a 'document' upload to disk in chunks.
+
+    Returns (fields, upload) where upload is (path, document_id, file_kind, error) as from
+    app.spool_request_upload(); the caller owns the spooled file. The upload's filename is kept
+    as request["document_name"].
+    """
+    if request.content_type != "multipart/form-data":
+        return dict(await request.post()), (None, None, None, None)
+
+    fields = {}
+    upload = (None, None, None, None)
+    try:
+        check_body_size(request, leximed.MAX_REQUEST_BYTES)
+        async for part in await request.multipart():
+            if part.name == 'document' and part.filename:
+                leximed.remove_file(upload[0])  # Only the last document part is kept
+                upload = (None, None, None, None)
+                request["document_name"] = part.filename
+                path, document_id, size = await spool_part(part, request, leximed.MAX_REQUEST_BYTES)
+                file_kind, error = leximed.validate_upload(part.filename, size)
+                if error:
+                    leximed.remove_file(path)
+                    upload = (None, None, None, error)
+                else:
+                    leximed.document_bytes.inc(size, file_kind)
+                    upload = (path, document_id, file_kind, None)
+            elif part.name and not part.filename:
+                fields[part.name] = await part.text()
+                check_body_size(request, leximed.MAX_REQUEST_BYTES)
+    except BaseException:
+        leximed.remove_file(upload[0])
+        raise
+    return fields, upload
+
+
+async def read_batch_form(request):
+    """Read a batch request's form fields, spooling every 'documents' part to disk.
+
+    Returns (fields, uploads, error) where uploads are (filename, path, document_id, file_kind,
+    error) tuples as for app.run_batch(); the caller owns the spooled files.
+    """
+    fields = {}
+    uploads = []
+    if request.content_type != "multipart/form-data":
+        return fields, uploads, "No documents uploaded."
+    try:
+        check_body_size(request, leximed.BATCH_MAX_BYTES)
+        async for part in await request.multipart():
+            if part.name == 'documents' and part.filename:
+                if len(uploads) >= leximed.BATCH_MAX_FILES:
+                    raise ValueError(f"Too many documents. Please upload at most {leximed.BATCH_MAX_FILES} at a time.")
+                path, document_id, size = await spool_part(part, request, leximed.BATCH_MAX_BYTES)
+                file_kind, error = leximed.validate_upload(part.filename, size)
+                if error:
+                    leximed.remove_file(path)
+                    uploads.append((part.filename, None, None, None, error))
+                else:
+                    leximed.document_bytes.inc(size, file_kind)
+                    uploads.append((part.filename, path, document_id, file_kind, None))
+            elif part.name and not part.filename:
+                fields[part.name] = await part.text()
+                check_body_size(request, leximed.BATCH_MAX_BYTES)
+    except ValueError as e:
+        for upload in uploads:
+            leximed.remove_file(upload[1])
+        return fields, [], str(e)
+    except BaseException:
+        for upload in uploads:
+            leximed.remove_file(upload[1])
+        raise
+    return fields, uploads, None if uploads else "No documents uploaded."
+
+
+async def build_prompt_from_post(request):
+    """Async counterpart of app.build_prompt_from_request: returns (prompt, document_id, error).
+
+    The form fields are kept as request["form"]. Before the body is read, the request takes a
+    slot in the admission lane its headers point to, and keeps it for the Mistral call that
+    follows; release_lane() gives it back.
+    """
+    upload = leximed.may_carry_upload(request.content_type, request.content_length)
+    lane = request.app["lanes"]["ocr" if upload else "text"]
+    await lane.acquire()
+    request["lane"] = (lane, time.perf_counter())
+
+    form, (path, document_id, file_kind, error) = await read_form(request)
+    request["form"] = form
+    if error:
+        return None, None, error
+    if path is None:
+        document_id = form.get('document_id') or None
+
+    # PyMuPDF, Tesseract, cache I/O and chunk summaries all block, so keep them off the event loop
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            request.app["extraction_executor"], functools.partial(
+                contextvars.copy_context().run, leximed.prepare_prompt, form.get('query', ''),
+                form.get('type', 'general'), path, file_kind, document_id,
+                ocr_profile=form.get('ocr_profile') or None, session_id=form.get('session_id') or None))
+    finally:
+        leximed.remove_file(path)
+
+
+async def release_lane(request):
+    """Give back the admission slot build_prompt_from_post took, if it took one."""
+    held = request.pop("lane", None)
+    if held is not None:
+        lane, admitted = held
+        await lane.release(time.perf_counter() - admitted)
+
+
+async def record_session_turn(request, answer, document_id):
+    """Record a finished /ask or /ask/stream turn in the request's session, if it has one."""
+    form = request["form"]
+    await asyncio.get_running_loop().run_in_executor(
+        request.app["extraction_executor"], leximed.record_session_turn, form.get('session_id') or None,
+        form.get('query', ''), answer, document_id, request.get("document_name"))
+
+
+async def index(request):
+    return web.FileResponse(TEMPLATE_PATH)
+
+
+async def ask(request):
+    try:
+        prompt, document_id, error = await build_prompt_from_post(request)
+        if error:
+            return web.json_response({"error": error})
+
+        try:
+            model = leximed.route_model(request["form"].get('type', 'general'), prompt, document_id is not None)
+            response_text = await request.app["mistral"].complete(prompt, model)
+            await record_session_turn(request, response_text, document_id)
+            return web.json_response({"response": response_text, "document_id": document_id,
+                                      "session_id": request["form"].get('session_id') or None})
+        except Exception as api_error:
+            return web.json_response({"error": leximed.describe_api_error(api_error)})
+
+    except leximed.AdmissionRejected:
+        raise
+    except leximed.MistralAPIError as api_error:
+        # Raised while summarizing a long document
+        return web.json_response({"error": leximed.describe_api_error(api_error)})
+    except Exception as e:
+        leximed.app.logger.error(f"Error processing request: {str(e)}")
+        return web.json_response({"error": f"An error occurred: {str(e)}"})
+    finally:
+        await release_lane(request)
+
+
+async def ask_stream(request):
+    try:
+        return await stream_answer(request)
+    finally:
+        await release_lane(request)
+
+
+async def stream_answer(request):
+    try:
+        prompt, document_id, error = await build_prompt_from_post(request)
+    except leximed.AdmissionRejected:
+        raise
+    except leximed.MistralAPIError as api_error:
+        prompt, document_id, error = None, None, leximed.describe_api_error(api_error)
+    except Exception as e:
+        leximed.app.logger.error(f"Error processing request: {str(e)}")
+        prompt, document_id, error = None, None, f"An error occurred: {str(e)}"
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+
+    if error:
+        await response.write(leximed.sse_event({"error": error}, event="error").encode("utf-8"))
+        return response
+    deltas = []
+    try:
+        model = leximed.route_model(request["form"].get('type', 'general'), prompt, document_id is not None)
+        async for delta in request.app["mistral"].stream(prompt, model):
+            deltas.append(delta)
+            await response.write(leximed.sse_event({"delta": delta}).encode("utf-8"))
+    except Exception as api_error:
+        message = leximed.describe_api_error(api_error)
+        await response.write(leximed.sse_event({"error": message}, event="error").encode("utf-8"))
+        return response
+    await record_session_turn(request, "".join(deltas), document_id)
+    done = {"document_id": document_id, "session_id": request["form"].get('session_id') or None}
+    await response.write(leximed.sse_event(done, event="done").encode("utf-8"))
+    return response
+
+
+class ThreadSlots:
+    """Context manager holding an asyncio.Semaphore from a worker thread.
+
+    Lets summaries made in extraction threads share a batch's LLM slots with its async calls.
+    """
+
+    def __init__(self, semaphore, loop):
+        self.semaphore = semaphore
+        self.loop = loop
+
+    def __enter__(self):
+        asyncio.run_coroutine_threadsafe(self.semaphore.acquire(), self.loop).result()
+
+    def __exit__(self, *exc_info):
+        self.loop.call_soon_threadsafe(self.semaphore.release)
+
+
+async def answer_batch_document(request, query, query_type, upload, llm_slots, ocr_profile=None):
+    """Async counterpart of app.answer_batch_document for one (filename, path, ...) upload."""
+    filename, path, document_id, file_kind, error = upload
+    try:
+        if error:
+            return {"error": error}
+        loop = asyncio.get_running_loop()
+        prompt, document_id, error = await loop.run_in_executor(
+            request.app["extraction_executor"], functools.partial(
+                contextvars.copy_context().run, leximed.prepare_prompt, query, query_type, path, file_kind, document_id,
+                ocr_profile=ocr_profile, llm_slots=ThreadSlots(llm_slots, loop)))
+        if error:
+            return {"error": error}
+        wait_start = time.perf_counter()
+        async with llm_slots:
+            leximed.record_span("llm_queue", time.perf_counter() - wait_start)
+            model = leximed.route_model(query_type, prompt, document_id is not None)
+            response_text = await request.app["mistral"].complete(prompt, model)
+        return {"response": response_text, "document_id": document_id}
+    except leximed.MistralAPIError as api_error:
+        return {"error": leximed.describe_api_error(api_error)}
+    except Exception as e:
+        leximed.app.logger.error(f"Error processing batch document: {str(e)}")
+        return {"error": f"An error occurred: {str(e)}"}
+    finally:
+        leximed.remove_file(path)
+
+
+async def ask_batch(request):
+    started = time.monotonic()
+    llm_slots = asyncio.Semaphore(leximed.BATCH_LLM_CONCURRENCY)
+
+    # The whole batch holds one OCR lane slot, taken before the body is read so a full lane turns
+    # the request away without receiving the uploads
+    await request.app["lanes"]["ocr"].acquire()
+    admitted = time.perf_counter()
+    uploads = []
+    tasks = []
+    failed = 0
+    try:
+        form, uploads, error = await read_batch_form(request)
+        if error:
+            return web.json_response({"error": error}, status=400)
+
+        query = form.get('query', '')
+        query_type = form.get('type', 'general')
+        ocr_profile = form.get('ocr_profile') or None
+
+        async def answer(index, upload):
+            result = await answer_batch_document(request, query, query_type, upload, llm_slots, ocr_profile)
+            return dict(result, index=index, filename=upload[0])
+
+        tasks = [asyncio.ensure_future(answer(index, upload)) for index, upload in enumerate(uploads)]
+        response = web.StreamResponse(headers={
+            "Content-Type": "application/x-ndjson",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        await response.prepare(request)
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            failed += "error" in result
+            await response.write((json.dumps(result) + "\n").encode("utf-8"))
+        await response.write((json.dumps({"done": True, "documents": len(uploads), "failed": failed,
+                                           "seconds": round(time.monotonic() - started, 3)}) + "\n").encode("utf-8"))
+    finally:
+        for task in tasks:
+            task.cancel()
+        for upload in uploads:
+            leximed.remove_file(upload[1])
+        await request.app["lanes"]["ocr"].release(time.perf_counter() - admitted)
+    return response
+
+
+async def submit_job(request):
+    form, (path, document_id, file_kind, error) = await read_form(request)
+    if error:
+        return web.json_response({"error": error}, status=400)
+
+    loop = asyncio.get_running_loop()
+    executor = request.app["extraction_executor"]
+    job_id, deduplicated = await loop.run_in_executor(
+        executor, leximed.job_queue.submit, form.get('query', ''), form.get('type', 'general'),
+        path, document_id, file_kind, form.get('ocr_profile') or None, form.get('session_id') or None,
+        request.get("document_name"))
+    job = await loop.run_in_executor(executor, leximed.job_queue.get, job_id)
+    return web.json_response(dict(leximed.job_status(job), deduplicated=deduplicated), status=202)
+
+
+async def get_job(request):
+    leximed.job_queue.start()  # Pick up jobs persisted by an earlier run of this process
+    job = await asyncio.get_running_loop().run_in_executor(
+        request.app["extraction_executor"], leximed.job_queue.get, request.match_info["job_id"])
+    if job is None:
+        return web.json_response({"error": "Job not found."}, status=404)
+    return web.json_response(leximed.job_status(job))
+
+
+async def get_job_result(request):
+    job = await asyncio.get_running_loop().run_in_executor(
+        request.app["extraction_executor"], leximed.job_queue.get, request.match_info["job_id"])
+    if job is None:
+        return web.json_response({"error": "Job not found."}, status=404)
+    if job["status"] in leximed.JobQueue.IN_FLIGHT:
+        return web.json_response(dict(leximed.job_status(job), error="Job is not finished yet."), status=409)
+    if job["status"] == leximed.JobQueue.DONE:
+        return web.json_response(json.loads(job["result"]))
+    return web.json_response({"error": job["error"] or "Job failed."})
+
+
+async def cancel_job(request):
+    job_id = request.match_info["job_id"]
+    loop = asyncio.get_running_loop()
+    executor = request.app["extraction_executor"]
+    if await loop.run_in_executor(executor, leximed.job_queue.get, job_id) is None:
+        return web.json_response({"error": "Job not found."}, status=404)
+    cancelled = await loop.run_in_executor(executor, leximed.job_queue.cancel, job_id)
+    return web.json_response({"job_id": job_id, "cancelled": cancelled})
+
+
+async def create_session(request):
+    form = await request.post()
+    session_id = await asyncio.get_running_loop().run_in_executor(
+        request.app["extraction_executor"], leximed.session_store.create, leximed.form_flag(form.get('save')))
+    return web.json_response({"session_id": session_id}, status=201)
+
+
+async def update_session(request):
+    session_id = request.match_info["session_id"]
+    saved = leximed.form_flag((await request.post()).get('save'))
+    updated = await asyncio.get_running_loop().run_in_executor(
+        request.app["extraction_executor"], leximed.session_store.set_saved, session_id, saved)
+    if not updated:
+        return web.json_response({"error": "Session not found."}, status=404)
+    return web.json_response({"session_id": session_id, "saved": saved})
+
+
+async def get_session(request):
+    def view():
+        session = leximed.session_store.get(request.match_info["session_id"])
+        return leximed.session_view(session) if session else None
+
+    session = await asyncio.get_running_loop().run_in_executor(request.app["extraction_executor"], view)
+    if session is None:
+        return web.json_response({"error": "Session not found."}, status=404)
+    return web.json_response(session)
+
+
+async def delete_session(request):
+    session_id = request.match_info["session_id"]
+    deleted = await asyncio.get_running_loop().run_in_executor(
+        request.app["extraction_executor"], leximed.session_store.delete, session_id)
+    if not deleted:
+        return web.json_response({"error": "Session not found."}, status=404)
+    return web.json_response({"session_id": session_id, "deleted": True})
+
+
+async def metrics(request):
+    text = await asyncio.get_running_loop().run_in_executor(
+        request.app["extraction_executor"], leximed.render_metrics, request.app["lanes"].values())
+    return web.Response(text=text,
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def models(request):
+    return web.json_response({
+        "small": leximed.MISTRAL_SMALL_MODEL,
+        "large": leximed.MISTRAL_LARGE_MODEL,
+        "hedging": leximed.HEDGE_REQUESTS,
+        "stats": leximed.model_stats.snapshot(),
+    })
+
+
+async def cache_stats(request):
+    snapshot = await asyncio.get_running_loop().run_in_executor(
+        request.app["extraction_executor"], leximed.cache_stats_snapshot)
+    return web.json_response(snapshot)
+
+
+@web.middleware
+async def admission_errors(request, handler):
+    try:
+        return await handler(request)
+    except leximed.AdmissionRejected as error:
+        return web.json_response(
+            {"error": "The server is busy. Please try again shortly.", "retry_after": error.retry_after},
+            status=error.status, headers={"Retry-After": str(error.retry_after)})
+
+
+@web.middleware
+async def server_timing(request, handler):
+    """Attach a Server-Timing header when SERVER_TIMING is set or the request asks for one."""
+    if not (leximed.SERVER_TIMING or request.headers.get("X-Server-Timing")):
+        return await handler(request)
+    spans = []
+    leximed._request_spans.set(spans)  # Each request runs in its own task, so its own context
+    start = time.perf_counter()
+    response = await handler(request)
+    if not response.prepared:  # Streamed responses have already sent their headers
+        spans.append(("total", time.perf_counter() - start))
+        response.headers["Server-Timing"] = leximed.server_timing_header(spans)
+    return response
+
+
+async def _client_context(application):
+    timeout = aiohttp.ClientTimeout(sock_connect=leximed.MISTRAL_CONNECT_TIMEOUT,
+                                    sock_read=leximed.MISTRAL_READ_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=ASYNC_MISTRAL_CONNECTIONS)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        application["mistral"] = AsyncMistralClient(session)
+        application["extraction_executor"] = ThreadPoolExecutor(max_workers=EXTRACTION_THREADS)
+        yield
+        application["extraction_executor"].shutdown(wait=False, cancel_futures=True)
+
+
+def create_app():
+    """Create the aiohttp application."""
+    application = web.Application(client_max_size=leximed.MAX_REQUEST_BYTES,
+                                  middlewares=[admission_errors, server_timing])
+    application["lanes"] = create_lanes()
+    if leximed.shared_metrics is not None:
+        leximed.shared_metrics.track_lanes(application["lanes"].values())
+    application.cleanup_ctx.append(_client_context)
+    application.router.add_get('/', index)
+    application.router.add_post('/ask', ask)
+    application.router.add_post('/ask/stream', ask_stream)
+    application.router.add_post('/ask/batch', ask_batch)
+    application.router.add_post('/jobs', submit_job)
+    application.router.add_get('/jobs/{job_id}', get_job)
+    application.router.add_get('/jobs/{job_id}/result', get_job_result)
+    application.router.add_delete('/jobs/{job_id}', cancel_job)
+    application.router.add_post('/sessions', create_session)
+    application.router.add_get('/sessions/{session_id}', get_session)
+    application.router.add_patch('/sessions/{session_id}', update_session)
+    application.router.add_delete('/sessions/{session_id}', delete_session)
+    application.router.add_get('/metrics', metrics)
+    application.router.add_get('/models', models)
+    application.router.add_get('/cache/stats', cache_stats)
+    return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the asyncio LexiMed server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    leximed.start_warm_up()
+    web.run_app(create_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Prompt compaction: estimated document tokens before and after compact_document_text().
+
+Each document is extracted the way an upload is (embedded PDF text in the configured
+PDF_TEXT_MODE; .txt files as they are), then compacted, and the table shows the tokens the
+document would cost in a prompt, the change and the time compaction took. The generated
+fixtures include ocr-12p.txt, text shaped like Tesseract output of a scanned filing. --corpus
+adds a directory of real documents (PDFs, images and .txt files); images and scanned PDFs are
+OCR'd, so they need Tesseract. Mistral's input-token cost, and most of its prefill latency,
+scale with these counts.
+
+    python benchmarks/compaction.py --json compaction.json
+    python benchmarks/compaction.py --corpus ~/leximed-samples --show ocr-12p.txt
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LEXIMED_CACHE_DIR", tempfile.mkdtemp(prefix="leximed-compaction-"))
+
+import app as leximed
+import fixtures
+
+
+def load_text(path):
+    """Extract a document the way an upload is extracted; returns its text or raises on an error."""
+    if path.endswith(".txt"):
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    file_kind = leximed.get_file_kind(path)
+    if file_kind is None:
+        raise ValueError("unsupported file type")
+    text = leximed.extract_document_text(path, file_kind)
+    if text.startswith("Error"):
+        raise RuntimeError(text)
+    return text
+
+
+def documents(args):
+    """Yield (name, path) for the generated fixtures and any corpus files."""
+    for name, fixture in fixtures.generate(args.fixtures, args.seed).items():
+        if fixture["kind"] in ("pdf", "text"):
+            yield name, fixture["path"]
+    if args.corpus:
+        for name in sorted(os.listdir(args.corpus)):
+            yield name, os.path.join(args.corpus, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how much prompt compaction shrinks documents.")
+    parser.add_argument("--corpus", help="Directory of real documents to include")
+    parser.add_argument("--fixtures", default=fixtures.DEFAULT_DIRECTORY)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--show", metavar="NAME", help="Print this document before and after compaction")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for name, path in documents(args):
+        try:
+            text = load_text(path)
+        except (ValueError, RuntimeError, OSError) as e:
+            print(f"{name}: skipped, {e}", file=sys.stderr)
+            continue
+        start = time.perf_counter()
+        compacted = leximed.compact_document_text(text)
+        seconds = time.perf_counter() - start
+        before, after = leximed.estimate_tokens(text), leximed.estimate_tokens(compacted)
+        results[name] = {
+            "tokens_before": before,
+            "tokens_after": after,
+            "change": round(after / max(before, 1) - 1, 4),
+            "compact_ms": round(seconds * 1000, 2),
+        }
+        if name == args.show:
+            print(f"----- {name} before -----\n{text}\n----- {name} after -----\n{compacted}\n")
+
+    print(f"{'document':<28}{'before':>9}{'after':>9}{'change':>9}{'ms':>9}")
+    for name, row in results.items():
+        print(f"{name:<28}{row['tokens_before']:>9}{row['tokens_after']:>9}{row['change']:>+9.1%}"
+              f"{row['compact_ms']:>9}")
+    before = sum(row["tokens_before"] for row in results.values())
+    after = sum(row["tokens_after"] for row in results.values())
+    print(f"{'total':<28}{before:>9}{after:>9}{after / max(before, 1) - 1:>+9.1%}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"pdf_text_mode": leximed.PDF_TEXT_MODE, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
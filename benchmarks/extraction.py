@@ -0,0 +1,88 @@
+"""Embedded PDF text: plain PyMuPDF text against layout-aware extraction.
+
+For each generated PDF fixture both PDF_TEXT_MODE settings extract the embedded text (no OCR),
+and the table shows the estimated tokens the text would cost in a prompt and the extraction time.
+report-9p.pdf is the case layout mode is for: a running header, a "Page N of M" footer, a
+disclaimer on every page, two-column pages and a ruled results table. --show prints one page of
+both outputs side by side for eyeballing reading order and table rows.
+
+    python benchmarks/extraction.py --iterations 5 --json extraction.json
+    python benchmarks/extraction.py --show report-9p.pdf:3
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LEXIMED_CACHE_DIR", tempfile.mkdtemp(prefix="leximed-extraction-"))
+
+import app as leximed
+import fixtures
+
+MODES = ("plain", "layout")
+
+
+def measure(path, mode, iterations):
+    """Return (text, median seconds) for extracting path in mode."""
+    seconds = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        text = leximed.extract_text_from_pdf(path, mode)
+        seconds.append(time.perf_counter() - start)
+    if text.startswith("Error"):
+        raise RuntimeError(text)
+    return text, statistics.median(seconds)
+
+
+def show(manifest, spec):
+    name, _, page = spec.partition(":")
+    page = int(page or 1) - 1
+    for mode in MODES:
+        text = leximed.extract_text_from_pdf(manifest[name]["path"], mode)
+        print(f"----- {name} page {page + 1} ({mode}) -----")
+        print(text.split(leximed.PAGE_BREAK)[page])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare plain and layout-aware PDF text extraction.")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--fixtures", default=fixtures.DEFAULT_DIRECTORY)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--show", metavar="FIXTURE[:PAGE]", help="Print one page of both outputs and exit")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    manifest = fixtures.generate(args.fixtures, args.seed)
+    if args.show:
+        show(manifest, args.show)
+        return
+
+    results = {}
+    for name, fixture in manifest.items():
+        if fixture["kind"] != "pdf":
+            continue
+        row = {"pages": fixture["pages"]}
+        for mode in MODES:
+            text, seconds = measure(fixture["path"], mode, args.iterations)
+            row[f"{mode}_tokens"] = leximed.estimate_tokens(text)
+            row[f"{mode}_ms"] = round(seconds * 1000, 1)
+        row["token_change"] = round(row["layout_tokens"] / max(row["plain_tokens"], 1) - 1, 4)
+        results[name] = row
+
+    print(f"{'fixture':<18}{'pages':>6}{'plain tok':>11}{'layout tok':>12}{'change':>9}{'plain ms':>10}{'layout ms':>11}")
+    for name, row in results.items():
+        print(f"{name:<18}{row['pages']:>6}{row['plain_tokens']:>11}{row['layout_tokens']:>12}"
+              f"{row['token_change']:>+9.1%}{row['plain_ms']:>10}{row['layout_ms']:>11}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"seed": args.seed, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Generated benchmark documents: text, scanned, mixed and report-style PDFs, phone photos and OCR-like text.
+
+Everything is derived from a seed, so two runs (or two machines) benchmark identical inputs
+without binary fixtures in the repository. Files are written once per directory and reused.
+
+    python benchmarks/fixtures.py --directory /tmp/leximed-fixtures
+"""
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+import textwrap
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageEnhance, ImageFilter
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), "leximed-fixtures")
+
+WORDS = """agreement party parties lessor lessee tenant landlord premises term rent payment notice
+default remedy clause section provision liability indemnify warranty representation governing law
+jurisdiction court claim damages breach termination renewal assignment consent obligation
+confidential disclosure effective date signature witness patient diagnosis treatment physician
+dosage prescription allergy history examination consent discharge referral insurance""".split()
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792  # US Letter in points
+TEXT_BOX = fitz.Rect(72, 72, 540, 720)
+
+
+def make_text(rng, paragraphs=4):
+    """Return a few paragraphs of legal/medical-sounding sentences."""
+    out = []
+    for _ in range(paragraphs):
+        sentences = []
+        for _ in range(rng.randint(3, 5)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(8, 14))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        out.append(" ".join(sentences))
+    return "\n\n".join(out)
+
+
+def render_page(text, dpi=300):
+    """Render text onto a Letter page and return it as a grayscale PIL image."""
+    doc = fitz.open()
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_textbox(TEXT_BOX, text, fontsize=11, fontname="helv")
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    doc.close()
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def degrade(image, rng):
+    """Make a rendered page look like a mediocre scan."""
+    image = image.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, fillcolor=255)
+    image = image.filter(ImageFilter.GaussianBlur(radius=rng.uniform(0.6, 1.2)))
+    image = ImageEnhance.Contrast(image).enhance(0.6)
+    noise = Image.effect_noise(image.size, 40)
+    return Image.blend(image, noise, 0.15)
+
+
+def jpeg_bytes(image, quality=80):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def add_text_page(doc, text):
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_textbox(TEXT_BOX, text, fontsize=11, fontname="helv")
+
+
+def add_scanned_page(doc, image):
+    """Add a page that is nothing but a page-sized image, as a scanner produces."""
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_image(page.rect, stream=jpeg_bytes(image))
+
+
+def scanned_pdf(image):
+    """Wrap a page image in a one-page PDF."""
+    doc = fitz.open()
+    add_scanned_page(doc, image)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def phone_photo(image, rng, scale=1.3):
+    """Put a page onto a darker background and JPEG it, like a phone photo of a form."""
+    page = image.resize((int(image.width * scale), int(image.height * scale)), Image.BICUBIC)
+    margin = int(200 * scale)
+    photo = Image.new("L", (page.width + 2 * margin, page.height + 2 * margin), 90)
+    photo.paste(page, (margin + rng.randint(-50, 50), margin + rng.randint(-50, 50)))
+    return jpeg_bytes(photo, quality=85)
+
+
+def text_pdf(rng, pages):
+    doc = fitz.open()
+    for _ in range(pages):
+        add_text_page(doc, make_text(rng))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def scanned_multi_pdf(rng, pages, dpi=200):
+    doc = fitz.open()
+    for _ in range(pages):
+        add_scanned_page(doc, degrade(render_page(make_text(rng), dpi), rng))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def mixed_pdf(rng, text_pages, scanned_pages, dpi=200):
+    """Typed pages with scanned attachments interleaved, like a filing with exhibits."""
+    doc = fitz.open()
+    kinds = ["text"] * text_pages + ["scanned"] * scanned_pages
+    rng.shuffle(kinds)
+    for kind in kinds:
+        if kind == "text":
+            add_text_page(doc, make_text(rng))
+        else:
+            add_scanned_page(doc, degrade(render_page(make_text(rng), dpi), rng))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def report_pdf(rng, pages):
+    """A lab/contract-style report: running header, "Page N of M" footer, a repeated disclaimer,
+    and pages alternating between numbered clauses, two columns and a ruled results table."""
+    doc = fitz.open()
+    disclaimer = ("This report is confidential and intended only for the named recipient. "
+                  "Results must be interpreted by a qualified physician.")
+    for number in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_text((72, 40), "Riverside Clinical Laboratory - Patient Report - Confidential", fontsize=9)
+        page.insert_text((72, 770), f"Page {number + 1} of {pages}", fontsize=9)
+        page.insert_text((430, 770), "Printed 2024-03-01", fontsize=9)
+        page.insert_textbox(fitz.Rect(72, 690, 540, 720), disclaimer, fontsize=8)
+        layout = number % 3
+        if layout == 0:
+            clauses = [f"{number + 1}.{item} {make_text(rng, 1)}" for item in range(1, 4)]
+            page.insert_textbox(fitz.Rect(72, 72, 540, 680), "\n".join(clauses), fontsize=11)
+        elif layout == 1:
+            page.insert_textbox(fitz.Rect(72, 72, 296, 680), make_text(rng, 3), fontsize=10)
+            page.insert_textbox(fitz.Rect(316, 72, 540, 680), make_text(rng, 3), fontsize=10)
+        else:
+            page.insert_textbox(fitz.Rect(72, 72, 540, 100), make_text(rng, 1)[:90], fontsize=11)
+            widths = [72, 232, 332, 412, 540]
+            rows = [("Test", "Result", "Units", "Reference")] + [
+                (rng.choice(WORDS).capitalize(), f"{rng.uniform(0, 200):.1f}", rng.choice(["mg/dL", "g/L", "%"]),
+                 f"{rng.randint(1, 50)}-{rng.randint(60, 250)}") for _ in range(14)]
+            for row_number, row in enumerate(rows):
+                y = 120 + row_number * 20
+                for column, cell in enumerate(row):
+                    page.insert_text((widths[column] + 4, y + 14), cell, fontsize=10)
+            shape = page.new_shape()
+            bottom = 120 + len(rows) * 20
+            for row_number in range(len(rows) + 1):
+                shape.draw_line((widths[0], 120 + row_number * 20), (widths[-1], 120 + row_number * 20))
+            for x in widths:
+                shape.draw_line((x, 120), (x, bottom))
+            shape.finish(width=0.5)
+            shape.commit()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+OCR_NOISE_LINES = ["~", "' . ,", "|| \u2014_", "=~ -", ";:", ". ' ,"]
+OCR_CONFUSIONS = {"l": "1", "o": "0", "e": "c", "m": "rn"}
+DISCLAIMER = ("This document contains confidential health information that is protected under applicable "
+              "federal and state privacy law. If you have received it in error, notify the sender "
+              "immediately and destroy every copy. Unauthorized review, use or disclosure is prohibited.")
+
+
+def misread(text, rng, errors=1):
+    """Apply a few OCR-style character confusions to text."""
+    for _ in range(errors):
+        positions = [i for i, char in enumerate(text) if char in OCR_CONFUSIONS]
+        i = rng.choice(positions)
+        text = text[:i] + OCR_CONFUSIONS[text[i]] + text[i + 1:]
+    return text
+
+
+def ocr_like_text(rng, pages):
+    """Text shaped like Tesseract output of a scanned filing: hard-wrapped lines with words
+    hyphenated across them, a running header, page numbers, speckle lines, and a disclaimer
+    repeated on every page, sometimes with a misread character."""
+    out = []
+    for number in range(pages):
+        lines = ["MERCY GENERAL HOSPITAL  -  Discharge Summary  -  MRN 0048213", ""]
+        for paragraph in make_text(rng).split("\n\n"):
+            wrapped = textwrap.wrap(paragraph, 70)
+            for i in range(len(wrapped) - 1):
+                head, _, rest = wrapped[i + 1].partition(" ")
+                if len(head) >= 6 and head.isalpha() and rng.random() < 0.3:
+                    wrapped[i] += f" {head[:3]}-"
+                    wrapped[i + 1] = f"{head[3:]} {rest}".rstrip()
+            lines += wrapped + [""]
+            if rng.random() < 0.4:
+                lines += [rng.choice(OCR_NOISE_LINES), ""]
+        lines += textwrap.wrap(misread(DISCLAIMER, rng, rng.choice([0, 0, 1])), 70) + ["", f"- {number + 1} -"]
+        out.append("\n".join(lines))
+    return "\f".join(out)
+
+
+# name -> (file kind, pages, builder(rng))
+FIXTURES = {
+    "text-2p.pdf": ("pdf", 2, lambda rng: text_pdf(rng, 2)),
+    "text-50p.pdf": ("pdf", 50, lambda rng: text_pdf(rng, 50)),
+    "scanned-3p.pdf": ("pdf", 3, lambda rng: scanned_multi_pdf(rng, 3)),
+    "mixed-6p.pdf": ("pdf", 6, lambda rng: mixed_pdf(rng, 4, 2)),
+    "report-9p.pdf": ("pdf", 9, lambda rng: report_pdf(rng, 9)),
+    "ocr-12p.txt": ("text", 12, lambda rng: ocr_like_text(rng, 12).encode("utf-8")),
+    "photo-2mp.jpg": ("image", 1, lambda rng: phone_photo(render_page(make_text(rng), 150), rng, 1.0)),
+    "photo-12mp.jpg": ("image", 1, lambda rng: phone_photo(render_page(make_text(rng), 300), rng, 1.2)),
+}
+
+
+def generate(directory=DEFAULT_DIRECTORY, seed=1234):
+    """Write any missing fixtures to directory; returns {name: {"path", "kind", "pages", "bytes"}}."""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+    for number, (name, (kind, pages, build)) in enumerate(FIXTURES.items()):
+        path = os.path.join(directory, f"{seed}-{name}")
+        if not os.path.exists(path):
+            data = build(random.Random(seed * 1000 + number))
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        manifest[name] = {"path": path, "kind": kind, "pages": pages, "bytes": os.path.getsize(path)}
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the benchmark fixture documents.")
+    parser.add_argument("--directory", default=DEFAULT_DIRECTORY)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    print(json.dumps(generate(args.directory, args.seed), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Load test comparing the sync Flask path with the asyncio path (async_app.py) on /ask.
+
+Both servers talk to a local mock Mistral with a fixed latency, so the numbers show how many
+concurrent LLM round-trips each serving path can hold rather than how fast Mistral is. The
+sync server gets a fixed pool of workers, the same way a sync gunicorn deployment would.
+
+--gunicorn-workers also runs the production setup (gunicorn.conf.py) once per worker count,
+with --gunicorn-threads threads per worker, to show how throughput scales with processes.
+--document sends a file with every request, which makes the load CPU-bound extraction
+instead of LLM waiting (set a small --latency for that).
+
+    python benchmarks/load_test.py --latency 0.5 --concurrency 200 --requests 2000 --sync-workers 8
+    python benchmarks/load_test.py --latency 0.2 --concurrency 64 --gunicorn-workers 1 2 4 --gunicorn-threads 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def serve_sync(port, workers):
+    """Serve the Flask app with a fixed pool of sync workers."""
+    from werkzeug.serving import BaseWSGIServer
+    from app import app
+
+    class PooledWSGIServer(BaseWSGIServer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._workers = ThreadPoolExecutor(max_workers=workers)
+
+        def process_request(self, request, client_address):
+            self._workers.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer("127.0.0.1", port, app).serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def start_process(args, env=None):
+    return subprocess.Popen([sys.executable] + args, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_load(url, total, concurrency, query, document=None):
+    """Fire total requests at url with at most concurrency in flight; return the measurements.
+
+    rps and the latency percentiles count successful answers only; requests turned away by
+    admission control (429/503) are counted as rejected, and any other failure as an error.
+    """
+    import aiohttp
+
+    latencies = []
+    errors = 0
+    rejected = 0
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def client(session):
+        nonlocal errors, rejected
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            form = aiohttp.FormData({"query": query, "type": "general"})
+            if document:
+                form.add_field("document", document[1], filename=document[0])
+            start = time.perf_counter()
+            try:
+                async with session.post(url, data=form) as response:
+                    body = await response.json()
+                    if response.status in (429, 503):
+                        rejected += 1
+                        continue
+                    if response.status != 200 or "error" in body:
+                        errors += 1
+                        continue
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    timeout = aiohttp.ClientTimeout(total=300)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "ok": len(latencies),
+        "rejected": rejected,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2),
+        "attempted_rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def benchmark_server(name, command, env, args):
+    """Start a server (command and env may use {port}) and load it; returns the measurements."""
+    port = free_port()
+    command = [part.replace("{port}", str(port)) for part in command]
+    env = {key: value.replace("{port}", str(port)) for key, value in env.items()}
+    process = start_process(command, env)
+    document = None
+    if args.document:
+        with open(args.document, "rb") as f:
+            document = (os.path.basename(args.document), f.read())
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/ask"
+        # Warm up every worker
+        asyncio.run(run_load(url, min(20, args.requests), min(20, args.concurrency), args.query, document))
+        result = asyncio.run(run_load(url, args.requests, args.concurrency, args.query, document))
+    finally:
+        process.terminate()
+        process.wait()
+    result["server"] = name
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and async /ask throughput.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock Mistral latency in seconds")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--sync-workers", type=int, default=8)
+    parser.add_argument("--gunicorn-workers", type=int, nargs="+", default=[],
+                        help="Also run gunicorn with each of these worker counts")
+    parser.add_argument("--gunicorn-threads", type=int, default=4)
+    parser.add_argument("--document", help="Upload this file with every request")
+    parser.add_argument("--query", default="What is a power of attorney?")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--serve-sync", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_sync:
+        return serve_sync(args.port, args.sync_workers)
+
+    mock_port = free_port()
+    mock = start_process(["mock_mistral.py", "--port", str(mock_port), "--latency", str(args.latency)])
+    try:
+        wait_for_port(mock_port)
+        env = dict(os.environ)
+        env["MISTRAL_API_URL"] = f"http://127.0.0.1:{mock_port}/v1/chat/completions"
+        env["MISTRAL_POOL_MAXSIZE"] = str(max(args.concurrency, 32))
+
+        sync_command = [os.path.join("benchmarks", "load_test.py"), "--serve-sync",
+                        "--sync-workers", str(args.sync_workers), "--port", "{port}"]
+        results = [
+            benchmark_server(f"sync ({args.sync_workers} workers)", sync_command, env, args),
+            benchmark_server("async", ["async_app.py", "--port", "{port}"], env, args),
+        ]
+        for workers in args.gunicorn_workers:
+            gunicorn_env = dict(env, GUNICORN_BIND="127.0.0.1:{port}", GUNICORN_WORKERS=str(workers),
+                                GUNICORN_THREADS=str(args.gunicorn_threads))
+            name = f"gunicorn ({workers}x{args.gunicorn_threads})"
+            results.append(benchmark_server(name, ["-m", "gunicorn", "app:app"], gunicorn_env, args))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print(f"{'server':<22}{'ok rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'rejected':>10}{'errors':>8}")
+    for result in results:
+        print(f"{result['server']:<22}{result['rps']:>10}{result['p50_ms']:>10}"
+              f"{result['p99_ms']:>10}{result['rejected']:>10}{result['errors']:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"latency": args.latency, "concurrency": args.concurrency, "results": results}, f, indent=2)
+
+    failed = [result for result in results if result["rejected"] or result["errors"]]
+    for result in failed:
+        print(f"WARNING: {result['server']}: {result['rejected'] + result['errors']} of {result['requests']} "
+              f"requests failed ({result['rejected']} rejected, {result['errors']} errors); its numbers "
+              "only cover the requests that succeeded", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Seconds per page against character accuracy for each OCR profile and backend.
+
+The corpus is generated on the fly from a fixed seed, so every run OCRs the same pages with a
+known ground truth: clean and degraded scans (rotated, blurred, noisy, low contrast) embedded
+in PDFs the way a scanner produces them, oversized phone-style JPEG photos, and blank pages.
+Accuracy is difflib's similarity ratio between the normalized OCR output and the truth.
+
+Pages are OCR'd in this process with the backend already loaded, so the gap between
+backends is the per-page engine start-up cost that the OCR pool workers no longer pay.
+
+    python benchmarks/ocr_profiles.py --pages 6 --backends pytesseract tesserocr --json ocr_profiles.json
+"""
+import argparse
+import difflib
+import json
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image
+
+import app as leximed
+from fixtures import degrade, make_text, phone_photo, render_page, scanned_pdf
+
+
+def build_corpus(pages, seed):
+    """Return a list of (kind, kind_of_source, source, truth) samples."""
+    rng = random.Random(seed)
+    corpus = []
+    for number in range(pages):
+        text = make_text(rng)
+        image = render_page(text)
+        kind = ("clean", "degraded", "photo")[number % 3]
+        if kind == "clean":
+            corpus.append((kind, "pdf", scanned_pdf(image), text))
+        elif kind == "degraded":
+            corpus.append((kind, "pdf", scanned_pdf(degrade(image, rng)), text))
+        else:
+            corpus.append((kind, "image", phone_photo(image, rng), text))
+    blank = Image.new("L", (2550, 3300), 255)
+    corpus.append(("blank", "pdf", scanned_pdf(blank), ""))
+    return corpus
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def accuracy(truth, text):
+    return difflib.SequenceMatcher(None, normalize(truth), normalize(text), autojunk=False).ratio()
+
+
+def ocr_sample(kind_of_source, source, profile_name):
+    """OCR one sample in-process with a profile, the same way the app's extractors do."""
+    profile = leximed.get_ocr_profile(profile_name)
+    if kind_of_source == "image":
+        return leximed._ocr_image_source(source, profile)
+    return leximed._ocr_pdf_pages(source, [0], profile)[0][0]
+
+
+def benchmark(corpus, profile_name):
+    by_kind = {}
+    for kind, kind_of_source, source, truth in corpus:
+        start = time.perf_counter()
+        text = ocr_sample(kind_of_source, source, profile_name)
+        seconds = time.perf_counter() - start
+        by_kind.setdefault(kind, []).append((seconds, accuracy(truth, text)))
+
+    rows = {}
+    for kind, samples in by_kind.items():
+        rows[kind] = {
+            "pages": len(samples),
+            "seconds_per_page": round(sum(s for s, _ in samples) / len(samples), 3),
+            "accuracy": round(sum(a for _, a in samples) / len(samples), 4),
+        }
+    samples = [sample for kind_samples in by_kind.values() for sample in kind_samples]
+    rows["all"] = {
+        "pages": len(samples),
+        "seconds_per_page": round(sum(s for s, _ in samples) / len(samples), 3),
+        "accuracy": round(sum(a for _, a in samples) / len(samples), 4),
+    }
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OCR profiles on a synthetic page corpus.")
+    parser.add_argument("--pages", type=int, default=6, help="Text pages to generate (plus one blank page)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--profiles", nargs="+", default=list(leximed.OCR_PROFILES))
+    parser.add_argument("--backends", nargs="+", default=[leximed.get_ocr_backend().name],
+                        choices=["pytesseract", "tesserocr"])
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.pages, args.seed)
+    results = {}
+    for backend in args.backends:
+        leximed._ocr_backend = leximed.create_ocr_backend(backend)
+        ocr_sample(*corpus[0][1:3], args.profiles[0])  # Load the engine before timing
+        for name in args.profiles:
+            results[f"{backend}/{name}"] = benchmark(corpus, name)
+
+    print(f"{'backend/profile':<24}{'pages':<10}{'count':>6}{'s/page':>10}{'accuracy':>10}")
+    for name, rows in results.items():
+        for kind, row in rows.items():
+            print(f"{name:<24}{kind:<10}{row['pages']:>6}{row['seconds_per_page']:>10}{row['accuracy']:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"seed": args.seed, "profiles": leximed.OCR_PROFILES, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Model routing, hedged requests and failover, exercised against local mock Mistral endpoints.
+
+Three scenarios run in this process, each with fresh routing statistics:
+
+  tiering   the small and large models are served by two separate mock endpoints (wired up
+            through MISTRAL_MODEL_URLS) with different latencies; short general questions,
+            typed questions and document-sized prompts are routed and timed, and compared with
+            sending everything to the large model
+  hedging   one endpoint where a small fraction of requests hit a slow tail; the same calls
+            are made with hedging off and on, for whole answers and for the first streamed token
+  failover  the small model always fails; routing moves general questions to the large model
+            once the small one's error rate is established
+
+    python benchmarks/router.py --requests 200 --concurrency 8 --json router.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LEXIMED_CACHE_DIR", tempfile.mkdtemp(prefix="leximed-router-"))
+os.environ.setdefault("MISTRAL_MAX_RETRIES", "0")  # Failover is the router's job here, not the retry loop's
+
+import app as leximed
+from load_test import percentile
+from mock_mistral import MockMistralServer
+
+SMALL, LARGE = leximed.MISTRAL_SMALL_MODEL, leximed.MISTRAL_LARGE_MODEL
+DOCUMENT_PROMPT = "Analyze the following lease and list the tenant's obligations. " + "Clause text. " * 1200
+
+# workload name -> (query type, prompt, has document)
+WORKLOADS = {
+    "general question": ("general", "What is a power of attorney?", False),
+    "medical question": ("medical", "What are common side effects of metformin?", False),
+    "document analysis": ("legal", DOCUMENT_PROMPT, True),
+}
+
+
+def reset_router(hedging):
+    leximed.model_stats = leximed.ModelStats(leximed.ROUTER_STATS_SECONDS)
+    leximed.hedge_budget = leximed.HedgeBudget(leximed.HEDGE_MAX_FRACTION)
+    leximed.HEDGE_REQUESTS = hedging
+
+
+def run_calls(call, requests, concurrency):
+    """Run call() requests times; returns (latencies, errors, results)."""
+    def timed(_):
+        start = time.perf_counter()
+        try:
+            result = call()
+        except leximed.MistralAPIError as e:
+            return time.perf_counter() - start, str(e), None
+        return time.perf_counter() - start, None, result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(timed, range(requests)))
+    return ([seconds for seconds, _, _ in samples], [error for _, error, _ in samples if error],
+            [result for _, _, result in samples])
+
+
+def summarize(latencies, errors, extra=None):
+    row = {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+    }
+    row.update(extra or {})
+    return row
+
+
+def tiering(args):
+    rows = {}
+    with MockMistralServer(latency=args.large_latency) as large, \
+            MockMistralServer(latency=args.small_latency) as small:
+        leximed.MISTRAL_API_URL = large.url
+        leximed.MISTRAL_MODEL_URLS = {SMALL: small.url}
+        for routed in (True, False):
+            reset_router(hedging=False)
+            for name, (query_type, prompt, has_document) in WORKLOADS.items():
+                model = leximed.route_model(query_type, prompt, has_document) if routed else LARGE
+                latencies, errors, _ = run_calls(lambda: leximed.call_mistral_api(prompt, model),
+                                                 args.requests // 4, args.concurrency)
+                label = f"{name} ({'routed' if routed else 'always large'})"
+                rows[label] = summarize(latencies, errors, {"model": model})
+        rows["requests per endpoint"] = {"large": large.request_count, "small": small.request_count}
+    leximed.MISTRAL_MODEL_URLS = {}
+    return rows
+
+
+def hedging(args):
+    rows = {}
+    for stream in (False, True):
+        for hedged in (False, True):
+            with MockMistralServer(latency=args.small_latency, tail_fraction=args.tail_fraction,
+                                   tail_latency=args.tail_latency, seed=args.seed) as mock:
+                leximed.MISTRAL_API_URL = mock.url
+                reset_router(hedging=hedged)
+                hedges_before = leximed.llm_hedges.total()
+                if stream:
+                    # Time to the first token, then drain the rest
+                    def call():
+                        deltas = leximed.call_mistral_api_stream("What is a power of attorney?", SMALL)
+                        next(deltas)
+                        first = time.perf_counter()
+                        for _ in deltas:
+                            pass
+                        return first
+                else:
+                    def call():
+                        return leximed.call_mistral_api("What is a power of attorney?", SMALL)
+                latencies, errors, _ = run_calls(call, args.requests, args.concurrency)
+                label = f"{'stream first token' if stream else 'complete'} (hedging {'on' if hedged else 'off'})"
+                rows[label] = summarize(latencies, errors, {
+                    "hedged": int(leximed.llm_hedges.total() - hedges_before),
+                    "upstream_requests": mock.request_count,
+                })
+                time.sleep(args.tail_latency)  # Losing attempts finish before the next run's stats start
+    return rows
+
+
+def failover(args):
+    with MockMistralServer(latency=args.small_latency, model_errors={SMALL: 503}) as mock:
+        leximed.MISTRAL_API_URL = mock.url
+        reset_router(hedging=False)
+        query_type, prompt, has_document = WORKLOADS["general question"]
+        routed = []
+        errors = 0
+        for _ in range(args.requests // 4):
+            model = leximed.route_model(query_type, prompt, has_document)
+            routed.append(model)
+            try:
+                leximed.call_mistral_api(prompt, model)
+            except leximed.MistralAPIError:
+                errors += 1
+        return {
+            "requests": len(routed),
+            "errors": errors,
+            "sent_to_small": routed.count(SMALL),
+            "sent_to_large": routed.count(LARGE),
+            "stats": leximed.model_stats.snapshot(),
+        }
+
+
+def print_rows(title, rows):
+    print(f"\n{title}")
+    print(f"{'':<42}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}  notes")
+    for name, row in rows.items():
+        if "p50_ms" not in row:
+            print(f"{name:<42}{json.dumps(row)}")
+            continue
+        notes = ", ".join(f"{key}={row[key]}" for key in ("model", "hedged", "upstream_requests") if key in row)
+        print(f"{name:<42}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['max_ms']:>9}"
+              f"{row['errors']:>8}  {notes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise model routing and hedging against mock endpoints.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--small-latency", type=float, default=0.05)
+    parser.add_argument("--large-latency", type=float, default=0.3)
+    parser.add_argument("--tail-fraction", type=float, default=0.03, help="Share of requests that are slow")
+    parser.add_argument("--tail-latency", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = {"tiering": tiering(args), "hedging": hedging(args), "failover": failover(args)}
+    print_rows("Tiering: small and large models on separate endpoints", results["tiering"])
+    print_rows(f"Hedging: {args.tail_fraction:.0%} of requests take {args.tail_latency}s", results["hedging"])
+    failed_over = results["failover"]
+    print(f"\nFailover: small model always fails; {failed_over['errors']} of {failed_over['requests']} "
+          f"general questions failed before routing moved {failed_over['sent_to_large']} to the large model")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
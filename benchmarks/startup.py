@@ -0,0 +1,158 @@
+"""Cold-start cost of the Flask app: import time and time to the first requests.
+
+Every run starts fresh interpreters, the way an autoscaled pod or a new worker process does.
+It reports the time to import app.py (and which heavy libraries that pulls in), the time from
+process start until the server accepts connections, and the latency of the first page, the
+first text /ask and the first PDF /ask. /ask goes to a local mock Mistral with no latency, so
+the numbers are the app's own start-up work. --root measures another checkout, for example a
+git worktree of an older revision, so before and after can be compared on one machine.
+
+    python benchmarks/startup.py --runs 5 --json startup.json
+    git worktree add /tmp/leximed-before HEAD~1
+    python benchmarks/startup.py --root /tmp/leximed-before
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests
+
+import fixtures
+from load_test import free_port
+from suite import cold_cache_env
+
+HEAVY_MODULES = ("fitz", "PIL", "pytesseract", "requests")
+
+# Both snippets only rely on app.app, so they work against older checkouts too
+IMPORT_SNIPPET = f"""
+import json, sys, time
+start = time.perf_counter()
+import app
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                  "heavy": [name for name in {HEAVY_MODULES!r} if name in sys.modules]}}))
+"""
+
+SERVE_SNIPPET = """
+import sys
+from werkzeug.serving import make_server
+import app
+getattr(app, "start_warm_up", lambda: None)()
+make_server("127.0.0.1", int(sys.argv[1]), app.app, threaded=True).serve_forever()
+"""
+
+METRICS = ("import_ms", "ready_ms", "first_page_ms", "first_ask_ms", "first_pdf_ask_ms")
+
+
+def measure_import(root, env):
+    completed = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=root, env=env,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def wait_until_accepting(port, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def timed_ms(call):
+    """Run call() and return (milliseconds, error message or None)."""
+    start = time.perf_counter()
+    response = call()
+    elapsed = round((time.perf_counter() - start) * 1000, 1)
+    if response.status_code != 200:
+        return elapsed, f"HTTP {response.status_code}"
+    if response.headers.get("Content-Type", "").startswith("application/json"):
+        return elapsed, response.json().get("error")
+    return elapsed, None
+
+
+def measure_server(root, env, pdf_path):
+    """Start a server process and time it until it has answered a page, a text /ask and a PDF /ask."""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", SERVE_SNIPPET, str(port)], cwd=root, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    errors = []
+    try:
+        wait_until_accepting(port)
+        result = {"ready_ms": round((time.perf_counter() - started) * 1000, 1)}
+        with requests.Session() as client:
+            form = {"query": "Summarize the key obligations.", "type": "general"}
+            calls = {
+                "first_page_ms": lambda: client.get(f"{base}/"),
+                "first_ask_ms": lambda: client.post(f"{base}/ask", data=form),
+                "first_pdf_ask_ms": lambda: client.post(
+                    f"{base}/ask", data=form, files={"document": ("text-2p.pdf", open(pdf_path, "rb"))}),
+            }
+            for name, call in calls.items():
+                result[name], error = timed_ms(call)
+                if error:
+                    errors.append(f"{name}: {error}")
+    finally:
+        process.terminate()
+        process.wait()
+    result["errors"] = errors
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time to the first requests.")
+    parser.add_argument("--root", default=ROOT, help="Checkout to measure")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warm-up", action="store_true", help="Start the servers with WARM_UP=1")
+    parser.add_argument("--fixtures", default=fixtures.DEFAULT_DIRECTORY)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    from mock_mistral import MockMistralServer
+
+    pdf_path = fixtures.generate(args.fixtures)["text-2p.pdf"]["path"]
+    runs = []
+    heavy = None
+    with MockMistralServer() as mock:
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory(prefix="leximed-startup-") as cache_dir:
+                env = cold_cache_env(cache_dir)
+                env["MISTRAL_API_URL"] = mock.url
+                if args.warm_up:
+                    env["WARM_UP"] = "1"
+                imported = measure_import(args.root, env)
+                heavy = imported["heavy"]
+                run = {"import_ms": round(imported["seconds"] * 1000, 1)}
+                run.update(measure_server(args.root, env, pdf_path))
+                runs.append(run)
+                for error in run["errors"]:
+                    print(error, file=sys.stderr)
+
+    summary = {metric: {"median": statistics.median(run[metric] for run in runs),
+                        "min": min(run[metric] for run in runs)} for metric in METRICS}
+    print(f"{os.path.abspath(args.root)} ({args.runs} runs)")
+    print(f"{'metric':<20}{'median':>10}{'min':>10}")
+    for metric, row in summary.items():
+        print(f"{metric:<20}{row['median']:>10}{row['min']:>10}")
+    print(f"heavy modules loaded by 'import app': {', '.join(heavy) or 'none'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"root": os.path.abspath(args.root), "heavy_modules": heavy, "summary": summary,
+                       "runs": runs}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
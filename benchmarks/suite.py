@@ -0,0 +1,241 @@
+"""Benchmark suite for extraction, OCR and end-to-end /ask, with baseline comparison.
+
+Each case runs in its own process against generated fixtures (see fixtures.py), so the peak
+RSS reported for a case is that case's alone, and caches are disabled so every iteration
+does the full work. /ask cases go through the Flask app to a local mock Mistral with a fixed
+latency. A case reports throughput, p50/p95/p99 latency, the first (cold) call, and peak
+memory of the case process and of its OCR workers.
+
+    python benchmarks/suite.py --json results.json
+    python benchmarks/suite.py --save-baseline benchmarks/baseline.json
+    python benchmarks/suite.py --baseline benchmarks/baseline.json   # exits 1 on a regression
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fixtures
+from load_test import percentile
+
+# case name -> (operation, fixture name or None)
+CASES = {
+    "extract_text_from_pdf[text-2p]": ("extract_pdf", "text-2p.pdf"),
+    "extract_text_from_pdf[text-50p]": ("extract_pdf", "text-50p.pdf"),
+    "extract_text_from_pdf[report-9p]": ("extract_pdf", "report-9p.pdf"),
+    "process_pdf_with_ocr[scanned-3p]": ("ocr_pdf", "scanned-3p.pdf"),
+    "process_pdf_with_ocr[mixed-6p]": ("ocr_pdf", "mixed-6p.pdf"),
+    "extract_text_from_image[photo-2mp]": ("ocr_image", "photo-2mp.jpg"),
+    "extract_text_from_image[photo-12mp]": ("ocr_image", "photo-12mp.jpg"),
+    "ask[query]": ("ask", None),
+    "ask[text-50p]": ("ask", "text-50p.pdf"),
+    "ask[scanned-3p]": ("ask", "scanned-3p.pdf"),
+}
+
+# Metric -> True when a larger value is worse
+METRICS = {"p50_ms": True, "p95_ms": True, "throughput": False, "peak_rss_mb": True}
+MIN_CHANGE = 1.0  # Ignore differences smaller than this (ms or MB); they are noise
+
+
+def cold_cache_env(cache_dir):
+    """Environment that gives the case process empty caches it never hits."""
+    env = dict(os.environ)
+    env["LEXIMED_CACHE_DIR"] = cache_dir
+    for prefix in ("EXTRACTION", "SUMMARY", "INDEX"):
+        env[f"{prefix}_CACHE_MEMORY_ITEMS"] = "0"
+        env[f"{prefix}_CACHE_DISK_BYTES"] = "0"
+    env["RESPONSE_CACHE_BACKEND"] = "none"
+    return env
+
+
+def make_operation(operation, fixture):
+    """Return a zero-argument callable for one iteration, returning an error message or None."""
+    import app as leximed
+
+    if operation == "ask":
+        client = leximed.app.test_client()
+
+        def ask():
+            data = {"query": "Summarize the key obligations.", "type": "general"}
+            if fixture:
+                data["document"] = (open(fixture["path"], "rb"), os.path.basename(fixture["path"]))
+            body = client.post("/ask", data=data, content_type="multipart/form-data").get_json()
+            return body.get("error")
+        return ask
+
+    extract = {
+        "extract_pdf": leximed.extract_text_from_pdf,
+        "ocr_pdf": leximed.process_pdf_with_ocr,
+        "ocr_image": leximed.extract_text_from_image,
+    }[operation]
+
+    def run():
+        text = extract(fixture["path"])
+        return text if text.startswith("Error") else None
+    return run
+
+
+def run_case(name, manifest, iterations, concurrency):
+    """Run one case in this process and return its measurements."""
+    operation, fixture_name = CASES[name]
+    fixture = manifest[fixture_name] if fixture_name else None
+    op = make_operation(operation, fixture)
+
+    def timed(_):
+        start = time.perf_counter()
+        error = op()
+        return time.perf_counter() - start, error
+
+    # The first call pays for pool start-up and engine loading; report it separately
+    first, first_error = timed(None)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(timed, range(iterations)))
+    elapsed = time.perf_counter() - started
+
+    import app as leximed
+    if leximed._ocr_pool is not None:
+        leximed._ocr_pool.shutdown(wait=True)  # Children count towards RUSAGE_CHILDREN once reaped
+
+    latencies = [seconds for seconds, _ in samples]
+    errors = [error for _, error in samples if error]
+    if first_error:
+        errors.insert(0, first_error)
+    pages = fixture["pages"] if fixture else 0
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "first_ms": round(first * 1000, 1),
+        "throughput": round(iterations / elapsed, 3),
+        "pages_per_second": round(iterations * pages / elapsed, 3) if pages else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_worker_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def run_case_process(name, args, mock_url):
+    """Run a case in a fresh interpreter with cold caches; returns its measurements."""
+    with tempfile.TemporaryDirectory(prefix="leximed-bench-") as cache_dir:
+        env = cold_cache_env(cache_dir)
+        env["MISTRAL_API_URL"] = mock_url
+        command = [sys.executable, os.path.abspath(__file__), "--run-case", name,
+                   "--iterations", str(args.iterations), "--concurrency", str(args.concurrency),
+                   "--fixtures", args.fixtures, "--seed", str(args.seed)]
+        completed = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"errors": args.iterations, "first_error": completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Return (rows, regressed) comparing each shared case's metrics with the baseline."""
+    rows = []
+    regressed = False
+    for name, current in results["cases"].items():
+        previous = baseline.get("cases", {}).get(name)
+        if not previous:
+            continue
+        for metric, larger_is_worse in METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if larger_is_worse else change < -tolerance
+            worse = worse and (metric == "throughput" or abs(new - old) >= MIN_CHANGE)
+            regressed = regressed or worse
+            rows.append((name, metric, old, new, change, worse))
+    return rows, regressed
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extraction, OCR and /ask against a baseline.")
+    parser.add_argument("--cases", nargs="+", help="Only run cases containing one of these strings")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock Mistral latency in seconds")
+    parser.add_argument("--fixtures", default=fixtures.DEFAULT_DIRECTORY)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Compare against this results file")
+    parser.add_argument("--save-baseline", help="Write results to this file as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative change before failing")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    manifest = fixtures.generate(args.fixtures, args.seed)
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, manifest, args.iterations, args.concurrency)))
+        return
+
+    from mock_mistral import MockMistralServer
+
+    names = [name for name in CASES if not args.cases or any(part in name for part in args.cases)]
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "seed": args.seed,
+        },
+        "cases": {},
+    }
+    with MockMistralServer(latency=args.latency) as mock:
+        for name in names:
+            results["cases"][name] = result = run_case_process(name, args, mock.url)
+            if result.get("first_error"):
+                print(f"{name}: {result['errors']} errors, first: {result['first_error']}", file=sys.stderr)
+
+    print(f"{'case':<38}{'ops/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'first ms':>10}{'rss MB':>9}")
+    for name, result in results["cases"].items():
+        if "p50_ms" not in result:
+            print(f"{name:<38}{'failed':>9}")
+            continue
+        print(f"{name:<38}{result['throughput']:>9}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+              f"{result['p99_ms']:>10}{result['first_ms']:>10}{result['peak_rss_mb']:>9}")
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressed = compare(results, baseline, args.tolerance)
+        print(f"\n{'case':<38}{'metric':<14}{'baseline':>10}{'current':>10}{'change':>9}")
+        for name, metric, old, new, change, worse in rows:
+            flag = "  REGRESSION" if worse else ""
+            print(f"{name:<38}{metric:<14}{old:>10}{new:>10}{change:>+9.1%}{flag}")
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""gunicorn settings for serving LexiMed in production.
+
+    gunicorn app:app                          # gunicorn reads this file from the working directory
+    GUNICORN_WORKERS=4 GUNICORN_THREADS=16 gunicorn app:app
+
+Each worker is a separate process with its own thread pool: threads cover requests waiting on
+Mistral, processes cover CPU-bound PDF extraction. Workers share state through local files
+rather than memory. The extraction, summary and index caches keep their disk tier in
+LEXIMED_CACHE_DIR. Jobs, sessions and RESPONSE_CACHE_BACKEND=sqlite use SQLite, and
+SHARED_METRICS (on here) makes /metrics and /cache/stats report whole-server totals.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+cores = os.cpu_count() or 1
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", cores))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 300))  # Large scanned PDFs take minutes to OCR
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so memory held by PyMuPDF and Pillow is returned
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = max_requests // 10
+# Each worker imports the app after the fork: the app opens SQLite connections and starts
+# threads at import, and neither survives a fork
+preload_app = False
+
+# Read by the workers when they import app.py. Every worker has its own OCR pool, so the cores
+# are split between them instead of each pool taking all of them
+os.environ.setdefault("SHARED_METRICS", "1")
+os.environ.setdefault("OCR_MAX_WORKERS", str(max(1, cores // workers)))
+
+_metrics_directory = None
+
+
+def on_starting(server):
+    """Give each server run fresh metric totals unless METRICS_DB_PATH pins a file."""
+    global _metrics_directory
+    if "METRICS_DB_PATH" not in os.environ:
+        _metrics_directory = tempfile.mkdtemp(prefix="leximed-metrics-")
+        os.environ["METRICS_DB_PATH"] = os.path.join(_metrics_directory, "metrics.sqlite3")
+
+
+def on_exit(server):
+    if _metrics_directory:
+        shutil.rmtree(_metrics_directory, ignore_errors=True)
+
+
+def post_worker_init(worker):
+    """Warm each worker's caches and models in the background when WARM_UP is set, as app.py's __main__ does."""
+    leximed = sys.modules.get("app")
+    if leximed is not None:
+        leximed.start_warm_up()
+
+
+def worker_exit(server, worker):
+    """Flush the metrics the worker gathered since its last periodic flush."""
+    leximed = sys.modules.get("app")
+    if leximed is not None and leximed.shared_metrics is not None:
+        leximed.shared_metrics.flush()
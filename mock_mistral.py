@@ -0,0 +1,203 @@
+"""Local mock of the Mistral chat completions API for development, load tests and benchmarks.
+
+Run it next to the app and point MISTRAL_API_URL at it:
+
+    python mock_mistral.py --port 8081 --latency 0.5
+    MISTRAL_API_URL=http://127.0.0.1:8081/v1/chat/completions python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops connections under load-test concurrency
+    request_queue_size = 1024
+
+
+class MockMistralServer:
+    """Threaded HTTP server that answers /v1/chat/completions like Mistral does.
+
+    latency delays every response, token_delay spaces out streamed chunks, and the
+    first fail_first requests are answered with fail_status (plus Retry-After when set)
+    so retry behaviour can be exercised. A tail_fraction of requests take tail_latency
+    instead, for hedging, and models listed in model_errors always fail with that status.
+    With cut_stream_after set, streams close after that many chunks without sending [DONE].
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_delay=0.0,
+                 fail_first=0, fail_status=503, retry_after=None, api_key=None, model_latency=None,
+                 tail_fraction=0.0, tail_latency=0.0, model_errors=None, seed=None,
+                 cut_stream_after=None):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.api_key = api_key
+        self.model_latency = model_latency or {}  # Per-model latency overrides
+        self.tail_fraction = tail_fraction
+        self.tail_latency = tail_latency
+        self.model_errors = model_errors or {}  # model -> status it always fails with
+        self.cut_stream_after = cut_stream_after
+        self.model_counts = {}  # model -> requests received
+        self._random = random.Random(seed)
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._httpd = _MockHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _next_request_number(self):
+        with self._lock:
+            self.request_count += 1
+            return self.request_count
+
+    def _latency_for(self, model):
+        with self._lock:
+            self.model_counts[model] = self.model_counts.get(model, 0) + 1
+            slow = self.tail_fraction and self._random.random() < self.tail_fraction
+        return self.tail_latency if slow else self.model_latency.get(model, self.latency)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, so connection pooling is observable
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    data = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return self._send_json(400, {"message": "Invalid JSON body"})
+
+                if not self.path.endswith("/chat/completions"):
+                    return self._send_json(404, {"message": "Not found"})
+
+                number = server._next_request_number()
+                if server.api_key and self.headers.get("Authorization") != f"Bearer {server.api_key}":
+                    return self._send_json(401, {"message": "Unauthorized"})
+                if number <= server.fail_first:
+                    headers = {}
+                    if server.retry_after is not None:
+                        headers["Retry-After"] = str(server.retry_after)
+                    return self._send_json(server.fail_status, {"message": "Injected failure"}, headers)
+
+                model = data.get("model", "mistral-large-latest")
+                time.sleep(server._latency_for(model))
+                if model in server.model_errors:
+                    return self._send_json(server.model_errors[model], {"message": f"Injected failure for {model}"})
+
+                messages = data.get("messages") or [{"content": ""}]
+                prompt = messages[-1].get("content", "")
+                content = f"Mock answer from {model} to: {prompt[:80]}"
+                prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(content) // 4,
+                    "total_tokens": prompt_tokens + len(content) // 4,
+                }
+
+                if data.get("stream"):
+                    return self._stream(model, content, usage)
+                return self._send_json(200, {
+                    "id": f"mock-{number}",
+                    "object": "chat.completion",
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+            def _stream(self, model, content, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                words = content.split(" ")
+                self.close_connection = True
+                try:
+                    for i, word in enumerate(words):
+                        if i == server.cut_stream_after:
+                            return  # Drop the connection mid-answer
+                        delta = word if i == 0 else " " + word
+                        chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": delta}}]}
+                        if i == len(words) - 1:
+                            chunk["usage"] = usage
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        if server.token_delay:
+                            time.sleep(server.token_delay)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client stopped reading, e.g. a hedged request that lost
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock Mistral API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--fail-first", type=int, default=0, help="Fail this many requests first")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--api-key", default=None, help="Require this bearer token")
+    parser.add_argument("--tail-fraction", type=float, default=0.0, help="Fraction of requests that are slow")
+    parser.add_argument("--tail-latency", type=float, default=0.0, help="Latency of the slow requests")
+    args = parser.parse_args()
+
+    server = MockMistralServer(args.host, args.port, args.latency, args.token_delay,
+                               args.fail_first, args.fail_status, args.retry_after, args.api_key,
+                               tail_fraction=args.tail_fraction, tail_latency=args.tail_latency)
+    print(f"Mock Mistral API listening on {server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
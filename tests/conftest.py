@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LEXIMED_CACHE_DIR", tempfile.mkdtemp(prefix="leximed-tests-"))
@@ -0,0 +1,44 @@
+import pytest
+
+import app as leximed
+from mock_mistral import MockMistralServer
+
+
+@pytest.fixture
+def client(monkeypatch):
+    with MockMistralServer(latency=0.05) as mock:
+        monkeypatch.setattr(leximed, "MISTRAL_API_URL", mock.url)
+        yield leximed.app.test_client()
+
+
+def test_streamed_answer_holds_its_slot_until_closed(client):
+    response = client.post("/ask/stream", data={"query": "Is 140/90 high?"}, buffered=False)
+    assert leximed.text_lane.snapshot()["active"] == 1
+    body = b"".join(response.response)
+    response.close()
+    assert b"event: done" in body
+    assert leximed.text_lane.snapshot()["active"] == 0
+
+
+def test_full_job_queue_is_rejected_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(leximed.job_queue, "queue_depth", 0)
+    response = client.post("/jobs", data={"query": "Summarize the discharge letter."})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_full_ocr_lane_rejects_a_batch_before_reading_it(client, monkeypatch):
+    full = leximed.AdmissionLane("ocr", 1, 0, 0)
+    full.active = 1
+    monkeypatch.setattr(leximed, "ocr_lane", full)
+    # Had the body been parsed, this one would be answered 400 for having no documents
+    response = client.post("/ask/batch", data=b"not multipart" * 5000, content_type="multipart/form-data; boundary=x")
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+
+def test_lane_is_chosen_from_the_headers():
+    assert not leximed.may_carry_upload("application/x-www-form-urlencoded", 100000)
+    assert not leximed.may_carry_upload("multipart/form-data", 600)
+    assert leximed.may_carry_upload("multipart/form-data", 2 * 1024 * 1024)
+    assert leximed.may_carry_upload("multipart/form-data", None)
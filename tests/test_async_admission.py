@@ -0,0 +1,48 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import app as leximed
+import async_app
+from mock_mistral import MockMistralServer
+
+
+def test_hundreds_of_concurrent_text_asks_are_admitted(monkeypatch):
+    with MockMistralServer(latency=0.5) as mock:
+        monkeypatch.setattr(leximed, "MISTRAL_API_URL", mock.url)
+
+        async def run():
+            async with TestClient(TestServer(async_app.create_app())) as client:
+                async def ask(number):
+                    response = await client.post("/ask", data={"query": f"Is a potassium of {number} high?"})
+                    return response.status, await response.json()
+
+                return await asyncio.gather(*(ask(number) for number in range(300)))
+
+        results = asyncio.run(run())
+
+    assert [status for status, _ in results] == [200] * 300
+    assert not [body for _, body in results if "error" in body]
+
+
+def test_full_ocr_lane_rejects_a_batch_before_reading_it(monkeypatch):
+    async def read_batch_form(request):
+        pytest.fail("upload was read")
+
+    monkeypatch.setattr(async_app, "read_batch_form", read_batch_form)
+
+    async def run():
+        application = async_app.create_app()
+        application["lanes"]["ocr"] = full = async_app.AsyncAdmissionLane("ocr", 1, 0, 0)
+        full.active = 1
+        async with TestClient(TestServer(application)) as client:
+            form = aiohttp.FormData()
+            form.add_field("documents", b"120/80\n" * 5000, filename="vitals.txt")
+            response = await client.post("/ask/batch", data=form)
+            return response.status, response.headers.get("Retry-After")
+
+    status, retry_after = asyncio.run(run())
+
+    assert status == 429 and retry_after
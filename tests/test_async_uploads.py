@@ -0,0 +1,50 @@
+import asyncio
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+
+import app as leximed
+import async_app
+
+
+def post_batch(monkeypatch, chunked):
+    monkeypatch.setattr(leximed, "BATCH_MAX_BYTES", 64 * 1024)
+
+    async def run():
+        form = aiohttp.FormData()
+        form.add_field("query", "List the readings.")
+        for number in range(3):
+            form.add_field("documents", b"120/80\n" * 5000, filename=f"vitals-{number}.txt")
+        body = form()
+        if chunked:
+            body = aiohttp.payload.AsyncIterablePayload(chunks(body), content_type=body.content_type)
+        async with TestClient(TestServer(async_app.create_app())) as client:
+            response = await client.post("/ask/batch", data=body)
+            return response.status, await response.json()
+
+    async def chunks(payload):
+        writer = Collect()
+        await payload.write(writer)
+        for start in range(0, len(writer.data), 8192):
+            yield writer.data[start:start + 8192]
+
+    return asyncio.run(run())
+
+
+class Collect:
+    def __init__(self):
+        self.data = b""
+
+    async def write(self, chunk):
+        self.data += chunk
+
+
+def test_batch_over_the_byte_limit_is_rejected(monkeypatch):
+    status, body = post_batch(monkeypatch, chunked=False)
+    assert status == 413
+    assert body["error"].startswith("Request too large")
+
+
+def test_chunked_batch_over_the_byte_limit_is_rejected(monkeypatch):
+    status, body = post_batch(monkeypatch, chunked=True)
+    assert status == 413
@@ -0,0 +1,42 @@
+import threading
+import time
+
+import fitz  # PyMuPDF
+
+import app as leximed
+
+
+def test_summaries_share_the_batch_llm_slots(tmp_path, monkeypatch):
+    monkeypatch.setattr(leximed, "BATCH_LLM_CONCURRENCY", 2)
+    monkeypatch.setattr(leximed, "DOCUMENT_TOKEN_BUDGET", 300)
+    monkeypatch.setattr(leximed, "CHUNK_TOKEN_BUDGET", 200)
+    in_flight, peak = 0, 0
+    lock = threading.Lock()
+
+    def call_mistral_api(prompt, model=None, max_tokens=1024, temperature=None):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.02)
+        with lock:
+            in_flight -= 1
+        return "Summary."
+
+    monkeypatch.setattr(leximed, "call_mistral_api", call_mistral_api)
+    uploads = []
+    for number in range(4):
+        doc = fitz.open()
+        for page_number in range(4):
+            page = doc.new_page()
+            text = " ".join(f"Visit {number}.{page_number} note {line}: potassium {line}.1 mmol/L." for line in range(30))
+            page.insert_textbox(fitz.Rect(40, 40, 570, 800), text, fontsize=9)
+        path = str(tmp_path / f"chart-{number}.pdf")
+        doc.save(path)
+        doc.close()
+        uploads.append((f"chart-{number}.pdf", path, leximed.document_id_for(path), "pdf", None))
+
+    results = list(leximed.run_batch("List the potassium readings.", "medical", uploads))
+
+    assert all("response" in result for result in results)
+    assert peak <= 2
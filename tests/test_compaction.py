@@ -0,0 +1,47 @@
+import app as leximed
+
+
+def test_edge_lines_with_different_numbers_are_kept():
+    pages = [f"Discharge Summary\n\nPatient stable on review.\n\nBlood pressure: {reading} mmHg"
+             for reading in ("120/80", "180/110", "70/40")]
+
+    text = leximed.compact_document_text(leximed.PAGE_BREAK.join(pages))
+
+    for reading in ("120/80", "180/110", "70/40"):
+        assert f"Blood pressure: {reading} mmHg" in text
+
+
+def test_repeated_headers_and_page_numbers_are_dropped():
+    header = "MERCY GENERAL HOSPITAL - Discharge Summary - MRN 0048213"
+    pages = [f"{header}\n\nVisit {number} notes for the attending physician.\n\n- {number} -"
+             for number in range(1, 4)]
+
+    text = leximed.compact_document_text(leximed.PAGE_BREAK.join(pages))
+
+    assert text.count(header) == 1
+    assert "- 2 -" not in text
+    assert all(f"Visit {number} notes" in text for number in range(1, 4))
+
+
+def test_clause_markers_are_not_ocr_noise():
+    for marker in ("(a)", "§ 4(a)", "1.", "A"):
+        assert not leximed.is_ocr_noise(marker)
+    for speckle in ("~", "' . ,", "|| —_", ";:"):
+        assert leximed.is_ocr_noise(speckle)
+    assert leximed.is_ocr_noise("~~ ;; || -- ,, a")
+
+
+def test_units_and_fractions_survive_normalization():
+    text = leximed.compact_document_text(
+        "WBC 7.2 x 10⁹/L, platelets 250 x 10³/µL\n\nBSA 1.73 m², dose ½ tablet\n\n"
+        "The ﬁnal report （signed）")
+
+    assert "10⁹/L" in text and "10³/µL" in text
+    assert "1.73 m²" in text and "½ tablet" in text
+    assert "The final report (signed)" in text
+
+
+def test_result_markers_between_lines_are_kept():
+    text = leximed.compact_document_text("HIV antibody\n-\nHepatitis B surface antigen\n+\nSyphilis RPR\n—\n\n.\n\n~")
+
+    assert text.split("\n") == ["HIV antibody", "-", "Hepatitis B surface antigen", "+", "Syphilis RPR", "—"]
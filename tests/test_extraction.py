@@ -0,0 +1,65 @@
+import fitz  # PyMuPDF
+
+import app as leximed
+
+
+def make_pdf(pages):
+    """Build a PDF with one list of (y, text) lines per page."""
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page(width=612, height=792)
+        for y, text in lines:
+            page.insert_text((72, y), text, fontsize=11)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_layout_keeps_body_blocks_whose_numbers_change():
+    readings = ["95", "182", "240"]
+    pdf = make_pdf([[(40, "Riverside Clinical Laboratory - Patient Report"),
+                     (200, f"Fasting glucose: {value} mg/dL"),
+                     (770, f"Page {number + 1} of 3")]
+                    for number, value in enumerate(readings)])
+
+    pages = leximed.extract_pdf_pages(pdf, "layout")
+
+    for page, value in zip(pages, readings):
+        assert f"Fasting glucose: {value} mg/dL" in page["text"]
+    assert "Page" not in "".join(page["text"] for page in pages)
+    assert sum("Riverside" in page["text"] for page in pages) == 1
+
+
+def test_layout_drops_identical_body_boilerplate():
+    disclaimer = "Results must be interpreted by a qualified physician."
+    pdf = make_pdf([[(200, f"Reading {number}"), (600, disclaimer)] for number in range(3)])
+
+    text = leximed.extract_text_from_pdf(pdf, "layout")
+
+    assert text.count(disclaimer) == 1
+    assert all(f"Reading {number}" in text for number in range(3))
+
+
+def test_margin_readings_are_kept_but_dated_footers_dropped():
+    readings = ["4.1", "6.8", "2.9"]
+    pdf = make_pdf([[(200, f"Metabolic panel, draw {number + 1}, reviewed by the attending."),
+                     (750, f"Potassium {value} mmol/L (critical)"),
+                     (775, f"Printed 0{number + 1}/05/2024 10:3{number} - Page {number + 1} of 3")]
+                    for number, value in enumerate(readings)])
+
+    text = leximed.extract_text_from_pdf(pdf, "layout")
+
+    for value in readings:
+        assert f"Potassium {value} mmol/L (critical)" in text
+    assert text.count("Printed") == 1
+
+
+def test_short_page_with_running_header_is_not_sent_to_ocr():
+    header = "Riverside Clinical Laboratory - Patient Report"
+    pdf = make_pdf([[(40, header), (200, "Findings are summarized on the following pages of this report.")],
+                    [(40, header), (200, "Signed: Dr. A. Reyes")]])
+
+    pages = leximed.extract_pdf_pages(pdf, "layout")
+
+    assert pages[1]["text"] == "Signed: Dr. A. Reyes"
+    assert not any(page["needs_ocr"] for page in pages)
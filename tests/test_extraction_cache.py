@@ -0,0 +1,47 @@
+import os
+
+import app as leximed
+
+
+def test_memory_tier_keeps_recently_used_entries(tmp_path):
+    cache = leximed.TwoTierCache(str(tmp_path / "cache"), 2, 1024 * 1024)
+    cache.set("aa1", "first")
+    cache.set("bb2", "second")
+    assert cache.get("aa1") == "first"  # Promoted past bb2
+    cache.set("cc3", "third")
+    assert list(cache._memory) == ["aa1", "cc3"]
+    assert cache.get("bb2") == "second"
+    assert cache.stats["disk_hits"] == 1
+
+
+def test_disk_tier_evicts_least_recently_used_by_size(tmp_path):
+    cache = leximed.TwoTierCache(str(tmp_path / "cache"), 0, 2500)
+    for number, key in enumerate(["aa1", "bb2", "cc3"]):
+        cache.set(key, "x" * 1000)
+        os.utime(cache._path(key), (number, number))
+    assert cache.get("aa1") is None
+    assert cache.get("bb2") == "x" * 1000
+    assert cache.stats["evictions"] == 1
+    assert cache.snapshot()["disk_bytes"] == 2000
+
+
+def test_rewritten_entry_is_counted_once(tmp_path):
+    cache = leximed.TwoTierCache(str(tmp_path / "cache"), 0, 2100)
+    cache.set("aa1", "x" * 1000)
+    cache.set("bb2", "y" * 1000)
+    cache.set("bb2", "y" * 1000)
+    assert cache.snapshot()["disk_bytes"] == 2000
+    assert cache.stats["evictions"] == 0
+    assert cache.get("aa1") == "x" * 1000
+
+
+def test_failed_extraction_is_not_cached(tmp_path, monkeypatch):
+    cache = leximed.TwoTierCache(str(tmp_path / "cache"), 8, 1024 * 1024)
+    monkeypatch.setattr(leximed, "extraction_cache", cache)
+    results = iter(["Error processing image: engine unavailable", "Potassium 4.1 mmol/L"])
+    monkeypatch.setattr(leximed, "extract_text_from_image", lambda source, profile: next(results))
+    upload = b"\x89PNG scan"
+    assert leximed.extract_document_text(upload, "image").startswith("Error")
+    assert leximed.extract_document_text(upload, "image") == "Potassium 4.1 mmol/L"
+    assert leximed.extract_document_text(upload, "image") == "Potassium 4.1 mmol/L"
+    assert cache.stats["memory_hits"] == 1
@@ -0,0 +1,40 @@
+import app as leximed
+
+
+def test_budget_allows_its_fraction_of_calls():
+    budget = leximed.HedgeBudget(0.05)
+    for _ in range(110):
+        budget.earn()
+    assert [budget.spend() for _ in range(6)] == [True] * 5 + [False]
+
+
+def test_latency_is_kept_per_bucket(monkeypatch):
+    stats = leximed.ModelStats(300)
+    monkeypatch.setattr(leximed, "model_stats", stats)
+    summary = leximed.latency_bucket(leximed.mistral_request_body("Summarize this page.", max_tokens=300))
+    answer = leximed.latency_bucket(leximed.mistral_request_body("Summarize this page."))
+    assert summary != answer
+    for _ in range(leximed.HEDGE_MIN_SAMPLES):
+        stats.record("large", "complete", 1.0, True, summary)
+        stats.record("large", "complete", 8.0, True, answer)
+    assert leximed.hedge_delay("large", "complete", summary) == 1.0
+    assert leximed.hedge_delay("large", "complete", answer) == 8.0
+    assert leximed.hedge_delay("large", "stream", answer) is None  # Too few samples to hedge on
+
+
+def test_short_questions_leave_a_slow_small_tier(monkeypatch):
+    stats = leximed.ModelStats(300)
+    monkeypatch.setattr(leximed, "model_stats", stats)
+    prompt = "Is 140/90 high?"
+    bucket = leximed.latency_bucket(leximed.mistral_request_body(prompt))
+    for _ in range(leximed.ROUTER_MIN_SAMPLES):
+        stats.record(leximed.MISTRAL_SMALL_MODEL, "complete", 1.5, True, bucket)
+        stats.record(leximed.MISTRAL_LARGE_MODEL, "complete", 1.0, True, bucket)
+    assert leximed.route_model("general", prompt) == leximed.MISTRAL_SMALL_MODEL
+    for _ in range(leximed.ROUTER_MIN_SAMPLES):
+        stats.record(leximed.MISTRAL_SMALL_MODEL, "complete", 6.0, True, bucket)
+    assert leximed.route_model("general", prompt) == leximed.MISTRAL_LARGE_MODEL
+    # Document analysis stays on the large tier however the latencies compare
+    for _ in range(3 * leximed.ROUTER_MIN_SAMPLES):
+        stats.record(leximed.MISTRAL_LARGE_MODEL, "complete", 30.0, True, bucket)
+    assert leximed.route_model("medical", prompt, has_document=True) == leximed.MISTRAL_LARGE_MODEL
@@ -0,0 +1,84 @@
+import sqlite3
+import time
+
+import pytest
+
+import app as leximed
+from mock_mistral import MockMistralServer
+
+
+@pytest.fixture
+def queue(tmp_path):
+    # No workers, so jobs stay where the test puts them; the database directory does not exist yet
+    return leximed.JobQueue(str(tmp_path / "db" / "jobs.sqlite3"), str(tmp_path / "files"), 0, 32)
+
+
+def status(queue, job_id):
+    return queue.get(job_id)["status"]
+
+
+def test_identical_in_flight_jobs_are_deduplicated(queue):
+    job_id, deduplicated = queue.submit("Summarize the letter.", "medical")
+    assert not deduplicated
+    assert queue.submit("Summarize the letter.", "medical") == (job_id, True)
+    assert queue.submit("Summarize the letter.", "legal")[1] is False
+
+    # The partial unique index holds even when the in-flight check is bypassed
+    dedupe_key = queue._connect().execute("SELECT dedupe_key FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    with pytest.raises(sqlite3.IntegrityError):
+        with queue._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, dedupe_key, status, created_at, updated_at, last_seen) "
+                         "VALUES ('other', ?, 'queued', 0, 0, 0)", (dedupe_key,))
+
+    assert queue.cancel(job_id)
+    assert queue.submit("Summarize the letter.", "medical")[0] != job_id
+
+
+def test_cancelled_job_is_not_run(queue):
+    job_id, _ = queue.submit("Summarize the letter.", "medical")
+    assert queue.cancel(job_id)
+    assert not queue.cancel(job_id)
+    assert status(queue, job_id) == leximed.JobQueue.CANCELLED
+    assert queue._claim() is None
+
+
+def test_job_is_abandoned_when_nobody_polls(queue, monkeypatch):
+    job_id, _ = queue.submit("Summarize the letter.", "medical")
+    assert queue._claim()["id"] == job_id
+    queue._report(job_id, "extract", 1, 3)
+    monkeypatch.setattr(leximed, "JOB_ABANDON_SECONDS", -1)
+    with pytest.raises(leximed.JobCancelled):
+        queue._report(job_id, "extract", 2, 3)
+    job = queue.get(job_id)
+    assert job["status"] == leximed.JobQueue.CANCELLED
+    assert job["error"].startswith("Job abandoned")
+
+
+def test_stale_running_job_is_requeued(queue, monkeypatch):
+    job_id, _ = queue.submit("Summarize the letter.", "medical")
+    assert queue._claim()["id"] == job_id
+    assert queue._claim() is None
+    monkeypatch.setattr(leximed, "JOB_STALE_SECONDS", -1)
+    assert queue._claim()["id"] == job_id
+
+
+def test_full_queue_is_rejected(queue):
+    queue.queue_depth = 1
+    queue.submit("Summarize the letter.", "medical")
+    with pytest.raises(leximed.AdmissionRejected) as rejected:
+        queue.submit("Summarize the discharge note.", "medical")
+    assert rejected.value.status == 429
+    assert rejected.value.retry_after >= 1
+
+
+def test_worker_runs_a_job_against_the_mock(tmp_path, monkeypatch):
+    queue = leximed.JobQueue(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "files"), 1, 32)
+    with MockMistralServer(latency=0.05) as mock:
+        monkeypatch.setattr(leximed, "MISTRAL_API_URL", mock.url)
+        job_id, _ = queue.submit("Is 140/90 high?", "medical")
+        deadline = time.time() + 10
+        while status(queue, job_id) in leximed.JobQueue.IN_FLIGHT and time.time() < deadline:
+            time.sleep(0.05)
+    job = queue.get(job_id)
+    assert job["status"] == leximed.JobQueue.DONE, job["error"]
+    assert mock.request_count == 1
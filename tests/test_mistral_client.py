@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+import app as leximed
+from mock_mistral import MockMistralServer
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waited, sleep, caller = [], leximed.time.sleep, threading.current_thread()
+
+    def record(seconds):
+        # The mock sleeps on its own threads to simulate latency; only the client's backoff is recorded
+        if threading.current_thread() is caller:
+            waited.append(seconds)
+        else:
+            sleep(seconds)
+
+    monkeypatch.setattr(leximed.time, "sleep", record)
+    return waited
+
+
+def post(mock, monkeypatch):
+    monkeypatch.setattr(leximed, "MISTRAL_API_URL", mock.url)
+    return leximed._post_mistral(leximed.mistral_request_body("Is 140/90 high?"))
+
+
+def test_retries_until_success(monkeypatch, sleeps):
+    with MockMistralServer(fail_first=2, fail_status=503) as mock:
+        response = post(mock, monkeypatch)
+    assert response.status_code == 200
+    assert mock.request_count == 3
+    assert len(sleeps) == 2
+
+
+def test_retry_after_is_honoured(monkeypatch, sleeps):
+    with MockMistralServer(fail_first=1, fail_status=429, retry_after=3) as mock:
+        post(mock, monkeypatch)
+    assert sleeps == [3]
+
+
+def test_retry_after_beyond_the_wait_limit_is_not_slept(monkeypatch, sleeps):
+    monkeypatch.setattr(leximed, "MISTRAL_MAX_RETRY_WAIT", 2)
+    with MockMistralServer(fail_first=1, fail_status=429, retry_after=60) as mock:
+        with pytest.raises(leximed.MistralRateLimitError) as error:
+            post(mock, monkeypatch)
+    assert error.value.retry_after == 60
+    assert mock.request_count == 1
+    assert sleeps == []
+
+
+def test_rejected_key_raises_auth_error(monkeypatch, sleeps):
+    monkeypatch.setattr(leximed, "MISTRAL_API_KEY", "wrong")
+    with MockMistralServer(api_key="right") as mock:
+        with pytest.raises(leximed.MistralAuthError) as error:
+            post(mock, monkeypatch)
+    assert error.value.status_code == 401
+    assert mock.request_count == 1
+
+
+def test_slow_response_raises_timeout_error(monkeypatch, sleeps):
+    monkeypatch.setattr(leximed, "MISTRAL_READ_TIMEOUT", 0.1)
+    monkeypatch.setattr(leximed, "MISTRAL_MAX_RETRIES", 0)
+    with MockMistralServer(latency=0.5) as mock:
+        with pytest.raises(leximed.MistralTimeoutError):
+            post(mock, monkeypatch)
@@ -0,0 +1,95 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+import app as leximed
+import async_app
+from mock_mistral import MockMistralServer
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = leximed.MemoryResponseCache(100, 3600)
+    monkeypatch.setattr(leximed, "response_cache", cache)
+    return cache
+
+
+def key(prompt, **overrides):
+    data = leximed.mistral_request_body(prompt, temperature=0)
+    data.update(overrides)
+    return leximed.response_cache_key(data)
+
+
+def test_rephrased_spacing_and_punctuation_share_a_key(cache):
+    assert key("Is 140/90 high?") == key("  is 140/90\n HIGH ") == key("Is 140/90 high?!")
+    assert key("Is 140/90 high?") != key("Is 150/90 high?")
+
+
+def test_request_settings_are_part_of_the_key(cache, monkeypatch):
+    monkeypatch.setattr(leximed, "RESPONSE_CACHE_ALLOW_SAMPLING", True)
+    base = key("Is 140/90 high?")
+    assert base != key("Is 140/90 high?", model=leximed.MISTRAL_SMALL_MODEL)
+    assert base != key("Is 140/90 high?", temperature=0.7)
+    assert base != key("Is 140/90 high?", max_tokens=300)
+
+
+def test_sampled_requests_bypass_the_cache(cache):
+    bypassed = leximed.response_cache_stats["bypassed"]
+    assert key("Is 140/90 high?", temperature=0.7) is None
+    assert leximed.response_cache_stats["bypassed"] == bypassed + 1
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_entries_expire_after_the_ttl(tmp_path, backend):
+    def create(ttl):
+        if backend == "memory":
+            return leximed.MemoryResponseCache(100, ttl)
+        return leximed.SQLiteResponseCache(str(tmp_path / "responses.sqlite3"), 100, ttl)
+
+    fresh = create(3600)
+    fresh.set("k", "Yes, 140/90 is high.")
+    assert fresh.get("k") == "Yes, 140/90 is high."
+    expired = create(-1)
+    expired.set("k", "Yes, 140/90 is high.")
+    assert expired.get("k") is None
+
+
+def test_interrupted_stream_is_not_cached(cache, monkeypatch):
+    with MockMistralServer(cut_stream_after=2) as mock:
+        monkeypatch.setattr(leximed, "MISTRAL_API_URL", mock.url)
+        received = []
+        with pytest.raises(leximed.MistralConnectionError):
+            for delta in leximed.call_mistral_api_stream("Is 140/90 high?", temperature=0):
+                received.append(delta)
+        assert len(received) == 2
+
+        # A reader that stops early doesn't leave a partial answer behind either
+        stream = leximed.call_mistral_api_stream("Is 140/90 high?", temperature=0)
+        next(stream)
+        stream.close()
+    assert not cache._entries
+
+
+def test_interrupted_async_stream_is_not_cached(cache, monkeypatch):
+    monkeypatch.setattr(leximed, "RESPONSE_CACHE_ALLOW_SAMPLING", True)
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            client = async_app.AsyncMistralClient(session)
+            async for _ in client.stream("Is 140/90 high?"):
+                pass
+
+    with MockMistralServer(cut_stream_after=2) as mock:
+        monkeypatch.setattr(leximed, "MISTRAL_API_URL", mock.url)
+        with pytest.raises(leximed.MistralConnectionError):
+            asyncio.run(run())
+    assert not cache._entries
+
+
+def test_complete_stream_is_cached(cache, monkeypatch):
+    with MockMistralServer() as mock:
+        monkeypatch.setattr(leximed, "MISTRAL_API_URL", mock.url)
+        answer = "".join(leximed.call_mistral_api_stream("Is 140/90 high?", temperature=0))
+        assert "".join(leximed.call_mistral_api_stream("is 140/90 high", temperature=0)) == answer
+        assert mock.request_count == 1
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+
+import pytest
+
+import app as leximed
+
+CHART = "\n\n".join([
+    "Admission note: patient reports chest pain and shortness of breath overnight.",
+    "Labs: potassium 5.9 mmol/L, potassium repeated 6.1 mmol/L, potassium critical.",
+    "Medications: lisinopril 10 mg daily, aspirin 81 mg daily, atorvastatin nightly.",
+    "Plan: recheck potassium in the morning and hold lisinopril.",
+])
+DOCUMENT_ID = "ab" * 32
+
+
+@pytest.fixture(autouse=True)
+def index_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(leximed, "RETRIEVAL_CHUNK_TOKENS", 20)
+    monkeypatch.setattr(leximed, "_loaded_indexes", OrderedDict())
+    cache = leximed.TwoTierCache(str(tmp_path / "index"), 8, 1024 * 1024)
+    monkeypatch.setattr(leximed, "index_cache", cache)
+    return cache
+
+
+def test_search_ranks_the_best_chunks_first():
+    index = leximed.DocumentIndex.build(CHART)
+    assert len(index.chunks) == 4
+    assert index.search("potassium lisinopril", 3) == [3, 1, 2]
+    assert index.search("potassium", 2) == [1, 3]
+    assert index.search("magnesium", 2) == [0, 1]  # No match falls back to the start of the document
+
+
+def test_passages_are_returned_in_document_order():
+    leximed.index_document(DOCUMENT_ID, CHART)
+    passages = leximed.retrieve_passages(DOCUMENT_ID, "potassium lisinopril", top_k=2)
+    assert passages.index("[Passage 2/4] Labs") < passages.index("[Passage 4/4] Plan")
+    assert "Medications" not in passages
+
+
+@pytest.mark.parametrize("document_id", ["../" + "ab" * 31, "AB" * 32, "ab" * 31, ""])
+def test_invalid_document_id_is_rejected(document_id, index_cache):
+    assert leximed.retrieve_passages(document_id, "potassium") is None
+    assert index_cache.stats["misses"] == 0  # Never looked up on disk
+
+
+def test_index_is_kept_per_profile_and_text_mode(monkeypatch):
+    leximed.index_document(DOCUMENT_ID, CHART, "fast")
+    assert leximed.retrieve_passages(DOCUMENT_ID, "potassium", ocr_profile="accurate") is None
+    assert leximed.retrieve_passages(DOCUMENT_ID, "potassium", ocr_profile="fast") is not None
+    assert leximed.retrieve_passages(DOCUMENT_ID, "potassium") is not None  # Any profile when none is asked for
+    monkeypatch.setattr(leximed, "PDF_TEXT_MODE", "plain")
+    monkeypatch.setattr(leximed, "_loaded_indexes", OrderedDict())
+    assert leximed.retrieve_passages(DOCUMENT_ID, "potassium") is None
@@ -0,0 +1,34 @@
+import app as leximed
+
+
+def test_unsaved_sessions_expire_first(tmp_path, monkeypatch):
+    store = leximed.SessionStore(str(tmp_path / "sessions.sqlite3"))
+    monkeypatch.setattr(leximed, "SESSION_UNSAVED_RETENTION_SECONDS", -1)
+    saved, unsaved, promoted = store.create(), store.create(saved=False), store.create(saved=False)
+    assert store.set_saved(promoted, True)
+    store.create()
+    assert store.get(saved) is not None
+    assert store.get(unsaved) is None
+    assert store.get(promoted) is not None
+
+
+def test_store_creates_its_directory(tmp_path):
+    store = leximed.SessionStore(str(tmp_path / "db" / "sessions.sqlite3"))
+    assert store.get(store.create()) is not None
+
+
+def test_turn_for_deleted_session_is_not_stored(tmp_path):
+    store = leximed.SessionStore(str(tmp_path / "sessions.sqlite3"))
+    session_id = store.create(saved=False)
+    store.delete(session_id)
+    store.add_turn(session_id, "What was my last reading?", "140/90.")
+    assert store.messages(session_id) == []
+
+
+def test_session_routes_take_the_save_flag():
+    client = leximed.app.test_client()
+    session_id = client.post("/sessions", data={"save": "0"}).json["session_id"]
+    assert client.get(f"/sessions/{session_id}").json["saved"] is False
+    assert client.patch(f"/sessions/{session_id}", data={"save": "1"}).json["saved"] is True
+    assert client.get(f"/sessions/{session_id}").json["saved"] is True
+    assert client.patch("/sessions/missing", data={"save": "1"}).status_code == 404